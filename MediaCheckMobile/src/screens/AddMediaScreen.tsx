@@ -1,10 +1,10 @@
-import React, { useState } from 'react';
+import React, { useEffect, useState } from 'react';
 import { View, Text, StyleSheet, TextInput, TouchableOpacity, ScrollView, Alert } from 'react-native';
 import { StackNavigationProp } from '@react-navigation/stack';
 import { RootStackParamList } from '../types/navigation';
 import { Media, MediaType } from '../types';
 import { addMedia, addUserMedia, deleteMedia } from '../services/database';
-import { addMediaToAPI, addUserMediaToAPI, deleteMediaFromAPI } from '../services/api';
+import { addMediaToAPI, addUserMediaToAPI, deleteMediaFromAPI, autocompleteMediaTitles, TitleSuggestion } from '../services/api';
 import { MediaState } from '../types';
 
 type AddMediaScreenNavigationProp = StackNavigationProp<RootStackParamList, 'AddMedia'>;
@@ -23,6 +23,20 @@ export const AddMediaScreen: React.FC<Props> = ({ navigation }) => {
     quotes: [],
   });
   const [loading, setLoading] = useState(false);
+  const [suggestions, setSuggestions] = useState<TitleSuggestion[]>([]);
+
+  // Show existing titles while typing so users don't create duplicates
+  useEffect(() => {
+    const query = media.title?.trim() ?? '';
+    if (query.length < 2) {
+      setSuggestions([]);
+      return;
+    }
+    const timer = setTimeout(async () => {
+      setSuggestions(await autocompleteMediaTitles(query, media.media_type));
+    }, 200);
+    return () => clearTimeout(timer);
+  }, [media.title, media.media_type]);
 
   const handleSubmit = async () => {
     if (!media.title || !media.media_type) {
@@ -153,6 +167,16 @@ export const AddMediaScreen: React.FC<Props> = ({ navigation }) => {
           onChangeText={(text) => setMedia({ ...media, title: text })}
           placeholder="Enter title"
         />
+        {suggestions.length > 0 && (
+          <View style={styles.suggestions}>
+            <Text style={styles.suggestionsHint}>Already in the catalog:</Text>
+            {suggestions.map((suggestion) => (
+              <Text key={suggestion.id} style={styles.suggestionText}>
+                {suggestion.title} ({suggestion.rating_count} ratings)
+              </Text>
+            ))}
+          </View>
+        )}
 
         <Text style={styles.label}>Media Type *</Text>
         <View style={styles.typeButtons}>
@@ -239,6 +263,20 @@ const styles = StyleSheet.create({
     borderWidth: 1,
     borderColor: '#ddd',
   },
+  suggestions: {
+    backgroundColor: '#fff8e1',
+    padding: 8,
+    borderRadius: 4,
+    marginTop: 4,
+  },
+  suggestionsHint: {
+    color: '#666',
+    marginBottom: 4,
+  },
+  suggestionText: {
+    color: '#333',
+    paddingVertical: 2,
+  },
   textArea: {
     height: 100,
     textAlignVertical: 'top',
@@ -14,14 +14,9 @@ import {
 // Using the computer's IP address instead of localhost
 const API_URL = 'http://192.168.1.155:8000';
 
-// Helper function to check if we're online
+// Helper function to check if we're online, answered by the cached /health/ check
 const isOnline = async (): Promise<boolean> => {
-  try {
-    const response = await fetch(`${API_URL}/health/`);
-    return response.ok;
-  } catch {
-    return false;
-  }
+  return (await getSyncCursors()) !== null;
 };
 
 const userExists = async (username: string): Promise<boolean> => {
@@ -33,6 +28,42 @@ const userExists = async (username: string): Promise<boolean> => {
   }
 };
 
+export interface SyncCursors {
+  catalog: number;
+  user?: number;
+}
+
+// One /health/ response serves both isOnline and the sync cursors for a few seconds,
+// so a burst of API calls doesn't pay an extra round trip each
+const HEALTH_CACHE_MS = 5000;
+let lastHealth: { at: number; token: string | null; cursors: SyncCursors | null } | null = null;
+
+// Current sync cursors, null when the backend is unreachable; they only grow when the
+// catalog or this user's collection changed
+export const getSyncCursors = async (): Promise<SyncCursors | null> => {
+  const token = await AsyncStorage.getItem('userToken');
+  if (lastHealth && lastHealth.token === token && Date.now() - lastHealth.at < HEALTH_CACHE_MS) {
+    return lastHealth.cursors;
+  }
+  let cursors: SyncCursors | null = null;
+  try {
+    const response = await fetch(`${API_URL}/health/`, {
+      headers: {
+        ...(token ? { 'Authorization': `Token ${token}` } : {}),
+        'Accept': 'application/json'
+      }
+    });
+    if (response.ok) {
+      const data = await response.json();
+      cursors = { catalog: data.catalog, user: data.user };
+    }
+  } catch {
+    cursors = null;
+  }
+  lastHealth = { at: Date.now(), token, cursors };
+  return cursors;
+};
+
 // Auth operations
 export const register = async (username: string, password: string): Promise<void> => {
   if (!await isOnline()) {
@@ -86,21 +117,62 @@ export const login = async (username: string, password: string): Promise<string>
 };
 
 // Media operations
-export const getMediaFromAPI = async (): Promise<Media[]> => {
-  if (!await isOnline()) {
-    return getMedia();
-  }
+// Fetch only the given media, e.g. ones referenced by user media but missing locally.
+// The local catalog only holds the media of the user's collection, so the app never
+// downloads the whole catalog; new titles are found through autocomplete.
+const MEDIA_BATCH_SIZE = 1000;  // Below the server's MEDIA_BATCH_MAX_IDS
+
+export const getMediaByIdsFromAPI = async (ids: number[]): Promise<{ media: Media[]; missing: number[] }> => {
   const token = await AsyncStorage.getItem('userToken');
-  const response = await fetch(`${API_URL}/api/media/`, {
-    headers: {
-      'Authorization': `Token ${token}`,
-      'Accept': 'application/json'
+  const media: Media[] = [];
+  const missing: number[] = [];
+  for (let start = 0; start < ids.length; start += MEDIA_BATCH_SIZE) {
+    const response = await fetch(`${API_URL}/api/media/batch/`, {
+      method: 'POST',
+      headers: {
+        'Authorization': `Token ${token}`,
+        'Content-Type': 'application/json',
+        'Accept': 'application/json'
+      },
+      body: JSON.stringify({ ids: ids.slice(start, start + MEDIA_BATCH_SIZE) })
+    });
+    if (!response.ok) {
+      throw new Error('Failed to fetch media');
     }
-  });
-  if (!response.ok) {
-    throw new Error('Failed to fetch media');
+    // Rows are lists of values in the order of fields; ids the server doesn't know are listed as missing
+    const data: { fields: string[]; rows: unknown[][]; missing: number[] } = await response.json();
+    for (const row of data.rows) {
+      media.push(Object.fromEntries(data.fields.map((field, index) => [field, row[index]])) as unknown as Media);
+    }
+    missing.push(...data.missing);
+  }
+  return { media, missing };
+};
+
+export interface TitleSuggestion {
+  id: number;
+  title: string;
+  media_type: string;
+  rating_count: number;
+}
+
+export const autocompleteMediaTitles = async (query: string, mediaType?: string): Promise<TitleSuggestion[]> => {
+  const token = await AsyncStorage.getItem('userToken');
+  const params = new URLSearchParams({ q: query });
+  if (mediaType) {
+    params.append('media_type', mediaType);
+  }
+  try {
+    const response = await fetch(`${API_URL}/api/media/autocomplete/?${params}`, {
+      headers: {
+        'Authorization': `Token ${token}`,
+        'Accept': 'application/json'
+      }
+    });
+    return response.ok ? response.json() : [];
+  } catch {
+    return [];
   }
-  return response.json();
 };
 
 export const addMediaToAPI = async (media: Media): Promise<Media> => {
@@ -171,6 +171,35 @@ export const addMedia = async (media: Media): Promise<void> => {
   });
 };
 
+export const updateMedia = async (media: Media): Promise<void> => {
+  return new Promise((resolve, reject) => {
+    // Ensure we have a valid ID
+    if (!media.id) {
+      reject(new Error('Media ID is required'));
+      return;
+    }
+
+    db.runAsync(
+      `UPDATE media
+       SET title = ?, media_type = ?, plot = ?, chapters = ?, quotes = ?
+       WHERE id = ?;`,
+      [
+        media.title,
+        media.media_type,
+        media.plot ?? null,
+        media.chapters ?? null,
+        media.quotes ? JSON.stringify(media.quotes) : null,
+        media.id
+      ] as SQLiteBindParams
+    ).then(() => {
+      resolve();
+    }).catch((error) => {
+      console.error('Error updating media:', error);
+      reject(error);
+    });
+  });
+};
+
 // UserMedia operations
 export const getUserMedia = async (): Promise<UserMedia[]> => {
   return new Promise((resolve, reject) => {
@@ -294,10 +323,14 @@ export const getMediaWithUserData = async (): Promise<MediaWithUserData[]> => {
 
 export const deleteMedia = async (id: number): Promise<void> => {
   return new Promise((resolve, reject) => {
+    // Its user media go with it, as on the server
     db.runAsync(
+      `DELETE FROM user_media WHERE media_id = ?;`,
+      [id]
+    ).then(() => db.runAsync(
       `DELETE FROM media WHERE id = ?;`,  // Use id instead of server_id
       [id]
-    ).then(() => {
+    )).then(() => {
       console.log('Media deleted successfully from local database');
       resolve();
     }).catch((error) => {
@@ -4,6 +4,11 @@ import * as database from './database';
 import * as api from './api';
 
 const LAST_SYNC_KEY = 'last_sync_timestamp';
+const SYNC_CURSORS_KEY = 'sync_cursors';
+
+interface SyncedCursors extends api.SyncCursors {
+  username: string;
+}
 
 export const syncData = async (): Promise<void> => {
   try {
@@ -14,10 +19,30 @@ export const syncData = async (): Promise<void> => {
     try {
       // Try to sync with API
       await syncOfflineUsers();
-      await syncMedia(lastSyncTime);
-      await syncUserMedia(lastSyncTime);
-      // Update last sync timestamp only if sync was successful
+
+      // Skip whatever didn't change since the last sync, according to the server's cursors
+      const cursors = await api.getSyncCursors();
+      const currentUser = await database.getCurrentUser();
+      const storedCursors = await AsyncStorage.getItem(SYNC_CURSORS_KEY);
+      const synced: SyncedCursors | null = storedCursors ? JSON.parse(storedCursors) : null;
+      const sameUser = synced !== null && currentUser !== null && synced.username === currentUser.username;
+      const catalogChanged = !cursors || !sameUser || cursors.catalog !== synced.catalog;
+      const userChanged = !cursors || cursors.user === undefined || !sameUser || cursors.user !== synced.user;
+
+      // The collection first: it fetches only the media it references that we don't have
+      // yet, so the refresh only needs the media we had before
+      const knownMediaIds = (await database.getMedia()).map(media => media.id).filter((id): id is number => id !== undefined);
+      if (userChanged) {
+        await syncUserMedia(lastSyncTime);
+      }
+      if (catalogChanged) {
+        await refreshMedia(knownMediaIds);
+      }
+      // Update last sync timestamp and cursors only if sync was successful
       await AsyncStorage.setItem(LAST_SYNC_KEY, new Date().toISOString());
+      if (cursors && currentUser) {
+        await AsyncStorage.setItem(SYNC_CURSORS_KEY, JSON.stringify({ ...cursors, username: currentUser.username }));
+      }
     } catch (error) {
       console.warn('API sync failed, using local data:', error);
       // Don't throw error, just use local data
@@ -54,32 +79,19 @@ const syncOfflineUsers = async (): Promise<void> => {
   }
 };
 
-const syncMedia = async (lastSyncTime: Date): Promise<void> => {
+// Pick up server-side edits and deletions of the media we have, without pulling the whole catalog
+const refreshMedia = async (mediaIds: number[]): Promise<void> => {
   try {
-    // Get media from API
-    const apiMedia = await api.getMediaFromAPI();
-    
-    // Get local media
-    const localMedia = await database.getMedia();
-
-    // Create a map of local media by ID
-    const localMediaMap = new Map(localMedia.map(media => [media.id, media]));
-
-    // Process each media item from API
-    for (const media of apiMedia) {
-      const localMedia = localMediaMap.get(media.id);
-      
-      if (!localMedia) {
-        // New media from API, add to local database
-        await database.addMedia(media);
-      } else if (media.created_at && new Date(media.created_at) > lastSyncTime) {
-        // Media updated on API, update local database
-        // Note: You'll need to implement an updateMedia function in database.ts
-        // await database.updateMedia(media);
-      }
+    const { media, missing } = await api.getMediaByIdsFromAPI(mediaIds);
+    for (const item of media) {
+      await database.updateMedia(item);
+    }
+    for (const mediaId of missing) {
+      // Deleted on the server, which took its user media with it
+      await database.deleteMedia(mediaId);
     }
   } catch (error) {
-    console.warn('Error syncing media:', error);
+    console.warn('Error refreshing media:', error);
     throw error; // Let the caller handle this
   }
 };
@@ -95,8 +107,21 @@ const syncUserMedia = async (lastSyncTime: Date): Promise<void> => {
     // Create a map of local user media by media_id
     const localUserMediaMap = new Map(localUserMedia.map(um => [um.media_id, um]));
 
+    // Fetch just the media we don't have yet, instead of the whole catalog
+    const localMediaIds = new Set((await database.getMedia()).map(media => media.id));
+    const missingMediaIds = [...new Set(
+      apiUserMedia
+        .map(userMedia => userMedia.media_id ?? userMedia.media?.id)
+        .filter((mediaId): mediaId is number => mediaId !== undefined && !localMediaIds.has(mediaId))
+    )];
+    for (const media of (await api.getMediaByIdsFromAPI(missingMediaIds)).media) {
+      await database.addMedia(media);
+    }
+
     // Process each user media item from API
-    for (const userMedia of apiUserMedia) {
+    for (const apiEntry of apiUserMedia) {
+      // The API nests the media instead of returning media_id
+      const userMedia = { ...apiEntry, media_id: apiEntry.media_id ?? apiEntry.media?.id };
       if (!userMedia.media_id) {
         console.warn('Skipping user media with missing media_id:', userMedia);
         continue;
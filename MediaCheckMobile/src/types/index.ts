@@ -24,6 +24,10 @@ export interface Media {
   quotes?: string[];
   score?: number;
   created_at?: string;
+  rating_count?: number;
+  rating_avg?: number | null;
+  user_state?: MediaState | null;
+  user_score?: number | null;
 }
 
 export interface UserMedia {
@@ -1,6 +1,183 @@
-from django.contrib import admin
-from .models import User, Media, UserMedia
+from django.contrib import admin, messages
+from django.core.paginator import Paginator
+from django.db import connection, transaction
+from django.db.models import Count, IntegerField, Max, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django.utils.functional import cached_property
+
+from . import cursors, stats
+from .autocomplete import title_index
+from .cache import media_cache
+from .events import event_log
+from .live import publish_media_score, publish_user_media
+from .models import User, Media, UserMedia, normalize_title
 
 admin.site.register(User)
-admin.site.register(Media)
-admin.site.register(UserMedia)
\ No newline at end of file
+
+
+def estimated_count(model):
+    """Cheap row count estimate: ANALYZE statistics when present, else the highest primary key"""
+    table = model._meta.db_table
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1 FROM sqlite_master WHERE name = %s', ['sqlite_stat1'])
+            if cursor.fetchone():
+                # Each row of a table starts with a row count: the table's for full indexes
+                # (or the idx IS NULL row of a table without any), fewer for partial ones
+                cursor.execute('SELECT MAX(CAST(stat AS INTEGER)) FROM sqlite_stat1 WHERE tbl = %s', [table])
+                row = cursor.fetchone()
+                if row and row[0] is not None:
+                    return row[0]
+    return model.objects.aggregate(top=Max('pk'))['top'] or 0
+
+
+def recompute_and_publish(media_ids):
+    """Recompute scores in bulk, then invalidate and publish the changed ones like update_score() does.
+
+    Returns (media_id, old_score, new_score) of each changed media.
+    """
+    before = dict(Media.objects.filter(pk__in=media_ids).values_list('pk', 'score'))
+    changes = []
+    if Media.recompute_scores(media_ids=media_ids):
+        for media_id, score in Media.objects.filter(pk__in=media_ids).values_list('pk', 'score'):
+            if score != before.get(media_id):
+                changes.append((media_id, before.get(media_id), score))
+                transaction.on_commit(lambda media_id=media_id: media_cache.invalidate(media_id))
+                publish_media_score(media_id, score)
+    return changes
+
+
+class EstimatedCountPaginator(Paginator):
+    """Avoids COUNT(*) over large tables in the changelist.
+
+    Unfiltered lists use estimated_count(); filtered ones count at most
+    MAX_COUNT rows, which is as far as anyone pages anyway.
+    """
+    MAX_COUNT = 10000
+
+    @cached_property
+    def count(self):
+        query = self.object_list.query
+        if not query.where:
+            return estimated_count(self.object_list.model)
+        return self.object_list.order_by().values('pk')[:self.MAX_COUNT].count()
+
+
+class TitlePrefixSearchMixin:
+    """Search titles by prefix on normalized_title, which the unique constraint indexes"""
+    normalized_title_lookup = 'normalized_title'
+
+    def get_search_results(self, request, queryset, search_term):
+        term = normalize_title(search_term)
+        if not term:
+            return queryset, False
+        # A range instead of LIKE, so SQLite can use the index
+        lookup = self.normalized_title_lookup
+        condition = Q(**{f'{lookup}__gte': term, f'{lookup}__lt': term + '\U0010ffff'})
+        return queryset.filter(condition | self.extra_search(search_term.strip())), False
+
+    def extra_search(self, search_term):
+        return Q(pk__in=[])
+
+
+@admin.register(Media)
+class MediaAdmin(TitlePrefixSearchMixin, admin.ModelAdmin):
+    list_display = ['title', 'media_type', 'score', 'rating_count', 'created_at']
+    list_filter = ['media_type']
+    search_fields = ['title']
+    search_help_text = 'Title prefix, ignoring case and punctuation'
+    show_full_result_count = False
+    paginator = EstimatedCountPaginator
+    actions = ['recompute_selected_scores']
+
+    def get_queryset(self, request):
+        # A correlated subquery only runs for the rows of the page, unlike a joined COUNT
+        ratings = UserMedia.objects.filter(
+            media=OuterRef('pk'), score__isnull=False
+        ).order_by().values('media').annotate(count=Count('pk')).values('count')
+        return super().get_queryset(request).annotate(
+            rating_count=Coalesce(Subquery(ratings, output_field=IntegerField()), 0)
+        )
+
+    @admin.display(description='Ratings', ordering='rating_count')
+    def rating_count(self, media):
+        return media.rating_count
+
+    @admin.action(description='Recompute scores of selected media')
+    def recompute_selected_scores(self, request, queryset):
+        media_ids = list(queryset.values_list('pk', flat=True))
+        with transaction.atomic():
+            changes = recompute_and_publish(media_ids)
+            # Bulk statements bypass the per-write deltas
+            stats.bulk_changed(score_changes=changes)
+        self.message_user(request, f'Recomputed scores, {len(changes)} changed.', messages.SUCCESS)
+
+
+@admin.register(UserMedia)
+class UserMediaAdmin(TitlePrefixSearchMixin, admin.ModelAdmin):
+    list_display = ['user', 'media', 'state', 'score', 'updated_at']
+    list_filter = ['state']
+    list_select_related = ['user', 'media']
+    raw_id_fields = ['user', 'media']
+    search_fields = ['media__title', 'user__username']
+    search_help_text = 'Media title prefix or exact username'
+    normalized_title_lookup = 'media__normalized_title'
+    show_full_result_count = False
+    paginator = EstimatedCountPaginator
+    actions = ['mark_check', 'mark_checked', 'mark_viewing', 'mark_done']
+
+    def extra_search(self, search_term):
+        return Q(user__username=search_term)
+
+    def set_state(self, request, queryset, state):
+        """Change the state of the selected entries with one UPDATE, logging the changes as events"""
+        values = {'state': state, 'updated_at': timezone.now()}
+        if state == UserMedia.MediaState.CHECK:
+            values['score'] = None
+
+        with transaction.atomic():
+            # The old values are only needed for the event log
+            rows = list(queryset.values_list('user_id', 'media_id', 'state', 'score'))
+            queryset.update(**values)
+
+            rating_changes = [
+                (media_id, old_score, values.get('score', old_score))
+                for _, media_id, _, old_score in rows
+                if values.get('score', old_score) != old_score
+            ]
+            if rating_changes:
+                score_changes = recompute_and_publish([media_id for media_id, _, _ in rating_changes])
+                # Bulk statements bypass the per-write deltas
+                stats.bulk_changed(rating_changes, score_changes)
+
+            for user_id in {row[0] for row in rows}:
+                cursors.user_changed(user_id)
+            # What UserMedia.save() does per entry
+            for user_id, media_id, old_state, old_score in rows:
+                new_score = values.get('score', old_score)
+                if old_score != new_score:
+                    title_index.rating_changed(media_id, old_score, new_score)
+                if old_state != state or old_score != new_score:
+                    entry = UserMedia(user_id=user_id, media_id=media_id, state=state, score=new_score)
+                    event_log.record(entry, old_state, old_score)
+                    publish_user_media(entry)
+
+        label = UserMedia.MediaState(state).label
+        self.message_user(request, f'Set {len(rows)} entries to {label}.', messages.SUCCESS)
+
+    @admin.action(description='Set selected entries to Check (clears their rating)')
+    def mark_check(self, request, queryset):
+        self.set_state(request, queryset, UserMedia.MediaState.CHECK)
+
+    @admin.action(description='Set selected entries to Checked')
+    def mark_checked(self, request, queryset):
+        self.set_state(request, queryset, UserMedia.MediaState.CHECKED)
+
+    @admin.action(description='Set selected entries to Viewing')
+    def mark_viewing(self, request, queryset):
+        self.set_state(request, queryset, UserMedia.MediaState.VIEWING)
+
+    @admin.action(description='Set selected entries to Done')
+    def mark_done(self, request, queryset):
+        self.set_state(request, queryset, UserMedia.MediaState.DONE)
@@ -0,0 +1,220 @@
+import heapq
+import threading
+import time
+from bisect import bisect_left, insort
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from .models import Media, normalize_title
+
+
+def _index_keys(normalized):
+    """Every suffix of the title that starts a word, so prefix search also finds infix words"""
+    return [
+        normalized[position:]
+        for position in range(len(normalized))
+        if position == 0 or normalized[position - 1] == ' '
+    ]
+
+
+class TitleIndex:
+    """In-memory sorted index of normalized media titles answering prefix and infix lookups.
+
+    One sorted list of (key, media_id) per media type is searched with bisect.
+    Writes in this process update the index through signals; the whole index is
+    rebuilt in the background after MEDIA_AUTOCOMPLETE_TTL seconds to pick up
+    writes from other workers.
+
+    Every match is ranked, so results are the true top N. Queries matching
+    more than CACHE_THRESHOLD keys (short prefixes on a large catalog) keep
+    their top CACHE_SIZE until a write touches one of their titles. The
+    one-character queries, the widest ranges, are ranked when the index is
+    loaded so no request pays for them.
+    """
+
+    CACHE_THRESHOLD = 1000
+    # The endpoint's largest limit
+    CACHE_SIZE = 50
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._entries = {}
+        self._media = {}
+        self._ranked = {}
+        self._built_at = None
+        self._rebuilding = False
+
+    def _is_fresh(self):
+        ttl = getattr(settings, 'MEDIA_AUTOCOMPLETE_TTL', 300)
+        return self._built_at is not None and time.monotonic() - self._built_at < ttl
+
+    def build(self):
+        """Load every title and its rating count with one query"""
+        rows = Media.objects.with_rating_stats().order_by().values_list(
+            'id', 'title', 'media_type', 'normalized_title', 'rating_count'
+        )
+        self.load(rows)
+
+    def load(self, rows):
+        """Replace the index with (id, title, media_type, normalized_title, rating_count) rows"""
+        entries = {media_type: [] for media_type in Media.MediaType.values}
+        media = {}
+        for media_id, title, media_type, normalized, rating_count in rows:
+            media[media_id] = [title, media_type, normalized, rating_count]
+            entries.setdefault(media_type, []).extend((key, media_id) for key in _index_keys(normalized))
+        ranked = {}
+        for media_type, keys in entries.items():
+            keys.sort()
+            start = 0
+            while start < len(keys):
+                prefix = keys[start][0][:1]
+                end = bisect_left(keys, (prefix + '\uffff',), start)
+                if end - start > self.CACHE_THRESHOLD:
+                    ranked[(media_type, prefix)] = self._rank(keys, start, end, prefix, self.CACHE_SIZE, media)
+                start = end
+
+        with self._lock:
+            self._entries = entries
+            self._media = media
+            self._ranked = ranked
+            self._built_at = time.monotonic()
+
+    def _rebuild_in_background(self):
+        """Keep answering from the stale index while a fresh one is loaded"""
+        with self._lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+
+        def rebuild():
+            try:
+                self.build()
+            finally:
+                self._rebuilding = False
+                connection.close()
+
+        threading.Thread(target=rebuild, daemon=True).start()
+
+    def search(self, query, media_type=None, limit=10):
+        """Return up to `limit` matching media ordered by rating count"""
+        normalized_query = normalize_title(query or '')
+        if not normalized_query:
+            return []
+        if self._built_at is None:
+            self.build()
+        elif not self._is_fresh():
+            self._rebuild_in_background()
+
+        with self._lock:
+            media_types = [media_type] if media_type else list(self._entries)
+            candidates = []
+            for current_type in media_types:
+                keys = self._entries.get(current_type, [])
+                # Every key starting with the query sorts between these two bounds
+                start = bisect_left(keys, (normalized_query,))
+                end = bisect_left(keys, (normalized_query + '\uffff',), start)
+                if end - start > self.CACHE_THRESHOLD and limit <= self.CACHE_SIZE:
+                    ranked = self._ranked.get((current_type, normalized_query))
+                    if ranked is None:
+                        ranked = self._rank(keys, start, end, normalized_query, self.CACHE_SIZE)
+                        self._ranked[(current_type, normalized_query)] = ranked
+                else:
+                    ranked = self._rank(keys, start, end, normalized_query, limit)
+                candidates.extend(ranked)
+
+            results = []
+            for _, media_id in heapq.nsmallest(limit, candidates):
+                title, current_type, _, rating_count = self._media[media_id]
+                results.append({'id': media_id, 'title': title, 'media_type': current_type, 'rating_count': rating_count})
+        return results
+
+    def _rank(self, keys, start, end, normalized_query, limit, media=None):
+        """Best (sort key, media_id) pairs among keys[start:end]: most rated, then title prefix matches"""
+        media = self._media if media is None else media
+        seen = set()
+        ranked = []
+        for index in range(start, end):
+            media_id = keys[index][1]
+            if media_id in seen:
+                continue
+            seen.add(media_id)
+            title, _, normalized, rating_count = media[media_id]
+            ranked.append(((-rating_count, not normalized.startswith(normalized_query), title.lower()), media_id))
+        return heapq.nsmallest(limit, ranked)
+
+    def _forget_rankings(self, media_type, normalized):
+        """Drop the cached rankings of every query that matches this title"""
+        if not self._ranked:
+            return
+        for key in _index_keys(normalized):
+            for length in range(1, len(key) + 1):
+                self._ranked.pop((media_type, key[:length]), None)
+
+    def add(self, media):
+        """Insert or refresh one media entry"""
+        with self._lock:
+            if self._built_at is None:
+                return
+            previous = self._media.get(media.pk)
+            if previous and previous[0] == media.title and previous[1] == media.media_type:
+                # Score recomputes save the media without touching the title
+                return
+            rating_count = previous[3] if previous else 0
+            self._remove_keys(media.pk)
+            normalized = media.normalized_title
+            self._forget_rankings(media.media_type, normalized)
+            self._media[media.pk] = [media.title, media.media_type, normalized, rating_count]
+            keys = self._entries.setdefault(media.media_type, [])
+            for key in _index_keys(normalized):
+                insort(keys, (key, media.pk))
+
+    def remove(self, media_id):
+        with self._lock:
+            self._remove_keys(media_id)
+            self._media.pop(media_id, None)
+
+    def rating_changed(self, media_id, old_score, new_score):
+        """Apply a rating count delta once the transaction commits, like stats.rating_changed"""
+        delta = (new_score is not None) - (old_score is not None)
+        if delta:
+            transaction.on_commit(lambda: self._add_ratings(media_id, delta))
+
+    def _add_ratings(self, media_id, delta):
+        with self._lock:
+            entry = self._media.get(media_id)
+            if entry is None:
+                return
+            entry[3] = max(0, entry[3] + delta)
+            title, media_type, normalized, rating_count = entry
+            if delta < 0:
+                # Something outside the cached top N may now rank higher
+                self._forget_rankings(media_type, normalized)
+                return
+            # A gained rating can only move the media up, so cached rankings are patched in place
+            for key in _index_keys(normalized):
+                for length in range(1, len(key) + 1):
+                    query = key[:length]
+                    ranked = self._ranked.get((media_type, query))
+                    if ranked is None:
+                        continue
+                    item = ((-rating_count, not normalized.startswith(query), title.lower()), media_id)
+                    kept = [pair for pair in ranked if pair[1] != media_id]
+                    if len(kept) < len(ranked) or len(ranked) < self.CACHE_SIZE or item < ranked[-1]:
+                        insort(kept, item)
+                        self._ranked[(media_type, query)] = kept[:self.CACHE_SIZE]
+
+    def _remove_keys(self, media_id):
+        previous = self._media.get(media_id)
+        if not previous:
+            return
+        _, media_type, normalized, _ = previous
+        self._forget_rankings(media_type, normalized)
+        keys = self._entries.get(media_type, [])
+        for key in _index_keys(normalized):
+            position = bisect_left(keys, (key, media_id))
+            if position < len(keys) and keys[position] == (key, media_id):
+                del keys[position]
+
+
+title_index = TitleIndex()
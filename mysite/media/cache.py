@@ -0,0 +1,135 @@
+import copy
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from django.conf import settings
+
+
+def _copy(media):
+    """Copy of a cached object with its own lists and dicts (JSON fields, change tracking), cheaper than deepcopy"""
+    clone = copy.copy(media)
+    for name, value in clone.__dict__.items():
+        if isinstance(value, (list, dict)):
+            clone.__dict__[name] = copy.deepcopy(value)
+    return clone
+
+
+class MediaCache:
+    """Bounded read-through cache of Media objects by id.
+
+    Entries are evicted least recently used past MEDIA_CACHE_SIZE and expire
+    after MEDIA_CACHE_TTL seconds, which bounds staleness from writes made by
+    other processes. Saves and deletes in this process invalidate the id
+    through signals. Invalidations are numbered, so a read that raced with the
+    write can't store the old row; they are forgotten once no read that
+    started before them is still running.
+    Callers get their own copy of the object and may modify it freely, unless
+    they ask for the shared read-only objects.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        # media id -> generation of its last invalidation, oldest first
+        self._invalidated = OrderedDict()
+        self._generation = 0
+        self._cleared_at = 0
+        # Generation at which each running read started, and how many
+        self._reads = Counter()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def max_size(self):
+        return getattr(settings, 'MEDIA_CACHE_SIZE', 5000)
+
+    @property
+    def ttl(self):
+        return getattr(settings, 'MEDIA_CACHE_TTL', 30)
+
+    def get(self, media_id, readonly=False):
+        """Return the Media with this id, or None if it does not exist"""
+        return self.get_many([media_id], readonly).get(int(media_id))
+
+    def get_many(self, media_ids, readonly=False):
+        """Return {id: Media} for the ids that exist, loading all misses with one query.
+
+        With readonly=True the cached objects themselves are returned; the
+        caller must not modify them.
+        """
+        from .models import Media
+
+        media_ids = {int(media_id) for media_id in media_ids}
+        found = {}
+        now = time.monotonic()
+        with self._lock:
+            for media_id in media_ids:
+                entry = self._entries.get(media_id)
+                if entry is not None and entry[0] > now:
+                    self._entries.move_to_end(media_id)
+                    found[media_id] = entry[1]
+            self.hits += len(found)
+            missing = media_ids - found.keys()
+            self.misses += len(missing)
+            started = self._generation
+            if missing:
+                self._reads[started] += 1
+
+        if missing:
+            loaded = {}
+            try:
+                loaded = Media.objects.in_bulk(missing)
+            finally:
+                with self._lock:
+                    for media_id, media in loaded.items():
+                        # Skip objects that were saved or deleted while we were reading
+                        if self._cleared_at <= started and self._invalidated.get(media_id, 0) <= started:
+                            self._entries[media_id] = (now + self.ttl, media)
+                            self._entries.move_to_end(media_id)
+                    while len(self._entries) > self.max_size:
+                        self._entries.popitem(last=False)
+                    self._reads[started] -= 1
+                    if not self._reads[started]:
+                        del self._reads[started]
+                    self._prune()
+            found.update(loaded)
+
+        if readonly:
+            return found
+        return {media_id: _copy(media) for media_id, media in found.items()}
+
+    def _prune(self):
+        """Forget invalidations that no running read started before"""
+        oldest = min(self._reads, default=self._generation)
+        while self._invalidated and next(iter(self._invalidated.values())) <= oldest:
+            self._invalidated.popitem(last=False)
+
+    def invalidate(self, media_id):
+        with self._lock:
+            self._generation += 1
+            self._invalidated[media_id] = self._generation
+            self._invalidated.move_to_end(media_id)
+            self._entries.pop(media_id, None)
+            self._prune()
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._cleared_at = self._generation
+            self._invalidated.clear()
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else None,
+            }
+
+
+media_cache = MediaCache()
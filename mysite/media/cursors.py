@@ -0,0 +1,73 @@
+import os
+from functools import lru_cache
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connection
+
+CATALOG = 'catalog'
+
+
+def user_key(user_id):
+    return f'user:{user_id}'
+
+
+def bump(key):
+    """Increment a cursor with one upsert statement, in the caller's transaction"""
+    from .models import SyncCursor
+
+    table = connection.ops.quote_name(SyncCursor._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {table} ("key", version) VALUES (%s, 1) '
+            f'ON CONFLICT ("key") DO UPDATE SET version = {table}.version + 1',
+            [key]
+        )
+
+
+def catalog_changed():
+    bump(CATALOG)
+
+
+def user_changed(user_id):
+    bump(user_key(user_id))
+
+
+def read(user_id=None):
+    """Current catalog cursor and, with a user id, that user's cursor, in one query"""
+    from .models import SyncCursor
+
+    keys = [CATALOG] if user_id is None else [CATALOG, user_key(user_id)]
+    table = connection.ops.quote_name(SyncCursor._meta.db_table)
+    # Raw SQL: building the ORM query costs more than running it on this hot path
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT "key", version FROM {table} WHERE "key" IN ({", ".join(["%s"] * len(keys))})', keys
+        )
+        versions = dict(cursor.fetchall())
+    cursors = {'catalog': versions.get(CATALOG, 0)}
+    if user_id is not None:
+        cursors['user'] = versions.get(user_key(user_id), 0)
+    return cursors
+
+
+@lru_cache(maxsize=None)
+def build_id():
+    """MEDIA_BUILD_ID, else the checked out git commit, else "dev"."""
+    configured = getattr(settings, 'MEDIA_BUILD_ID', None) or os.environ.get('MEDIA_BUILD_ID')
+    if configured:
+        return configured
+    git = Path(settings.BASE_DIR).parent / '.git'
+    try:
+        head = (git / 'HEAD').read_text().strip()
+        if head.startswith('ref: '):
+            ref = head[5:]
+            ref_path = git / ref
+            if ref_path.exists():
+                head = ref_path.read_text().strip()
+            else:
+                packed = (git / 'packed-refs').read_text().splitlines()
+                head = next(line.split()[0] for line in packed if line.endswith(f' {ref}'))
+        return head[:12]
+    except (OSError, StopIteration):
+        return 'dev'
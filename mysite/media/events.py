@@ -0,0 +1,85 @@
+import atexit
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+
+class EventLog:
+    """Buffers UserMediaEvent rows and writes them with bulk_create.
+
+    Events are buffered once their transaction commits and flushed when
+    MEDIA_EVENT_BATCH_SIZE is reached, by a timer MEDIA_EVENT_FLUSH_SECONDS
+    after the first buffered event, or when the process exits. A killed
+    process loses at most that window of events; the rollups are trends,
+    not an audit trail.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = []
+        self._timer = None
+
+    def record(self, user_media, old_state, old_score):
+        from .models import UserMediaEvent
+
+        event = UserMediaEvent(
+            user_id=user_media.user_id,
+            media_id=user_media.media_id,
+            old_state=old_state,
+            new_state=user_media.state,
+            old_score=old_score,
+            new_score=user_media.score,
+            created_at=timezone.now(),
+        )
+        transaction.on_commit(lambda: self._append(event))
+
+    def _append(self, event):
+        with self._lock:
+            self._pending.append(event)
+            due = len(self._pending) >= getattr(settings, 'MEDIA_EVENT_BATCH_SIZE', 100)
+            if not due and self._timer is None:
+                self._timer = threading.Timer(getattr(settings, 'MEDIA_EVENT_FLUSH_SECONDS', 5), self._flush_on_timer)
+                self._timer.daemon = True
+                self._timer.start()
+        if due:
+            self.flush()
+
+    def _flush_on_timer(self):
+        try:
+            self.flush()
+        finally:
+            # The timer thread opened its own connection
+            connection.close()
+
+    def flush(self):
+        with self._lock:
+            pending = self._pending
+            self._pending = []
+            timer, self._timer = self._timer, None
+        if timer is not None:
+            timer.cancel()
+        if not pending:
+            return
+
+        # A user or media deleted after the rating took its events with it; writing
+        # them now would fail the foreign key check for the whole batch. The write
+        # lock taken by the IMMEDIATE transaction keeps deletes out until the insert.
+        with transaction.atomic():
+            self._write(pending)
+
+    def _write(self, pending):
+        from .models import Media, User, UserMediaEvent
+
+        user_ids = set(User.objects.filter(pk__in={event.user_id for event in pending}).values_list('pk', flat=True))
+        media_ids = set(Media.objects.filter(pk__in={event.media_id for event in pending}).values_list('pk', flat=True))
+        UserMediaEvent.objects.bulk_create([
+            event for event in pending
+            if event.user_id in user_ids and event.media_id in media_ids
+        ])
+
+
+event_log = EventLog()
+atexit.register(event_log.flush)
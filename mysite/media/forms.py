@@ -1,10 +1,58 @@
 from django import forms
 from django.core.validators import URLValidator, MinLengthValidator
 from django.core.exceptions import ValidationError
-from .models import Media, UserMedia
-import re
+from .models import Media, UserMedia, normalize_title
+from bisect import bisect_left, bisect_right, insort
 from difflib import SequenceMatcher
 
+# Titles of the same type more similar than this are treated as potential duplicates
+SIMILAR_TITLE_RATIO = 0.85
+
+
+class TitleMatcher:
+    """Finds the titles more than SIMILAR_TITLE_RATIO similar to a normalized title.
+
+    Candidates are kept sorted by length: a SequenceMatcher ratio can never
+    beat 2 * shorter / total length, so only a window of lengths is compared.
+    """
+
+    def __init__(self, titles=()):
+        # (title, normalized_title) pairs
+        self._entries = sorted(((len(normalized), normalized, title) for title, normalized in titles))
+
+    def add(self, title, normalized_title):
+        insort(self._entries, (len(normalized_title), normalized_title, title))
+
+    def similar(self, normalized_title, limit=3):
+        """Up to limit (title, similarity) pairs, most similar first"""
+        length = len(normalized_title)
+        low = bisect_left(self._entries, length * SIMILAR_TITLE_RATIO / (2 - SIMILAR_TITLE_RATIO), key=lambda entry: entry[0])
+        high = bisect_right(self._entries, length * (2 - SIMILAR_TITLE_RATIO) / SIMILAR_TITLE_RATIO, key=lambda entry: entry[0])
+
+        # The matcher caches its second sequence, so that one stays the new title
+        matcher = SequenceMatcher(None, b=normalized_title)
+        similar_titles = []
+        for _, normalized_existing, existing_title in self._entries[low:high]:
+            matcher.set_seq1(normalized_existing)
+            if matcher.real_quick_ratio() <= SIMILAR_TITLE_RATIO or matcher.quick_ratio() <= SIMILAR_TITLE_RATIO:
+                continue
+            similarity = matcher.ratio()
+            if similarity > SIMILAR_TITLE_RATIO:
+                similar_titles.append((existing_title, similarity))
+        similar_titles.sort(key=lambda x: x[1], reverse=True)
+        return similar_titles[:limit]
+
+
+def similar_titles_message(similar_titles):
+    suggestions = [f"'{title}' ({similarity:.0%} similar)" for title, similarity in similar_titles]
+    return (
+        'This title is very similar to existing entries. '
+        'Please check if you meant one of these: ' + 
+        ', '.join(suggestions) +
+        '. If this is a different media, please make the title more distinct.'
+    )
+
+
 class MediaForm(forms.ModelForm):
     class Meta:
         model = Media
@@ -55,19 +103,11 @@ class MediaForm(forms.ModelForm):
             }),
         }
 
-    def _normalize_title(self, title):
-        """Normalize title for comparison"""
-        # Convert to lowercase
-        title = title.lower()
-        # Remove special characters and extra spaces
-        title = re.sub(r'[^\w\s]', '', title)
-        # Replace multiple spaces with single space
-        title = re.sub(r'\s+', ' ', title)
-        return title.strip()
-
-    def _similarity_ratio(self, str1, str2):
-        """Calculate similarity ratio between two strings"""
-        return SequenceMatcher(None, str1, str2).ratio()
+    def __init__(self, *args, check_catalog=True, **kwargs):
+        # check_catalog=False keeps validation free of database queries (bulk imports)
+        super().__init__(*args, **kwargs)
+        self.check_catalog = check_catalog
+        self.instance.check_catalog = check_catalog
 
     def clean_title(self):
         title = self.cleaned_data.get('title', '').strip()
@@ -81,50 +121,30 @@ class MediaForm(forms.ModelForm):
             raise ValidationError('Title is too long')
         if any(char.isdigit() for char in title) and len(title) < 5:
             raise ValidationError('Title seems too short for a numeric title')
+        return title
 
-        # Get media type for context
-        media_type = self.cleaned_data.get('media_type')
-        if not media_type:
-            return title
+    def clean(self):
+        cleaned_data = super().clean()
+        # Checked here rather than in clean_title: media_type is cleaned after the title
+        title = cleaned_data.get('title')
+        media_type = cleaned_data.get('media_type')
+        if not title or not media_type or not self.check_catalog:
+            return cleaned_data
 
         # Normalize the input title
-        normalized_title = self._normalize_title(title)
+        normalized_title = normalize_title(title)
         
-        # Get all existing titles of the same media type
+        # Get all existing titles of the same media type; exact matches are
+        # reported by Media.clean()
         existing_media = Media.objects.filter(media_type=media_type).exclude(
             pk=self.instance.pk if self.instance else None
-        )
-        
-        # Check for exact matches (case-insensitive)
-        exact_matches = existing_media.filter(title__iexact=title)
-        if exact_matches.exists():
-            raise ValidationError(
-                f'A {media_type} with this exact title already exists. '
-                'Please check if it\'s the same media.'
-            )
-        
-        # Check for similar titles
-        similar_titles = []
-        for media in existing_media:
-            normalized_existing = self._normalize_title(media.title)
-            similarity = self._similarity_ratio(normalized_title, normalized_existing)
-            
-            # If similarity is high (e.g., > 0.85), consider it a potential duplicate
-            if similarity > 0.85:
-                similar_titles.append((media.title, similarity))
+        ).exclude(normalized_title=normalized_title)
         
+        # Check for similar titles against the stored normalized titles
+        similar_titles = TitleMatcher(existing_media.values_list('title', 'normalized_title')).similar(normalized_title)
         if similar_titles:
-            # Sort by similarity
-            similar_titles.sort(key=lambda x: x[1], reverse=True)
-            suggestions = [f"'{title}' ({similarity:.0%} similar)" for title, similarity in similar_titles[:3]]
-            raise ValidationError(
-                'This title is very similar to existing entries. '
-                'Please check if you meant one of these: ' + 
-                ', '.join(suggestions) +
-                '. If this is a different media, please make the title more distinct.'
-            )
-        
-        return title
+            self.add_error('title', ValidationError(similar_titles_message(similar_titles)))
+        return cleaned_data
 
     def clean_url(self):
         url = self.cleaned_data.get('url', '').strip()
@@ -0,0 +1,146 @@
+import asyncio
+import itertools
+import json
+import threading
+import uuid
+from collections import deque
+
+from django.conf import settings
+from django.db import transaction
+
+CATALOG = 'catalog'
+
+
+def user_channel(user_id):
+    return f'user:{user_id}'
+
+
+class EventBroker:
+    """In-process pub/sub for server-sent events.
+
+    Events are kept in a bounded backlog so clients can resume from their
+    Last-Event-ID. Ids carry a per-process token: a client reconnecting to
+    another process, or further behind than the backlog reaches, gets a
+    ``reset`` event and should reload its lists. Subscribers don't get a
+    queue each. They share one asyncio.Event per event loop, replaced on every
+    publish, and read the backlog from their own cursor, so an idle connection
+    costs one suspended coroutine.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._token = uuid.uuid4().hex[:8]
+        self._sequence = itertools.count(1)
+        self._backlog = deque(maxlen=getattr(settings, 'MEDIA_LIVE_BACKLOG', 1000))
+        self._wakeups = {}
+
+    def publish(self, channel, event_type, data):
+        """Publish an event now; safe to call from any thread"""
+        payload = json.dumps(data, separators=(',', ':'))
+        with self._lock:
+            sequence = next(self._sequence)
+            text = f'id: {self._token}-{sequence}\nevent: {event_type}\ndata: {payload}\n\n'
+            self._backlog.append((sequence, channel, text))
+            loops = list(self._wakeups)
+        for loop in loops:
+            if loop.is_closed():
+                with self._lock:
+                    self._wakeups.pop(loop, None)
+            else:
+                loop.call_soon_threadsafe(self._wake, loop)
+
+    def _wake(self, loop):
+        # Subscribers wait on the event they took before reading the backlog, so none is missed
+        with self._lock:
+            event = self._wakeups.get(loop)
+            self._wakeups[loop] = asyncio.Event()
+        if event is not None:
+            event.set()
+
+    def publish_on_commit(self, channel, event_type, data):
+        transaction.on_commit(lambda: self.publish(channel, event_type, data))
+
+    def _cursor(self, last_event_id):
+        """Sequence to resume after, or None when the client has to reset"""
+        with self._lock:
+            latest = self._backlog[-1][0] if self._backlog else 0
+            oldest = self._backlog[0][0] if self._backlog else 1
+        if not last_event_id:
+            return latest
+        token, _, sequence = last_event_id.partition('-')
+        if token != self._token or not sequence.isdigit():
+            return None
+        sequence = int(sequence)
+        if sequence > latest or sequence < oldest - 1:
+            return None
+        return sequence
+
+    def _since(self, cursor, channels):
+        with self._lock:
+            pending = []
+            for sequence, channel, text in reversed(self._backlog):
+                if sequence <= cursor:
+                    break
+                if channel in channels:
+                    pending.append(text)
+            latest = self._backlog[-1][0] if self._backlog else cursor
+        pending.reverse()
+        return pending, latest
+
+    def _start(self, last_event_id):
+        """Cursor to read from, plus a reset frame when the client has to reload"""
+        cursor = self._cursor(last_event_id)
+        if cursor is not None:
+            return cursor, []
+        cursor = self._cursor(None)
+        return cursor, [f'id: {self._token}-{cursor}\nevent: reset\ndata: {{}}\n\n']
+
+    async def stream(self, channels, last_event_id=None):
+        """Yield SSE frames for the given channels until the client goes away"""
+        keepalive = getattr(settings, 'MEDIA_LIVE_KEEPALIVE_SECONDS', 15)
+        loop = asyncio.get_running_loop()
+
+        cursor, frames = self._start(last_event_id)
+        for text in frames:
+            yield text
+        # Tell EventSource how long to wait before reconnecting
+        yield 'retry: 3000\n\n'
+
+        while True:
+            with self._lock:
+                wakeup = self._wakeups.setdefault(loop, asyncio.Event())
+            pending, cursor = self._since(cursor, channels)
+            for text in pending:
+                yield text
+            try:
+                await asyncio.wait_for(wakeup.wait(), keepalive)
+            except asyncio.TimeoutError:
+                yield ': keepalive\n\n'
+
+    def poll(self, channels, last_event_id=None, retry=10):
+        """SSE frames published since last_event_id, for a response that ends right away.
+
+        EventSource reconnects after retry seconds with the id of the last
+        frame, which makes it poll without holding a server thread in between.
+        """
+        cursor, frames = self._start(last_event_id)
+        pending, cursor = self._since(cursor, channels)
+        # An id-only frame moves the client's Last-Event-ID even when nothing was pending
+        return [*frames, *pending, f'id: {self._token}-{cursor}\nretry: {int(retry * 1000)}\n\n']
+
+
+broker = EventBroker()
+
+
+def publish_user_media(user_media, deleted=False):
+    """Tell the owner's open streams about a collection change once it commits"""
+    data = {'media_id': user_media.media_id}
+    if not deleted:
+        data.update(state=user_media.state, score=user_media.score)
+    broker.publish_on_commit(
+        user_channel(user_media.user_id), 'collection.deleted' if deleted else 'collection', data
+    )
+
+
+def publish_media_score(media_id, score):
+    broker.publish_on_commit(CATALOG, 'score', {'media_id': media_id, 'score': score})
@@ -0,0 +1,133 @@
+import time
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from media import similarity
+from media.models import Media, MediaNeighbor
+
+
+class Command(BaseCommand):
+    help = 'Build the "more like this" neighbors of each media from TF-IDF vectors of plot and quotes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--k',
+            type=int,
+            default=10,
+            help='Neighbors stored per media'
+        )
+        parser.add_argument(
+            '--media-type',
+            type=str,
+            choices=Media.MediaType.values,
+            help='Only build neighbors for this media type'
+        )
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help='Rebuild every media instead of only media without neighbors yet'
+        )
+        parser.add_argument(
+            '--max-features',
+            type=int,
+            default=4096,
+            help='Vocabulary size per media type'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Rows per bulk_create'
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        media_types = [options['media_type']] if options['media_type'] else Media.MediaType.values
+        engine = 'NumPy' if similarity.np is not None else 'pure Python (NumPy is not installed)'
+        self.stdout.write(f'Scoring with {engine}.')
+
+        built = written = 0
+        for media_type in media_types:
+            media_count, row_count = self.build(media_type, options)
+            built += media_count
+            written += row_count
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Built neighbors of {built} media ({written} rows) in {elapsed:.2f}s.'
+        ))
+
+    def build(self, media_type, options):
+        """Neighbors are only searched within one media type"""
+        k = options['k']
+        ids, documents = [], []
+        for media_id, plot, quotes in Media.objects.filter(media_type=media_type).order_by('pk').values_list(
+            'pk', 'plot', 'quotes'
+        ).iterator(chunk_size=2000):
+            ids.append(media_id)
+            documents.append(similarity.media_terms(plot, quotes))
+        if len(ids) < 2:
+            return 0, 0
+
+        existing = defaultdict(list)
+        if not options['full']:
+            for media_id, neighbor_id, score in MediaNeighbor.objects.filter(
+                media__media_type=media_type
+            ).values_list('media_id', 'neighbor_id', 'score'):
+                existing[media_id].append((neighbor_id, score))
+
+        rows = [
+            row for row, media_id in enumerate(ids)
+            if documents[row] and (options['full'] or media_id not in existing)
+        ]
+        if not rows:
+            return 0, 0
+
+        vectors, dimensions = similarity.tfidf(documents, options['max_features'])
+        # Media without any vocabulary term can't have neighbors; leaving them out keeps them
+        # from being scored again on every incremental run (--full picks them up later)
+        rows = [row for row in rows if vectors[row]]
+        if not rows:
+            return 0, 0
+        floors = None
+        if not options['full']:
+            # An existing list only changes if a new media scores above its weakest neighbor
+            floors = [
+                min(score for _, score in existing[media_id]) if len(existing[media_id]) >= k else 0.0
+                for media_id in ids
+            ]
+        neighbors, reverse = similarity.nearest_neighbors(vectors, dimensions, rows, k, floors)
+
+        lists = {ids[row]: [(ids[other], score) for other, score in found] for row, found in neighbors.items()}
+        new_ids = set(lists)
+        for other, row, score in reverse:
+            media_id = ids[other]
+            if media_id in new_ids:
+                continue
+            candidates = lists.setdefault(media_id, list(existing[media_id]))
+            candidates.append((ids[row], score))
+        for media_id, candidates in lists.items():
+            if media_id not in new_ids:
+                candidates.sort(key=lambda item: -item[1])
+                del candidates[k:]
+
+        with transaction.atomic():
+            if options['full']:
+                MediaNeighbor.objects.filter(media__media_type=media_type).delete()
+            else:
+                rebuilt = list(lists)
+                for start in range(0, len(rebuilt), 500):
+                    MediaNeighbor.objects.filter(media_id__in=rebuilt[start:start + 500]).delete()
+            MediaNeighbor.objects.bulk_create(
+                [
+                    MediaNeighbor(media_id=media_id, neighbor_id=neighbor_id, score=score)
+                    for media_id, candidates in lists.items()
+                    for neighbor_id, score in candidates
+                ],
+                batch_size=options['batch_size']
+            )
+
+        row_count = sum(len(candidates) for candidates in lists.values())
+        self.stdout.write(f'{media_type}: {len(rows)} media scored, {len(lists) - len(new_ids)} lists updated.')
+        return len(lists), row_count
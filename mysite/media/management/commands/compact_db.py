@@ -0,0 +1,187 @@
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from media import cursors
+from media.live import publish_user_media
+from media.models import UserMedia
+
+
+def _pragma(name):
+    with connection.cursor() as cursor:
+        cursor.execute(f'PRAGMA {name}')
+        row = cursor.fetchone()
+    return row[0] if row else None
+
+
+class Command(BaseCommand):
+    help = (
+        'Delete UserMedia rows left in Check state without a score, in short batches, then run ANALYZE, '
+        'free pages with incremental VACUUM and checkpoint the WAL. Safe to run while the site is live.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Rows deleted per transaction; each one holds the write lock only briefly'
+        )
+        parser.add_argument(
+            '--pause',
+            type=float,
+            default=0.05,
+            help='Seconds to sleep between batches so other writers get the lock'
+        )
+        parser.add_argument(
+            '--analysis-limit',
+            type=int,
+            default=1000,
+            help='Rows ANALYZE samples per index (0 = read every row)'
+        )
+        parser.add_argument(
+            '--checkpoint',
+            choices=['passive', 'truncate'],
+            default='passive',
+            help='WAL checkpoint mode; truncate also shrinks the -wal file but waits for readers'
+        )
+        parser.add_argument(
+            '--enable-incremental-vacuum',
+            action='store_true',
+            help='Switch the database to auto_vacuum=INCREMENTAL with one full VACUUM, which locks it while it runs'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only count the rows that would be deleted'
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        dead = UserMedia.objects.filter(state=UserMedia.MediaState.CHECK, score__isnull=True)
+        if options['dry_run']:
+            self.stdout.write(f'{dead.count()} Check entries without a score would be deleted.')
+            return
+
+        sqlite = connection.vendor == 'sqlite'
+        before = self.database_size() if sqlite else None
+
+        deleted = self.delete_dead_rows(options['batch_size'], options['pause'])
+        self.stdout.write(f'Deleted {deleted} Check entries without a score.')
+        if not sqlite:
+            self.stdout.write('Not SQLite, skipping ANALYZE, VACUUM and checkpoint.')
+            return
+
+        self.analyze(options['analysis_limit'])
+        self.vacuum(options['enable_incremental_vacuum'], options['pause'])
+        self.checkpoint(options['checkpoint'])
+
+        after = self.database_size()
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            f"Pages in use: {before['used'] / 1024:.0f} KiB -> {after['used'] / 1024:.0f} KiB, "
+            f"free pages: {before['free'] / 1024:.0f} KiB -> {after['free'] / 1024:.0f} KiB."
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Reclaimed {(before['files'] - after['files']) / 1024:.0f} KiB on disk "
+            f"({before['files'] / 1024:.0f} KiB -> {after['files'] / 1024:.0f} KiB) in {elapsed:.2f}s."
+        ))
+
+    def delete_dead_rows(self, batch_size, pause):
+        """Walk the table by primary key, deleting one batch per short transaction"""
+        table = connection.ops.quote_name(UserMedia._meta.db_table)
+        pk_column = connection.ops.quote_name(UserMedia._meta.pk.column)
+        last_pk = deleted = 0
+        while True:
+            batch = list(
+                UserMedia.objects.filter(
+                    pk__gt=last_pk, state=UserMedia.MediaState.CHECK, score__isnull=True
+                ).order_by('pk').values_list('pk', 'user_id', 'media_id')[:batch_size]
+            )
+            if not batch:
+                return deleted
+            last_pk = batch[-1][0]
+            pks = [pk for pk, _, _ in batch]
+
+            with transaction.atomic():
+                # Conditions repeated: a row may have been rated since it was read
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        f'DELETE FROM {table} WHERE {pk_column} IN ({", ".join(["%s"] * len(pks))}) '
+                        f'AND state = %s AND score IS NULL',
+                        [*pks, UserMedia.MediaState.CHECK]
+                    )
+                    removed = cursor.rowcount
+                if removed:
+                    deleted += removed
+                    kept = set(UserMedia.objects.filter(pk__in=pks).values_list('pk', flat=True))
+                    # Raw SQL skips the per-row delete signals. These rows hold no rating, so
+                    # only the owners' sync cursors and open live streams need to hear about it.
+                    for pk, user_id, media_id in batch:
+                        if pk not in kept:
+                            publish_user_media(UserMedia(pk=pk, user_id=user_id, media_id=media_id), deleted=True)
+                    for user_id in {user_id for pk, user_id, _ in batch if pk not in kept}:
+                        cursors.user_changed(user_id)
+            if pause:
+                time.sleep(pause)
+
+    def analyze(self, analysis_limit):
+        started = time.monotonic()
+        with connection.cursor() as cursor:
+            # Sampling keeps ANALYZE, and the write lock it takes, short on big tables
+            cursor.execute(f'PRAGMA analysis_limit = {int(analysis_limit)}')
+            cursor.execute('ANALYZE')
+        self.stdout.write(f'ANALYZE done in {time.monotonic() - started:.2f}s.')
+
+    def vacuum(self, enable_incremental, pause, step=1000):
+        mode = _pragma('auto_vacuum')
+        if mode != 2 and enable_incremental:
+            self.stdout.write('Switching to auto_vacuum=INCREMENTAL, running a full VACUUM...')
+            with connection.cursor() as cursor:
+                cursor.execute('PRAGMA auto_vacuum = INCREMENTAL')
+                cursor.execute('VACUUM')
+            return
+        if mode != 2:
+            self.stdout.write(self.style.WARNING(
+                'auto_vacuum is not INCREMENTAL, so freed pages stay in the file for reuse. '
+                'Run once with --enable-incremental-vacuum at a quiet time to let later runs shrink it.'
+            ))
+            return
+
+        # A limited number of pages per statement, so writers can get in between
+        initial = free = _pragma('freelist_count')
+        connection.ensure_connection()
+        while free:
+            # The sqlite3 cursor steps a statement only once, which frees a single page;
+            # executescript() runs it to completion
+            connection.connection.executescript(f'PRAGMA incremental_vacuum({step})')
+            remaining = _pragma('freelist_count')
+            if remaining >= free:
+                break
+            free = remaining
+            if free and pause:
+                time.sleep(pause)
+        self.stdout.write(f'Incremental VACUUM released {initial - free} pages.')
+
+    def checkpoint(self, mode):
+        if _pragma('journal_mode') != 'wal':
+            self.stdout.write('Not in WAL mode, no checkpoint needed.')
+            return
+        with connection.cursor() as cursor:
+            cursor.execute(f'PRAGMA wal_checkpoint({mode.upper()})')
+            busy, log_pages, checkpointed = cursor.fetchone()
+        state = 'blocked by readers, ' if busy else ''
+        self.stdout.write(f'WAL checkpoint ({mode}): {state}{checkpointed}/{log_pages} frames written back.')
+
+    def database_size(self):
+        page_size = _pragma('page_size')
+        page_count = _pragma('page_count')
+        free = _pragma('freelist_count')
+        path = Path(connection.settings_dict['NAME'])
+        files = sum(
+            candidate.stat().st_size
+            for candidate in (path, Path(f'{path}-wal'))
+            if candidate.exists()
+        )
+        return {'used': (page_count - free) * page_size, 'free': free * page_size, 'files': files}
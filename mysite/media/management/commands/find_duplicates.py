@@ -0,0 +1,217 @@
+import csv
+import io
+import json
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from difflib import SequenceMatcher
+
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+from media.models import Media, normalize_title
+
+# Per-worker state, filled once by _init_worker instead of being pickled with every task
+_titles = []
+_gram_counts = []
+_postings = {}
+
+
+def _trigrams(title):
+    """Set of character trigrams of a normalized title, padded so short titles still get some"""
+    padded = f'  {title} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _init_worker(titles, postings):
+    global _titles, _gram_counts, _postings
+    _titles = titles
+    _gram_counts = [len(_trigrams(title)) for title in titles]
+    _postings = postings
+
+
+def _score_block(start, end, threshold, min_overlap):
+    """Score every candidate pair (i, j) with start <= i < end and i < j"""
+    matches = []
+    for i in range(start, end):
+        title = _titles[i]
+        grams = _trigrams(title)
+        gram_count = _gram_counts[i]
+
+        # Count shared trigrams with the titles after this one
+        shared = defaultdict(int)
+        for gram in grams:
+            for j in _postings.get(gram, ()):
+                if j > i:
+                    shared[j] += 1
+
+        for j, count in shared.items():
+            other = _titles[j]
+            # Dice coefficient on trigram sets as a cheap blocking filter
+            if 2 * count < min_overlap * (gram_count + _gram_counts[j]):
+                continue
+            # SequenceMatcher ratio can never beat 2 * shorter / total length
+            if 2 * min(len(title), len(other)) < threshold * (len(title) + len(other)):
+                continue
+            matcher = SequenceMatcher(None, title, other)
+            if matcher.quick_ratio() < threshold:
+                continue
+            similarity = matcher.ratio()
+            if similarity >= threshold:
+                matches.append((i, j, similarity))
+    return matches
+
+
+class Command(BaseCommand):
+    help = 'Find near-duplicate media titles across the catalog and write a ranked merge report'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--threshold',
+            type=float,
+            default=0.85,
+            help='Minimum similarity ratio to report a pair (same default as MediaForm)'
+        )
+        parser.add_argument(
+            '--min-overlap',
+            type=float,
+            default=0.4,
+            help='Minimum trigram overlap (Dice coefficient) for a pair to be scored at all'
+        )
+        parser.add_argument(
+            '--max-posting',
+            type=int,
+            default=5000,
+            help='Ignore trigrams shared by more titles than this when blocking'
+        )
+        parser.add_argument(
+            '--media-type',
+            type=str,
+            choices=Media.MediaType.values,
+            help='Only look for duplicates within this media type'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count() or 1,
+            help='Number of worker processes'
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=500,
+            help='Number of titles scored per worker task'
+        )
+        parser.add_argument(
+            '--format',
+            type=str,
+            choices=['csv', 'json'],
+            default='csv',
+            help='Report format'
+        )
+        parser.add_argument(
+            '--output',
+            type=str,
+            help='Report file (defaults to stdout)'
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+
+        media_qs = Media.objects.order_by('id')
+        if options['media_type']:
+            media_qs = media_qs.filter(media_type=options['media_type'])
+
+        # Block by media type: duplicates are only meaningful within one type. Only columns
+        # that exist before migration 0008 are read, and titles are normalized here, so the
+        # report also runs on a database where 0008 stopped at the duplicates it has to list.
+        blocks = defaultdict(list)
+        rows = media_qs.values('id', 'title', 'media_type', 'created_at').annotate(rating_count=Count('user_media__score'))
+        for media in rows:
+            media['normalized_title'] = normalize_title(media['title'])
+            blocks[media['media_type']].append(media)
+
+        pairs = []
+        for media_type, entries in blocks.items():
+            for i, j, similarity in self.score_block(entries, options):
+                pairs.append(self.merge_candidate(media_type, entries[i], entries[j], similarity))
+
+        pairs.sort(key=lambda pair: (-pair['similarity'], pair['keep_id'], pair['duplicate_id']))
+        self.write_report(pairs, options)
+
+        total = sum(len(entries) for entries in blocks.values())
+        elapsed = time.monotonic() - started
+        self.stderr.write(self.style.SUCCESS(
+            f"Found {len(pairs)} candidate merges among {total} titles in {elapsed:.2f}s."
+        ))
+
+    def score_block(self, entries, options):
+        """Score the candidate pairs of one media type, spread over a process pool"""
+        titles = [entry['normalized_title'] for entry in entries]
+
+        postings = defaultdict(list)
+        for index, title in enumerate(titles):
+            for gram in _trigrams(title):
+                postings[gram].append(index)
+        # Very common trigrams match almost everything and only add noise
+        postings = {
+            gram: indexes for gram, indexes in postings.items()
+            if len(indexes) <= options['max_posting']
+        }
+
+        chunk_size = max(1, options['chunk_size'])
+        ranges = [(start, min(start + chunk_size, len(titles))) for start in range(0, len(titles), chunk_size)]
+        task_args = (options['threshold'], options['min_overlap'])
+
+        if options['workers'] <= 1 or len(ranges) <= 1:
+            _init_worker(titles, postings)
+            for start, end in ranges:
+                yield from _score_block(start, end, *task_args)
+            return
+
+        with ProcessPoolExecutor(
+            max_workers=options['workers'],
+            initializer=_init_worker,
+            initargs=(titles, postings)
+        ) as executor:
+            futures = [executor.submit(_score_block, start, end, *task_args) for start, end in ranges]
+            for future in futures:
+                yield from future.result()
+
+    def merge_candidate(self, media_type, first, second, similarity):
+        """Suggest keeping the entry with more ratings, then the older one"""
+        keep, duplicate = sorted(
+            (first, second),
+            key=lambda media: (-media['rating_count'], media['created_at'], media['id'])
+        )
+        return {
+            'similarity': round(similarity, 4),
+            'media_type': media_type,
+            'keep_id': keep['id'],
+            'keep_title': keep['title'],
+            'keep_ratings': keep['rating_count'],
+            'duplicate_id': duplicate['id'],
+            'duplicate_title': duplicate['title'],
+            'duplicate_ratings': duplicate['rating_count'],
+        }
+
+    def write_report(self, pairs, options):
+        buffer = io.StringIO(newline='')
+        if options['format'] == 'json':
+            json.dump(pairs, buffer, indent=2)
+            buffer.write('\n')
+        else:
+            fields = [
+                'similarity', 'media_type', 'keep_id', 'keep_title', 'keep_ratings',
+                'duplicate_id', 'duplicate_title', 'duplicate_ratings'
+            ]
+            writer = csv.DictWriter(buffer, fieldnames=fields)
+            writer.writeheader()
+            writer.writerows(pairs)
+
+        if options['output']:
+            with open(options['output'], 'w', newline='') as output:
+                output.write(buffer.getvalue())
+        else:
+            # self.stdout so call_command(stdout=...) captures the report
+            self.stdout.write(buffer.getvalue(), ending='')
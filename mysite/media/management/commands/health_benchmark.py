@@ -0,0 +1,128 @@
+import io
+import json
+import math
+import random
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.core.wsgi import get_wsgi_application
+from django.db import connection
+from wsgiref.util import setup_testing_defaults
+
+USERNAME = 'health-benchmark'
+
+
+def _percentile(ordered, fraction):
+    """Nearest-rank percentile of an ascending list"""
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+class Command(BaseCommand):
+    help = 'Time /health/ inside the WSGI application from parallel threads, optionally while ratings are written'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--threads',
+            type=int,
+            default=8,
+            help='Parallel callers'
+        )
+        parser.add_argument(
+            '--requests',
+            type=int,
+            default=2000,
+            help='Requests per caller'
+        )
+        parser.add_argument(
+            '--writers',
+            type=int,
+            default=1,
+            help='Threads rating media in the background, which moves the cursors'
+        )
+        parser.add_argument(
+            '--method',
+            choices=['GET', 'HEAD'],
+            default='HEAD'
+        )
+
+    def handle(self, *args, **options):
+        from media.models import Media, User, UserMedia
+        from rest_framework.authtoken.models import Token
+
+        application = get_wsgi_application()
+        user, _ = User.objects.get_or_create(username=USERNAME)
+        token, _ = Token.objects.get_or_create(user=user)
+        media_ids = list(Media.objects.values_list('pk', flat=True)[:100])
+
+        def call(authorization):
+            environ = {
+                'REQUEST_METHOD': options['method'], 'PATH_INFO': '/health/',
+                'HTTP_HOST': 'localhost', 'wsgi.input': io.BytesIO(),
+            }
+            if authorization:
+                environ['HTTP_AUTHORIZATION'] = authorization
+            setup_testing_defaults(environ)
+            started = time.perf_counter()
+            body = application(environ, lambda status, headers, exc_info=None: None)
+            b''.join(body)
+            return time.perf_counter() - started
+
+        timings = {'anonymous': [], 'token': []}
+        lock = threading.Lock()
+        stop = threading.Event()
+
+        def caller(number):
+            kind = 'token' if number % 2 else 'anonymous'
+            authorization = f'Token {token.key}' if kind == 'token' else None
+            local = [call(authorization) for _ in range(options['requests'])]
+            with lock:
+                timings[kind].extend(local)
+            connection.close()
+
+        writes = [0]
+
+        def writer():
+            rng = random.Random()
+            while not stop.is_set() and media_ids:
+                UserMedia.upsert(user, rng.choice(media_ids), score=rng.randint(0, 20) / 2)
+                writes[0] += 1
+            connection.close()
+
+        for _ in range(50):
+            call(None)
+
+        writers = [threading.Thread(target=writer) for _ in range(options['writers'])]
+        callers = [threading.Thread(target=caller, args=(number,)) for number in range(options['threads'])]
+        started = time.monotonic()
+        for thread in writers + callers:
+            thread.start()
+        for thread in callers:
+            thread.join()
+        stop.set()
+        for thread in writers:
+            thread.join()
+        elapsed = time.monotonic() - started
+
+        report = {
+            'method': options['method'],
+            'threads': options['threads'],
+            'requests': sum(len(values) for values in timings.values()),
+            'throughput_rps': round(sum(len(values) for values in timings.values()) / elapsed, 1),
+            'background_writes': writes[0],
+        }
+        for kind, values in timings.items():
+            if not values:
+                continue
+            values.sort()
+            report[kind] = {
+                'p50_ms': round(_percentile(values, 0.50) * 1000, 3),
+                'p95_ms': round(_percentile(values, 0.95) * 1000, 3),
+                'p99_ms': round(_percentile(values, 0.99) * 1000, 3),
+            }
+
+        UserMedia.objects.filter(user=user).delete()
+        user.delete()
+        if writes[0]:
+            Media.recompute_scores()
+        self.stdout.write(json.dumps(report, indent=2))
@@ -0,0 +1,181 @@
+import csv
+import json
+import os
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError, connections, transaction
+from media import cursors, stats
+from media.forms import MediaForm, TitleMatcher
+from media.models import Media, normalize_title
+
+FIELDS = ['title', 'media_type', 'url', 'plot', 'chapters', 'quotes']
+
+
+def _form_data(row):
+    """Turn an input row into MediaForm data; quotes may be a list or one quote per line"""
+    data = {field: row.get(field) or '' for field in FIELDS}
+    quotes = row.get('quotes') or []
+    if isinstance(quotes, str):
+        quotes = [quote.strip() for quote in quotes.split('\n') if quote.strip()]
+    data['quotes'] = json.dumps(quotes)
+    return data
+
+
+def _validate_chunk(rows):
+    """Run the MediaForm rules on (row_number, row) pairs, without touching the database"""
+    results = []
+    for row_number, row in rows:
+        form = MediaForm(_form_data(row), check_catalog=False)
+        if form.is_valid():
+            results.append((row_number, form.cleaned_data, None))
+        else:
+            reason = '; '.join(
+                f"{field}: {' '.join(messages)}" for field, messages in form.errors.items()
+            )
+            results.append((row_number, row, reason))
+    return results
+
+
+class Command(BaseCommand):
+    help = 'Import media from a CSV or JSON file with MediaForm validation, deduplication and bulk inserts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', type=str, help='CSV (with a header row) or JSON list of objects')
+        parser.add_argument(
+            '--rejects',
+            type=str,
+            help='CSV file listing rejected rows and the reason (default: <path>.rejects.csv)'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count() or 1,
+            help='Number of validation processes'
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=500,
+            help='Rows validated per worker task'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Rows per bulk_create'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Validate and deduplicate without inserting'
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        path = Path(options['path'])
+        rows = self.read_rows(path)
+
+        accepted, rejects = [], []
+        for row_number, data, reason in self.validate(rows, options):
+            if reason:
+                rejects.append((row_number, data.get('title', ''), reason))
+            else:
+                accepted.append((row_number, data))
+
+        # Deduplicate against the catalog and within the batch on the normalized title, then
+        # apply MediaForm's similar-title rule, which the workers skip (it needs the catalog)
+        existing = set()
+        matchers = {media_type: TitleMatcher() for media_type in Media.MediaType.values}
+        for title, normalized, media_type in Media.objects.values_list('title', 'normalized_title', 'media_type').order_by():
+            existing.add((normalized, media_type))
+            matchers.setdefault(media_type, TitleMatcher()).add(title, normalized)
+
+        new_media = []
+        for row_number, data in accepted:
+            key = (normalize_title(data['title']), data['media_type'])
+            if key in existing:
+                rejects.append((row_number, data['title'], f"duplicate of an existing {data['media_type']}"))
+                continue
+            similar_titles = matchers[data['media_type']].similar(key[0])
+            if similar_titles:
+                suggestions = ', '.join(f"'{title}' ({similarity:.0%} similar)" for title, similarity in similar_titles)
+                rejects.append((row_number, data['title'], f"too similar to an existing {data['media_type']}: {suggestions}"))
+                continue
+            existing.add(key)
+            matchers[data['media_type']].add(data['title'], key[0])
+            new_media.append((row_number, Media(normalized_title=key[0], **data)))
+
+        created = 0
+        if not options['dry_run']:
+            created = self.insert(new_media, options['batch_size'], rejects)
+
+        rejects.sort()
+        rejects_path = Path(options['rejects'] or f'{path}.rejects.csv')
+        with rejects_path.open('w', newline='') as output:
+            writer = csv.writer(output)
+            writer.writerow(['row', 'title', 'reason'])
+            writer.writerows(rejects)
+
+        elapsed = time.monotonic() - started
+        verb = 'would import' if options['dry_run'] else 'imported'
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb.capitalize()} {len(new_media) if options['dry_run'] else created} of {len(rows)} rows "
+            f"in {elapsed:.2f}s, {len(rejects)} rejected (see {rejects_path})."
+        ))
+
+    def read_rows(self, path):
+        if not path.exists():
+            raise CommandError(f'{path} does not exist')
+        with path.open(newline='') as source:
+            if path.suffix.lower() == '.json':
+                rows = json.load(source)
+                if not isinstance(rows, list):
+                    raise CommandError('The JSON file must contain a list of objects')
+                return rows
+            return list(csv.DictReader(source))
+
+    def validate(self, rows, options):
+        """Validate rows in chunks, in a process pool when there is more than one chunk"""
+        numbered = list(enumerate(rows, start=1))
+        chunk_size = max(1, options['chunk_size'])
+        chunks = [numbered[start:start + chunk_size] for start in range(0, len(numbered), chunk_size)]
+
+        if options['workers'] <= 1 or len(chunks) <= 1:
+            for chunk in chunks:
+                yield from _validate_chunk(chunk)
+            return
+
+        # Forked workers must not share this process's database connections
+        connections.close_all()
+        # Spawned workers import this module, and so the models, only after setup
+        with ProcessPoolExecutor(max_workers=options['workers'], initializer=django.setup) as executor:
+            for results in executor.map(_validate_chunk, chunks):
+                yield from results
+
+    def insert(self, new_media, batch_size, rejects):
+        """bulk_create in batches, falling back to row by row when a batch hits a concurrent duplicate"""
+        created = 0
+        for start in range(0, len(new_media), batch_size):
+            batch = new_media[start:start + batch_size]
+            try:
+                with transaction.atomic():
+                    Media.objects.bulk_create([media for _, media in batch])
+                    # bulk_create sends no post_save, so count the new media here
+                    for media_type, count in Counter(media.media_type for _, media in batch).items():
+                        stats.media_added(media_type, count)
+                    cursors.catalog_changed()
+                created += len(batch)
+            except IntegrityError:
+                for row_number, media in batch:
+                    try:
+                        with transaction.atomic():
+                            media.save()
+                        created += 1
+                    except IntegrityError:
+                        rejects.append((row_number, media.title, 'duplicate inserted concurrently'))
+        return created
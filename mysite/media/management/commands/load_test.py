@@ -0,0 +1,369 @@
+import json
+import math
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+import requests
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+USERNAME_PREFIX = 'loadtest-'
+PASSWORD = 'loadtest-password'
+# Same as HEALTH_CACHE_MS and MEDIA_BATCH_SIZE in MediaCheckMobile/src/services/api.ts
+HEALTH_CACHE_SECONDS = 5
+MEDIA_BATCH_SIZE = 1000
+
+
+class Recorder:
+    """Latencies and errors per endpoint, shared by the client threads of one worker process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def add(self, endpoint, seconds, ok):
+        with self._lock:
+            self.latencies[endpoint].append(seconds)
+            if not ok:
+                self.errors[endpoint] += 1
+
+
+class SimulatedClient:
+    """Replays the mobile app: login, syncData, then pushLocalChanges, with think time and churn.
+
+    Like MediaCheckMobile/src/services/api.ts, API calls are preceded by a
+    /health/ check, answered from the last response for HEALTH_CACHE_SECONDS,
+    and syncData uses the cursors of that same response to skip what didn't
+    change. The local catalog only holds the media of the collection: user
+    media first, then a batch fetch of the unknown ids. New titles are found
+    through autocomplete, as on the add screen. While offline, the client only
+    makes local changes, which it pushes in one burst when it comes back online.
+    """
+
+    def __init__(self, base_url, number, options, recorder):
+        self.base_url = base_url
+        self.username = f'{USERNAME_PREFIX}{number}'
+        self.options = options
+        self.recorder = recorder
+        self.rng = random.Random(options['seed'] + number)
+        self.session = requests.Session()
+        self.token = None
+        self.health = None
+        self.health_at = 0
+        self.synced = None
+        self.media_ids = set()
+        self.entries = {}
+        self.pending = {}
+
+    def request(self, endpoint, method, path, **kwargs):
+        headers = {'Accept': 'application/json'}
+        if self.token:
+            headers['Authorization'] = f'Token {self.token}'
+        started = time.perf_counter()
+        try:
+            response = self.session.request(method, self.base_url + path, headers=headers, timeout=30, **kwargs)
+        except requests.RequestException:
+            self.recorder.add(endpoint, time.perf_counter() - started, False)
+            return None
+        # The app treats 404 from user-exists as "not registered yet"
+        ok = response.status_code < 400 or (endpoint == 'GET /user-exists/' and response.status_code == 404)
+        self.recorder.add(endpoint, time.perf_counter() - started, ok)
+        return response
+
+    def online(self):
+        """The /health/ response (status and sync cursors), None when offline"""
+        if self.health is None or time.monotonic() - self.health_at >= HEALTH_CACHE_SECONDS:
+            response = self.request('GET /health/', 'GET', '/health/')
+            self.health = response.json() if response is not None and response.ok else None
+            self.health_at = time.monotonic()
+        return self.health
+
+    def think(self):
+        if self.options['think_time'] > 0:
+            time.sleep(self.rng.expovariate(1 / self.options['think_time']))
+
+    def run(self, deadline):
+        while time.monotonic() < deadline:
+            if self.rng.random() < self.options['offline_rate']:
+                self.offline(deadline)
+                continue
+            if self.login():
+                self.think()
+                self.sync_data()
+                self.think()
+                self.discover()
+                self.change_locally()
+                self.push_local_changes()
+            self.think()
+
+    def offline(self, deadline):
+        offline_until = min(deadline, time.monotonic() + self.rng.expovariate(1 / self.options['offline_seconds']))
+        while time.monotonic() < offline_until:
+            self.change_locally()
+            time.sleep(min(max(self.options['think_time'], 0.1), max(offline_until - time.monotonic(), 0)))
+
+    def login(self):
+        if self.online() is None:
+            return False
+        exists = self.request('GET /user-exists/', 'GET', f'/user-exists/{self.username}/')
+        if exists is not None and exists.status_code == 404:
+            self.request('POST /register-App/', 'POST', '/register-App/', json={
+                'username': self.username, 'password': PASSWORD
+            })
+        self.token = None
+        response = self.request('POST /api-token-auth/', 'POST', '/api-token-auth/', json={
+            'username': self.username, 'password': PASSWORD
+        })
+        if response is None or not response.ok:
+            return False
+        self.token = response.json()['token']
+        # The cursors of the anonymous check don't include the user's
+        self.health = None
+        return True
+
+    def sync_data(self):
+        cursors = self.online()
+        if cursors is None:
+            return
+        synced = self.synced or {}
+        known = set(self.media_ids)
+        if cursors.get('user') != synced.get('user'):
+            response = self.request('GET /api/user-media/', 'GET', '/api/user-media/')
+            if response is None or not response.ok:
+                return
+            self.entries = {entry['media']['id']: entry['id'] for entry in response.json() if entry.get('media')}
+            self.fetch_media(set(self.entries) - known)
+        if cursors['catalog'] != synced.get('catalog'):
+            # Refresh the media we had; the ones deleted on the server are dropped
+            self.media_ids -= self.fetch_media(known)
+        self.synced = cursors
+
+    def fetch_media(self, media_ids):
+        """Batch fetch these media like getMediaByIdsFromAPI, keeping the ones that exist; returns the missing ids"""
+        media_ids = sorted(media_ids)
+        missing = set()
+        for start in range(0, len(media_ids), MEDIA_BATCH_SIZE):
+            response = self.request('POST /api/media/batch/', 'POST', '/api/media/batch/', json={
+                'ids': media_ids[start:start + MEDIA_BATCH_SIZE]
+            })
+            if response is not None and response.ok:
+                data = response.json()
+                self.media_ids.update(row[0] for row in data['rows'])
+                missing.update(data['missing'])
+        return missing
+
+    def discover(self):
+        """Find titles to add through autocomplete, as the add screen does"""
+        if self.online() is None:
+            return
+        query = self.rng.choice('abcdefghijklmnopqrstuvwxyz')
+        response = self.request('GET /api/media/autocomplete/', 'GET', '/api/media/autocomplete/', params={'q': query})
+        if response is not None and response.ok:
+            self.media_ids.update(item['id'] for item in response.json())
+
+    def change_locally(self):
+        if not self.media_ids:
+            return
+        for _ in range(self.rng.randint(1, self.options['changes'])):
+            media_id = self.rng.choice(sorted(self.media_ids))
+            state = self.rng.choice([1, 2, 3])
+            score = self.rng.randint(0, 20) / 2 if state == 3 else None
+            self.pending[media_id] = {'media_id': media_id, 'state': state, 'score': score}
+
+    def push_local_changes(self):
+        for media_id, change in list(self.pending.items()):
+            if self.online() is None:
+                return
+            entry_id = self.entries.get(media_id)
+            if entry_id:
+                response = self.request('PUT /api/user-media/{id}/', 'PUT', f'/api/user-media/{entry_id}/', json=change)
+            else:
+                response = self.request('POST /api/user-media/', 'POST', '/api/user-media/', json=change)
+            if response is not None and response.ok:
+                self.entries[media_id] = response.json()['id']
+                del self.pending[media_id]
+
+
+def _run_clients(base_url, numbers, options, deadline):
+    """Worker process: one thread per simulated client"""
+    recorder = Recorder()
+    clients = [SimulatedClient(base_url, number, options, recorder) for number in numbers]
+    threads = [threading.Thread(target=client.run, args=(deadline,)) for client in clients]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return dict(recorder.latencies), dict(recorder.errors)
+
+
+def _percentile(ordered, fraction):
+    """Nearest-rank percentile of an ascending list"""
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+class Command(BaseCommand):
+    help = 'Drive simulated mobile clients against a local server and report latency percentiles as JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--clients',
+            type=int,
+            default=20,
+            help='Number of simulated devices'
+        )
+        parser.add_argument(
+            '--processes',
+            type=int,
+            default=4,
+            help='Worker processes the clients are spread over'
+        )
+        parser.add_argument(
+            '--duration',
+            type=float,
+            default=30,
+            help='Seconds to run'
+        )
+        parser.add_argument(
+            '--think-time',
+            type=float,
+            default=1.0,
+            help='Mean pause between steps of a client, in seconds (exponentially distributed)'
+        )
+        parser.add_argument(
+            '--offline-rate',
+            type=float,
+            default=0.1,
+            help='Chance that a client goes offline instead of starting its next session'
+        )
+        parser.add_argument(
+            '--offline-seconds',
+            type=float,
+            default=5.0,
+            help='Mean time a client stays offline'
+        )
+        parser.add_argument(
+            '--changes',
+            type=int,
+            default=3,
+            help='Most local changes made per session'
+        )
+        parser.add_argument(
+            '--url',
+            type=str,
+            help='Use a server that is already running instead of starting runserver'
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=0,
+            help='Random seed of the clients'
+        )
+        parser.add_argument(
+            '--keep',
+            action='store_true',
+            help='Keep the load test users and their entries afterwards'
+        )
+
+    def handle(self, *args, **options):
+        from media.models import Media
+
+        if not Media.objects.exists():
+            raise CommandError('There is no media to rate; load some first (e.g. erase_data --action restore)')
+
+        server = None
+        base_url = (options['url'] or '').rstrip('/')
+        if not base_url:
+            server, base_url = self.start_server()
+        try:
+            results = self.run(base_url, options)
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait()
+        if not options['keep']:
+            self.cleanup()
+        self.stdout.write(json.dumps(results, indent=2))
+
+    def start_server(self):
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            port = probe.getsockname()[1]
+        server = subprocess.Popen(
+            [sys.executable, str(settings.BASE_DIR / 'manage.py'), 'runserver', f'127.0.0.1:{port}', '--noreload'],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        base_url = f'http://127.0.0.1:{port}'
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            try:
+                if requests.get(f'{base_url}/health/', timeout=1).ok:
+                    return server, base_url
+            except requests.RequestException:
+                time.sleep(0.2)
+        server.terminate()
+        raise CommandError('The test server did not come up within 30s')
+
+    def run(self, base_url, options):
+        numbers = list(range(options['clients']))
+        processes = max(1, min(options['processes'], len(numbers)))
+        groups = [numbers[index::processes] for index in range(processes)]
+        client_options = {
+            key: options[key] for key in ('think_time', 'offline_rate', 'offline_seconds', 'changes', 'seed')
+        }
+
+        latencies, errors = defaultdict(list), defaultdict(int)
+        started = time.monotonic()
+        deadline = started + options['duration']
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            futures = [executor.submit(_run_clients, base_url, group, client_options, deadline) for group in groups]
+            for future in futures:
+                worker_latencies, worker_errors = future.result()
+                for endpoint, values in worker_latencies.items():
+                    latencies[endpoint].extend(values)
+                for endpoint, count in worker_errors.items():
+                    errors[endpoint] += count
+        elapsed = time.monotonic() - started
+
+        total = sum(len(values) for values in latencies.values())
+        total_errors = sum(errors.values())
+        endpoints = {}
+        for endpoint, values in sorted(latencies.items()):
+            values.sort()
+            endpoints[endpoint] = {
+                'requests': len(values),
+                'errors': errors[endpoint],
+                'error_rate': round(errors[endpoint] / len(values), 4),
+                'p50_ms': round(_percentile(values, 0.50) * 1000, 1),
+                'p95_ms': round(_percentile(values, 0.95) * 1000, 1),
+                'p99_ms': round(_percentile(values, 0.99) * 1000, 1),
+                'max_ms': round(values[-1] * 1000, 1),
+            }
+        return {
+            'server': base_url,
+            'clients': options['clients'],
+            'processes': processes,
+            'duration_s': round(elapsed, 2),
+            'requests': total,
+            'throughput_rps': round(total / elapsed, 1) if elapsed else None,
+            'errors': total_errors,
+            'error_rate': round(total_errors / total, 4) if total else None,
+            'endpoints': endpoints,
+        }
+
+    def cleanup(self):
+        """Remove the load test users and their entries, then fix the scores and stats they touched"""
+        from media import stats
+        from media.models import Media, User
+
+        users = User.objects.filter(username__startswith=USERNAME_PREFIX)
+        if users.exists():
+            users.delete()
+            Media.recompute_scores()
+            stats.rebuild()
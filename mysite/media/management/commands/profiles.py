@@ -0,0 +1,51 @@
+import io
+import pstats
+from datetime import datetime
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+class Command(BaseCommand):
+    help = 'List stored request profiles and summarize their top cumulative functions'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--url-name',
+            type=str,
+            help='Only include profiles of this URL name (e.g. media-home)'
+        )
+        parser.add_argument(
+            '--top',
+            type=int,
+            default=25,
+            help='Number of functions to show in the summary'
+        )
+        parser.add_argument(
+            '--list-only',
+            action='store_true',
+            help='Only list the stored profiles'
+        )
+
+    def handle(self, *args, **options):
+        directory = Path(getattr(settings, 'MEDIA_PROFILING_DIR', settings.BASE_DIR / 'profiles'))
+        pattern = f"{options['url_name']}-*.pstats" if options['url_name'] else '*.pstats'
+        profiles = sorted(directory.glob(pattern), key=lambda path: path.stat().st_mtime)
+
+        if not profiles:
+            self.stdout.write(f"No profiles found in {directory}.")
+            return
+
+        for path in profiles:
+            modified = datetime.fromtimestamp(path.stat().st_mtime).strftime('%Y-%m-%d %H:%M:%S')
+            self.stdout.write(f"{modified}  {path.stat().st_size:>8}  {path.name}")
+
+        if options['list_only']:
+            return
+
+        # Merge every profile so the summary shows where time goes across requests
+        output = io.StringIO()
+        stats = pstats.Stats(*[str(path) for path in profiles], stream=output)
+        stats.strip_dirs().sort_stats('cumulative').print_stats(options['top'])
+        self.stdout.write(f"\nTop {options['top']} cumulative functions across {len(profiles)} profiles:")
+        self.stdout.write(output.getvalue())
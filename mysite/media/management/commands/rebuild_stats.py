@@ -0,0 +1,20 @@
+import time
+
+from django.core.management.base import BaseCommand
+from media import stats
+
+
+class Command(BaseCommand):
+    help = 'Recompute the catalog counters and score histograms from the Media and UserMedia tables'
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        stats.rebuild()
+        snapshot = stats.snapshot()
+        elapsed = time.monotonic() - started
+        for media_type, values in snapshot['types'].items():
+            self.stdout.write(
+                f"{media_type}: {values['media']} media, {values['rated']} rated, "
+                f"{sum(values['histogram'].values())} ratings"
+            )
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt catalog stats in {elapsed:.2f}s.'))
@@ -0,0 +1,92 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Max, Min
+from media import stats
+from media.models import Media, UserMedia
+
+class Command(BaseCommand):
+    help = 'Recompute every Media.score from the ratings with set-based UPDATE statements'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--media-type',
+            type=str,
+            choices=Media.MediaType.values,
+            help='Only recompute media of this type'
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=0,
+            help='Process media ids in ranges of this size (0 = whole table in one statement)'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Show the scores that would change without writing them'
+        )
+
+    def handle(self, *args, **options):
+        media_type = options['media_type']
+        chunk_size = options['chunk_size']
+        dry_run = options['dry_run']
+        started = time.monotonic()
+
+        changed = 0
+        for start_id, end_id in self.id_ranges(media_type, chunk_size):
+            if dry_run:
+                changed += self.show_diff(start_id, end_id, media_type)
+            else:
+                with transaction.atomic():
+                    changed += Media.recompute_scores(start_id, end_id, media_type)
+        if changed and not dry_run:
+            # The set-based updates bypass the rated/unrated counters
+            stats.rebuild()
+
+        elapsed = time.monotonic() - started
+        verb = 'would change' if dry_run else 'updated'
+        self.stdout.write(self.style.SUCCESS(
+            f"Recompute {verb} {changed} media scores in {elapsed:.2f}s."
+        ))
+
+    def id_ranges(self, media_type, chunk_size):
+        """Yield inclusive (start_id, end_id) ranges covering the media table"""
+        if chunk_size <= 0:
+            yield None, None
+            return
+
+        media_qs = Media.objects.all()
+        if media_type:
+            media_qs = media_qs.filter(media_type=media_type)
+        bounds = media_qs.aggregate(low=Min('id'), high=Max('id'))
+        if bounds['low'] is None:
+            return
+
+        for start_id in range(bounds['low'], bounds['high'] + 1, chunk_size):
+            yield start_id, start_id + chunk_size - 1
+
+    def show_diff(self, start_id, end_id, media_type):
+        """Print the media whose stored score differs from the ratings average"""
+        media_table = connection.ops.quote_name(Media._meta.db_table)
+        user_media_table = connection.ops.quote_name(UserMedia._meta.db_table)
+        media_where, media_params = Media._score_range_filter(
+            'm.id', start_id, end_id, media_type, 'm.media_type'
+        )
+        rating_where, rating_params = Media._score_range_filter('media_id', start_id, end_id)
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT m.id, m.title, m.score, agg.avg_score FROM {media_table} m '
+                f'LEFT JOIN (SELECT media_id, AVG(score) AS avg_score FROM {user_media_table} '
+                f'WHERE score IS NOT NULL{rating_where} GROUP BY media_id) AS agg '
+                f'ON agg.media_id = m.id '
+                f'WHERE m.score IS NOT agg.avg_score{media_where} ORDER BY m.id',
+                rating_params + media_params
+            )
+            rows = cursor.fetchall()
+
+        for media_id, title, old_score, new_score in rows:
+            self.stdout.write(f"{media_id}\t{title}\t{old_score} -> {new_score}")
+        return len(rows)
@@ -0,0 +1,73 @@
+import json
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+def weighted_percentile(samples, fraction):
+    """Percentile of (value, weight) pairs, 0 when there are none"""
+    samples = sorted(samples)
+    target = sum(weight for _, weight in samples) * fraction
+    seen = 0.0
+    for value, weight in samples:
+        seen += weight
+        if seen >= target:
+            return value
+    return samples[-1][0] if samples else 0.0
+
+
+class Command(BaseCommand):
+    help = 'Show the slowest query fingerprints recorded by the slow-query log'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sort',
+            type=str,
+            choices=['total', 'count', 'p95'],
+            default='total',
+            help='Rank fingerprints by total time, number of executions or 95th percentile'
+        )
+        parser.add_argument(
+            '--top',
+            type=int,
+            default=20,
+            help='Number of fingerprints to show'
+        )
+
+    def handle(self, *args, **options):
+        # Reads what the server processes have flushed; they append every
+        # MEDIA_SLOW_QUERY_FLUSH_SECONDS and at exit
+        path = Path(getattr(settings, 'MEDIA_SLOW_QUERY_LOG', settings.BASE_DIR / 'slow_queries.log'))
+        if not path.exists():
+            self.stdout.write(f"No slow queries logged yet ({path} does not exist).")
+            return
+
+        merged = {}
+        with path.open() as log:
+            for line in log:
+                entry = json.loads(line)
+                current = merged.setdefault(entry['fingerprint'], {
+                    'count': 0, 'total': 0.0, 'samples': [], 'views': set(), 'locations': set()
+                })
+                current['count'] += entry['count']
+                current['total'] += entry['total']
+                # Each sample of a window stands for count / len(samples) executions
+                if entry['samples']:
+                    weight = entry['count'] / len(entry['samples'])
+                    current['samples'].extend((sample, weight) for sample in entry['samples'])
+                current['views'].update(entry['views'])
+                current['locations'].update(entry['locations'])
+
+        for current in merged.values():
+            current['p95'] = weighted_percentile(current['samples'], 0.95)
+
+        ranked = sorted(merged.items(), key=lambda item: item[1][options['sort']], reverse=True)
+        for sql, current in ranked[:options['top']]:
+            self.stdout.write(self.style.SUCCESS(
+                f"total {current['total'] * 1000:.1f}ms  count {current['count']}  "
+                f"p95 {current['p95'] * 1000:.1f}ms"
+            ))
+            self.stdout.write(f"  {sql}")
+            self.stdout.write(f"  views: {', '.join(sorted(current['views']))}")
+            self.stdout.write(f"  from: {', '.join(sorted(current['locations']))}\n")
@@ -0,0 +1,84 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+# Runs in a fresh interpreter: loads the WSGI app like a new worker would and
+# times the first request to each path
+WORKER_SCRIPT = '''
+import io, json, os, sys, time
+started = time.perf_counter()
+sys.path.insert(0, os.environ['BENCHMARK_BASE_DIR'])
+os.environ['DJANGO_SETTINGS_MODULE'] = 'mysite.settings'
+from wsgiref.util import setup_testing_defaults
+from mysite.wsgi import application
+ready = time.perf_counter()
+
+def request(path):
+    environ = {'PATH_INFO': path, 'HTTP_HOST': 'localhost', 'wsgi.input': io.BytesIO()}
+    setup_testing_defaults(environ)
+    statuses = []
+    body = application(environ, lambda status, headers, exc_info=None: statuses.append(status))
+    b''.join(body)
+    return statuses[0]
+
+first_requests = {}
+for path in sys.argv[1:]:
+    before = time.perf_counter()
+    status = request(path)
+    first_requests[path] = [time.perf_counter() - before, status]
+print(json.dumps({
+    'app_ready': ready - started,
+    'first_requests': first_requests,
+    'first_response': time.perf_counter() - started,
+}))
+'''
+
+
+class Command(BaseCommand):
+    help = 'Measure time from worker process start to first response, with and without warm-up'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--runs',
+            type=int,
+            default=5,
+            help='Fresh processes started per mode'
+        )
+        parser.add_argument(
+            '--path',
+            action='append',
+            dest='paths',
+            help='Path requested by each process (repeatable, default / and /api/media/)'
+        )
+
+    def handle(self, *args, **options):
+        paths = options['paths'] or ['/', '/api/media/']
+        results = {}
+        for mode, warmup in (('cold', '0'), ('warm', '1')):
+            runs = [self.run_worker(paths, warmup) for _ in range(options['runs'])]
+            results[mode] = {
+                'app_ready_ms': self.median_ms(run['app_ready'] for run in runs),
+                'first_response_ms': self.median_ms(run['first_response'] for run in runs),
+                'first_request_ms': {
+                    path: self.median_ms(run['first_requests'][path][0] for run in runs)
+                    for path in paths
+                },
+                'statuses': {path: runs[0]['first_requests'][path][1] for path in paths},
+            }
+        self.stdout.write(json.dumps(results, indent=2))
+
+    def run_worker(self, paths, warmup):
+        env = {**os.environ, 'MEDIA_WARMUP': warmup, 'BENCHMARK_BASE_DIR': str(settings.BASE_DIR)}
+        completed = subprocess.run(
+            [sys.executable, '-c', WORKER_SCRIPT, *paths],
+            env=env, capture_output=True, text=True, check=True
+        )
+        return json.loads(completed.stdout.strip().splitlines()[-1])
+
+    def median_ms(self, values):
+        return round(statistics.median(values) * 1000, 1)
@@ -0,0 +1,142 @@
+import random
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Avg, Count
+from media.models import Media, User, UserMedia
+
+USERNAME_PREFIX = 'stress-rater-'
+
+
+class Command(BaseCommand):
+    help = 'Rate one media item from many threads at once and check the final average score is exact'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--threads',
+            type=int,
+            default=8,
+            help='Number of parallel raters'
+        )
+        parser.add_argument(
+            '--ratings',
+            type=int,
+            default=200,
+            help='Ratings written by each rater'
+        )
+        parser.add_argument(
+            '--media-id',
+            type=int,
+            help='Media to rate (default: a dedicated media created for the run)'
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=0,
+            help='Random seed for the scores and states'
+        )
+        parser.add_argument(
+            '--keep',
+            action='store_true',
+            help='Keep the stress users, their ratings and the created media afterwards'
+        )
+
+    def handle(self, *args, **options):
+        threads = max(1, options['threads'])
+        if options['media_id']:
+            media = Media.objects.filter(pk=options['media_id']).first()
+            if media is None:
+                raise CommandError(f"Media {options['media_id']} does not exist")
+            created_media = False
+        else:
+            media, created_media = Media.objects.get_or_create(
+                title='Stress test media', media_type=Media.MediaType.CINEMA
+            )
+
+        users = [
+            User.objects.get_or_create(username=f'{USERNAME_PREFIX}{number}')[0]
+            for number in range(threads)
+        ]
+        UserMedia.objects.filter(user__in=users, media=media).delete()
+        Media.update_score(media.pk)
+
+        # Each rater remembers the last entry it wrote, which is what must end up in the database
+        final = {}
+        errors = []
+        barrier = threading.Barrier(threads)
+
+        def rater(user, seed):
+            rng = random.Random(seed)
+            try:
+                barrier.wait()
+                for _ in range(options['ratings']):
+                    if rng.random() < 0.2:
+                        state = rng.choice(UserMedia.MediaState.values)
+                        values = {'state': state}
+                        if state == UserMedia.MediaState.CHECK:
+                            values['score'] = None
+                    else:
+                        values = {'score': rng.randint(0, 20) / 2}
+                    entry = UserMedia.upsert(user, media.pk, **values)
+                    final[user.pk] = entry.score
+            except Exception as error:
+                errors.append(f'{user.username}: {error!r}')
+            finally:
+                connection.close()
+
+        workers = [
+            threading.Thread(target=rater, args=(user, options['seed'] + number))
+            for number, user in enumerate(users)
+        ]
+        started = time.monotonic()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.monotonic() - started
+
+        scores = [score for score in final.values() if score is not None]
+        expected = sum(scores) / len(scores) if scores else None
+        media.refresh_from_db(fields=['score'])
+        stored = UserMedia.objects.filter(media=media, score__isnull=False, user__in=users).aggregate(
+            count=Count('score'), avg=Avg('score')
+        )
+        others = UserMedia.objects.filter(media=media, score__isnull=False).exclude(user__in=users).exists()
+
+        total = threads * options['ratings']
+        self.stdout.write(
+            f'{total} upserts from {threads} threads in {elapsed:.2f}s ({total / elapsed:.0f}/s), '
+            f'{len(errors)} errors'
+        )
+        for error in errors[:10]:
+            self.stdout.write(self.style.ERROR(f'  {error}'))
+        self.stdout.write(
+            f'Expected average {expected} over {len(scores)} ratings, '
+            f"stored ratings average {stored['avg']} over {stored['count']}, media score {media.score}"
+        )
+
+        exact = (
+            stored['count'] == len(scores)
+            and _same(stored['avg'], expected)
+            and (others or _same(media.score, expected))
+        )
+
+        if not options['keep']:
+            UserMedia.objects.filter(user__in=users).delete()
+            User.objects.filter(pk__in=[user.pk for user in users]).delete()
+            if created_media:
+                media.delete()
+            else:
+                Media.update_score(media.pk)
+
+        if errors or not exact:
+            raise CommandError('Lost updates: the final aggregate does not match the last ratings')
+        self.stdout.write(self.style.SUCCESS('Final aggregate is exact.'))
+
+
+def _same(left, right):
+    if left is None or right is None:
+        return left is right
+    return abs(left - right) < 1e-9
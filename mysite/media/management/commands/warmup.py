@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from media.warmup import warm_up
+
+class Command(BaseCommand):
+    help = 'Preload imports, the URL resolver, templates and the database connection, and show the time spent'
+
+    def handle(self, *args, **options):
+        timings = warm_up()
+        for step, seconds in timings.items():
+            self.stdout.write(f"{step:<14}{seconds * 1000:8.1f} ms")
+        if 'database' not in timings:
+            self.stdout.write(self.style.WARNING("database      skipped, the database is unreachable or not migrated"))
+        self.stdout.write(self.style.SUCCESS(f"Warm-up finished in {sum(timings.values()) * 1000:.1f} ms."))
@@ -0,0 +1,125 @@
+import cProfile
+import random
+from datetime import datetime
+from pathlib import Path
+from time import perf_counter
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+
+from . import timing
+from .querylog import SlowQueryLogger
+
+
+def is_staff(request):
+    """Session users, or token users authenticated here since DRF only does it in the view"""
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return user.is_staff
+    if not request.headers.get('Authorization'):
+        return False
+    try:
+        authenticated = TokenAuthentication().authenticate(request)
+    except AuthenticationFailed:
+        return False
+    return authenticated is not None and authenticated[0].is_staff
+
+
+class ServerTimingMiddleware:
+    """Add a Server-Timing header: total, database time and query count, templates, serialization, rendering.
+
+    Listed first so total covers the other middleware. Templates, serializers
+    and the JSON renderer report through media.timing; the overhead is a few
+    perf_counter() calls per query, template and serialized object. Off unless
+    MEDIA_SERVER_TIMING = True, and even then the header, which tells how the
+    server spends its time, only goes to staff users or with DEBUG on.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'MEDIA_SERVER_TIMING', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timings = timing.Timings()
+        token = timing.activate(timings)
+        started = perf_counter()
+        try:
+            with connection.execute_wrapper(timings):
+                response = self.get_response(request)
+        finally:
+            timing.deactivate(token)
+        total = perf_counter() - started
+        if settings.DEBUG or is_staff(request):
+            # Streaming bodies are produced after this point and are not included
+            response['Server-Timing'] = timings.header(total)
+        return response
+
+
+class ProfilingMiddleware:
+    """Profile whole requests with cProfile and store them as .pstats files.
+
+    A staff user opts in with the ``X-Profile: 1`` header or ``?profile=1``;
+    MEDIA_PROFILING_SAMPLE_RATE additionally profiles a random share of all
+    requests. View, template rendering and DRF serialization all happen inside
+    get_response, so the profile covers them.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.directory = Path(getattr(settings, 'MEDIA_PROFILING_DIR', settings.BASE_DIR / 'profiles'))
+        self.sample_rate = getattr(settings, 'MEDIA_PROFILING_SAMPLE_RATE', 0.0)
+        self.max_files = getattr(settings, 'MEDIA_PROFILING_MAX_FILES', 200)
+
+    def __call__(self, request):
+        requested = request.headers.get('X-Profile') == '1' or request.GET.get('profile') == '1'
+        # Checked before profiling, so nobody else can make the server pay for it
+        requested = requested and is_staff(request)
+        sampled = self.sample_rate > 0 and random.random() < self.sample_rate
+        if not requested and not sampled:
+            return self.get_response(request)
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            response = self.get_response(request)
+        finally:
+            profiler.disable()
+
+        path = self.save(profiler, request)
+        if requested:
+            response['X-Profile-File'] = path.name
+        return response
+
+    def save(self, profiler, request):
+        match = request.resolver_match
+        url_name = match.view_name.replace(':', '-') if match and match.view_name else 'unresolved'
+        timestamp = datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.directory / f'{url_name}-{timestamp}.pstats'
+        profiler.dump_stats(path)
+        self.rotate()
+        return path
+
+    def rotate(self):
+        """Keep only the newest MEDIA_PROFILING_MAX_FILES profiles; 0 or None keeps them all"""
+        if not self.max_files:
+            return
+        profiles = sorted(self.directory.glob('*.pstats'), key=lambda path: path.stat().st_mtime)
+        for path in profiles[:-self.max_files]:
+            path.unlink(missing_ok=True)
+
+
+class SlowQueryLogMiddleware:
+    """Record slow ORM statements of each request, see media.querylog"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with connection.execute_wrapper(SlowQueryLogger(request)):
+            return self.get_response(request)
@@ -0,0 +1,57 @@
+# Generated by Django 5.1.7 on 2026-10-19 13:55
+
+import re
+from collections import Counter
+
+from django.db import migrations, models
+
+
+def normalize_title(title):
+    """media.models.normalize_title as of this migration"""
+    title = title.lower()
+    title = re.sub(r'[^\w\s]', '', title)
+    title = re.sub(r'\s+', ' ', title)
+    return title.strip()
+
+
+def backfill_normalized_title(apps, schema_editor):
+    Media = apps.get_model('media', 'Media')
+    batch = []
+    seen = Counter()
+    for media in Media.objects.only('id', 'title', 'media_type').iterator(chunk_size=2000):
+        media.normalized_title = normalize_title(media.title)
+        seen[(media.normalized_title, media.media_type)] += 1
+        batch.append(media)
+        if len(batch) >= 2000:
+            Media.objects.bulk_update(batch, ['normalized_title'])
+            batch = []
+    if batch:
+        Media.objects.bulk_update(batch, ['normalized_title'])
+
+    duplicates = [key for key, count in seen.items() if count > 1]
+    if duplicates:
+        listed = ', '.join(f"'{title}' ({media_type})" for title, media_type in duplicates[:10])
+        raise RuntimeError(
+            f'{len(duplicates)} titles are duplicated after normalization, e.g. {listed}. '
+            'Merge them (see the find_duplicates command) before running this migration.'
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('media', '0007_usermedia_state_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='media',
+            name='normalized_title',
+            field=models.CharField(default='', editable=False, max_length=255),
+        ),
+        migrations.RunPython(backfill_normalized_title, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='media',
+            constraint=models.UniqueConstraint(fields=('normalized_title', 'media_type'), name='media_unique_normalized_title_type'),
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.1.7 on 2026-10-19 14:00
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('media', '0008_media_normalized_title'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaTypeDailyStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('media_type', models.CharField(choices=[('cinema', 'Cinema'), ('series', 'Series'), ('manga', 'Manga'), ('music', 'Music')], max_length=50)),
+                ('rating_count', models.IntegerField(default=0)),
+                ('score_sum', models.FloatField(default=0)),
+                ('state_transitions', models.JSONField(blank=True, default=dict)),
+            ],
+            options={
+                'ordering': ['day'],
+                'unique_together': {('media_type', 'day')},
+            },
+        ),
+        migrations.CreateModel(
+            name='UserMediaEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('old_state', models.IntegerField(blank=True, choices=[(0, 'Check'), (1, 'Checked'), (2, 'Viewing'), (3, 'Done')], null=True)),
+                ('new_state', models.IntegerField(choices=[(0, 'Check'), (1, 'Checked'), (2, 'Viewing'), (3, 'Done')])),
+                ('old_score', models.FloatField(blank=True, null=True)),
+                ('new_score', models.FloatField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(db_index=True)),
+                ('media', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='events', to='media.media')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='media_events', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='MediaDailyStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('rating_count', models.IntegerField(default=0)),
+                ('score_sum', models.FloatField(default=0)),
+                ('state_transitions', models.JSONField(blank=True, default=dict)),
+                ('media', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to='media.media')),
+            ],
+            options={
+                'ordering': ['day'],
+                'unique_together': {('media', 'day')},
+            },
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.1.7 on 2026-10-19 14:02
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('media', '0009_usermediaevent_daily_stats'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='usermedia',
+            name='media_userm_user_id_90a7fb_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='usermedia',
+            name='media_userm_score_bb7d48_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='usermedia',
+            name='media_userm_state_43495c_idx',
+        ),
+        migrations.AlterField(
+            model_name='usermedia',
+            name='state',
+            field=models.IntegerField(choices=[(0, 'Check'), (1, 'Checked'), (2, 'Viewing'), (3, 'Done')], default=0),
+        ),
+        migrations.AlterField(
+            model_name='usermedia',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='user_media', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='usermedia',
+            index=models.Index(fields=['user', 'state', '-updated_at'], name='usermedia_user_state_upd_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='usermedia',
+            index=models.Index(condition=models.Q(('score__isnull', False)), fields=['media', 'score'], name='usermedia_rated_by_media_idx'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.1.7 on 2026-10-19 14:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('media', '0010_usermedia_query_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaNeighbor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField()),
+                ('media', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='neighbors', to='media.media')),
+                ('neighbor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='media.media')),
+            ],
+            options={
+                'ordering': ['-score'],
+                'indexes': [models.Index(fields=['media', '-score'], name='medianeighbor_media_score_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,80 @@
+# Generated by Django 5.1.7 on 2026-10-19 14:15
+
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+BUCKETS = 21
+
+
+def score_bucket(score):
+    """media.stats.score_bucket as of this migration"""
+    return min(int(score * 2), BUCKETS - 1)
+
+
+def build_stats(apps, schema_editor):
+    """media.stats.rebuild as of this migration"""
+    Media = apps.get_model('media', 'Media')
+    UserMedia = apps.get_model('media', 'UserMedia')
+    MediaTypeStats = apps.get_model('media', 'MediaTypeStats')
+    ScoreHistogramBucket = apps.get_model('media', 'ScoreHistogramBucket')
+    media_types = [value for value, _ in Media._meta.get_field('media_type').choices]
+
+    counts = {
+        row['media_type']: row
+        for row in Media.objects.order_by().values('media_type').annotate(
+            total=Count('pk'), rated=Count('pk', filter=Q(score__isnull=False))
+        )
+    }
+    histogram = {media_type: [0] * BUCKETS for media_type in media_types}
+    ratings = UserMedia.objects.filter(score__isnull=False).order_by().values_list(
+        'media__media_type', 'score'
+    ).annotate(total=Count('pk'))
+    for media_type, score, total in ratings:
+        histogram.setdefault(media_type, [0] * BUCKETS)[score_bucket(score)] += total
+
+    MediaTypeStats.objects.bulk_create([
+        MediaTypeStats(
+            media_type=media_type,
+            media_count=counts.get(media_type, {}).get('total', 0),
+            rated_count=counts.get(media_type, {}).get('rated', 0),
+        )
+        for media_type in sorted(set(media_types) | counts.keys())
+    ])
+    ScoreHistogramBucket.objects.bulk_create([
+        ScoreHistogramBucket(media_type=media_type, bucket=bucket, rating_count=total)
+        for media_type, totals in histogram.items()
+        for bucket, total in enumerate(totals)
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('media', '0011_medianeighbor'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaTypeStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('media_type', models.CharField(choices=[('cinema', 'Cinema'), ('series', 'Series'), ('manga', 'Manga'), ('music', 'Music')], max_length=50, unique=True)),
+                ('media_count', models.IntegerField(default=0)),
+                ('rated_count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ScoreHistogramBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('media_type', models.CharField(choices=[('cinema', 'Cinema'), ('series', 'Series'), ('manga', 'Manga'), ('music', 'Music')], max_length=50)),
+                ('bucket', models.SmallIntegerField()),
+                ('rating_count', models.IntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['media_type', 'bucket'],
+                'unique_together': {('media_type', 'bucket')},
+            },
+        ),
+        migrations.RunPython(build_stats, migrations.RunPython.noop),
+    ]
@@ -1,16 +1,112 @@
-from django.db import models
+from django.db import models, connection, transaction
 from django.contrib.auth.models import AbstractUser
 from django.contrib.auth.hashers import make_password, check_password
 from django.core.validators import MinValueValidator, MaxValueValidator, URLValidator
 from enum import Enum
-from django.db.models import Avg, Count
+from django.db.models import Avg, Count, Q, OuterRef, Subquery, Value, IntegerField
 from django.core.exceptions import ValidationError
+import copy
+import re
+
+def normalize_title(title):
+    """Normalize title for comparison"""
+    # Convert to lowercase
+    title = title.lower()
+    # Remove special characters and extra spaces
+    title = re.sub(r'[^\w\s]', '', title)
+    # Replace multiple spaces with single space
+    title = re.sub(r'\s+', ' ', title)
+    return title.strip()
+
+_NOT_LOADED = object()
+
+class TrackChangesMixin:
+    """Remember the field values loaded from the database so saves only write what changed.
+
+    save() of a loaded instance passes update_fields with the changed columns
+    (plus auto_now fields) and does nothing at all when nothing changed.
+    """
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._remember_loaded_values()
+        return instance
+
+    def _remember_loaded_values(self, field_names=None):
+        """Snapshot the current values as the database state, of every field or only the named ones"""
+        if field_names is None:
+            self._loaded_values = {}
+            fields = self._meta.concrete_fields
+        else:
+            if getattr(self, '_loaded_values', None) is None:
+                self._loaded_values = {}
+            field_names = set(field_names)
+            fields = [
+                field for field in self._meta.concrete_fields
+                if field.name in field_names or field.attname in field_names
+            ]
+        for field in fields:
+            value = self.__dict__.get(field.attname, _NOT_LOADED)
+            if value is not _NOT_LOADED:
+                # Copy JSON containers so in-place edits still count as changes
+                self._loaded_values[field.attname] = copy.deepcopy(value) if isinstance(value, (list, dict)) else value
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        super().refresh_from_db(using=using, fields=fields, from_queryset=from_queryset)
+        # Also called to load a deferred field on first access
+        self._remember_loaded_values(fields)
+
+    def get_changed_fields(self):
+        """Map each changed field name to the value it was loaded with (None for unsaved objects)"""
+        loaded = getattr(self, '_loaded_values', None)
+        if loaded is None:
+            return {field.name: None for field in self._meta.concrete_fields if not field.primary_key}
+        changed = {}
+        for field in self._meta.concrete_fields:
+            if field.attname not in self.__dict__:
+                continue
+            if field.attname not in loaded or loaded[field.attname] != self.__dict__[field.attname]:
+                changed[field.name] = loaded.get(field.attname)
+        return changed
+
+    def save(self, *args, **kwargs):
+        loaded = getattr(self, '_loaded_values', None)
+        if loaded is not None and self.pk is not None and 'update_fields' not in kwargs \
+                and not kwargs.get('force_insert') and not args:
+            changed = self.get_changed_fields()
+            if not changed:
+                return
+            auto_now = [
+                field.name for field in self._meta.concrete_fields
+                if getattr(field, 'auto_now', False)
+            ]
+            kwargs['update_fields'] = list(changed) + [name for name in auto_now if name not in changed]
+        super().save(*args, **kwargs)
+        # After an update_fields save only the written fields match the database
+        self._remember_loaded_values(kwargs.get('update_fields'))
 
 class User(AbstractUser):
     # We can add custom fields here if needed
     pass
 
-class Media(models.Model):
+class MediaQuerySet(models.QuerySet):
+    def with_rating_stats(self, user=None):
+        """Annotate rating count/average and, for a logged in user, their own state and score"""
+        queryset = self.annotate(
+            rating_count=Count('user_media__score'),
+            rating_avg=Avg('user_media__score'),
+        )
+        if user is not None and user.is_authenticated:
+            own_entry = UserMedia.objects.filter(user=user, media=OuterRef('pk'))
+            queryset = queryset.annotate(
+                stats_user_id=Value(user.pk, output_field=IntegerField()),
+                user_state=Subquery(own_entry.values('state')[:1]),
+                user_score=Subquery(own_entry.values('score')[:1]),
+            )
+        return queryset
+
+class Media(TrackChangesMixin, models.Model):
     class MediaType(models.TextChoices):
         CINEMA = 'cinema', 'Cinema'
         SERIES = 'series', 'Series'
@@ -18,6 +114,8 @@ class Media(models.Model):
         MUSIC = 'music', 'Music'
 
     title = models.CharField(max_length=255, db_index=True)
+    # Filled from title on save, see normalize_title()
+    normalized_title = models.CharField(max_length=255, editable=False, default='')
     media_type = models.CharField(
         max_length=50, 
         choices=MediaType.choices, 
@@ -36,22 +134,150 @@ class Media(models.Model):
     quotes = models.JSONField(default=list, blank=True)
     score = models.FloatField(null=True, blank=True)
 
+    objects = MediaQuerySet.as_manager()
+
     class Meta:
         ordering = ['-created_at']
         indexes = [
             models.Index(fields=['title', 'media_type']),
             models.Index(fields=['created_at', 'media_type']),
         ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['normalized_title', 'media_type'],
+                name='media_unique_normalized_title_type'
+            ),
+        ]
+
+    def save(self, *args, **kwargs):
+        # A deferred normalized_title is only loaded (and rewritten) when the title changed
+        if 'normalized_title' in self.__dict__ or 'title' in self.get_changed_fields():
+            self.normalized_title = normalize_title(self.title)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'title' in update_fields and 'normalized_title' not in update_fields:
+            kwargs['update_fields'] = [*update_fields, 'normalized_title']
+        old_type = None if self._state.adding else self.get_changed_fields().get('media_type')
+        super().save(*args, **kwargs)
+        if old_type is not None and old_type != self.media_type:
+            from . import stats
+            stats.media_type_changed(self, old_type)
+
+    @classmethod
+    def find_duplicate(cls, title, media_type, exclude_pk=None):
+        """Return the media with the same normalized title and type, if any"""
+        queryset = cls.objects.filter(normalized_title=normalize_title(title), media_type=media_type)
+        if exclude_pk is not None:
+            queryset = queryset.exclude(pk=exclude_pk)
+        return queryset.order_by().first()
 
     def calculate_score(self):
         """Calculate the average score from all ratings"""
-        avg_score = self.user_media.filter(score__isnull=False).aggregate(Avg('score'))['score__avg']
-        self.score = avg_score
-        self.save()
-        return avg_score
+        self.score = Media.update_score(self.pk)
+        if getattr(self, '_loaded_values', None) is not None:
+            self._loaded_values['score'] = self.score
+        return self.score
+
+    @classmethod
+    def update_score(cls, media_id):
+        """Set a media's score to the average of its ratings in a single UPDATE statement.
+
+        Returns the new score.
+        """
+        from . import stats
+        from .cache import media_cache
+        from .live import publish_media_score
+
+        ratings = UserMedia.objects.filter(
+            media=OuterRef('pk'), score__isnull=False
+        ).order_by().values('media').annotate(avg=Avg('score')).values('avg')
+        current = cls.objects.filter(pk=media_id).values_list('score', flat=True)
+        with transaction.atomic():
+            old_score = current.first()
+            cls.objects.filter(pk=media_id).update(score=Subquery(ratings))
+            score = current.first()
+            if (old_score is None) != (score is None):
+                stats.rated_changed(media_id, 1 if old_score is None else -1)
+        transaction.on_commit(lambda: media_cache.invalidate(media_id))
+        publish_media_score(media_id, score)
+        return score
+
+    @classmethod
+    def recompute_scores(cls, start_id=None, end_id=None, media_type=None, media_ids=None):
+        """Recompute the average score of many media with set-based statements.
+
+        Limited to an id range, a media type and/or a list of ids. Returns the
+        number of media rows whose score changed. The statements are raw
+        SQLite SQL: UPDATE ... FROM needs SQLite 3.33+ and "IS NOT" is its
+        null-safe comparison. Other databases would need an ORM Subquery
+        version like update_score(), one correlated subquery per row.
+        """
+        if media_ids is not None:
+            media_ids = sorted(set(media_ids))
+            # Keep each IN list well below SQLite's bound parameter limit
+            return sum(
+                cls._recompute_scores(start_id, end_id, media_type, media_ids[start:start + 500])
+                for start in range(0, len(media_ids), 500)
+            )
+        return cls._recompute_scores(start_id, end_id, media_type)
+
+    @classmethod
+    def _recompute_scores(cls, start_id, end_id, media_type, media_ids=None):
+        media_table = connection.ops.quote_name(cls._meta.db_table)
+        user_media_table = connection.ops.quote_name(UserMedia._meta.db_table)
+
+        media_where, media_params = cls._score_range_filter(
+            f'{media_table}.id', start_id, end_id, media_type, f'{media_table}.media_type', media_ids
+        )
+        rating_where, rating_params = cls._score_range_filter('media_id', start_id, end_id, media_ids=media_ids)
+
+        with connection.cursor() as cursor:
+            # Media that lost all of their ratings go back to NULL
+            cursor.execute(
+                f'UPDATE {media_table} SET score = NULL '
+                f'WHERE score IS NOT NULL{media_where} AND NOT EXISTS ('
+                f'SELECT 1 FROM {user_media_table} um '
+                f'WHERE um.media_id = {media_table}.id AND um.score IS NOT NULL)',
+                media_params
+            )
+            cleared = cursor.rowcount
+            # Everything else gets the grouped average in a single pass
+            cursor.execute(
+                f'UPDATE {media_table} SET score = agg.avg_score '
+                f'FROM (SELECT media_id, AVG(score) AS avg_score FROM {user_media_table} '
+                f'WHERE score IS NOT NULL{rating_where} GROUP BY media_id) AS agg '
+                f'WHERE agg.media_id = {media_table}.id '
+                f'AND {media_table}.score IS NOT agg.avg_score{media_where}',
+                rating_params + media_params
+            )
+            return cleared + cursor.rowcount
+
+    @staticmethod
+    def _score_range_filter(id_column, start_id=None, end_id=None, media_type=None, type_column=None, media_ids=None):
+        """Build the extra WHERE conditions used by recompute_scores"""
+        conditions = []
+        params = []
+        if start_id is not None:
+            conditions.append(f'{id_column} >= %s')
+            params.append(start_id)
+        if end_id is not None:
+            conditions.append(f'{id_column} <= %s')
+            params.append(end_id)
+        if media_type:
+            conditions.append(f'{type_column} = %s')
+            params.append(media_type)
+        if media_ids is not None:
+            conditions.append(f'{id_column} IN ({", ".join(["%s"] * len(media_ids))})')
+            params.extend(media_ids)
+        return ''.join(f' AND {condition}' for condition in conditions), params
+
+    def _annotated_for(self, user):
+        """Check if with_rating_stats() already loaded this user's state and score"""
+        return getattr(self, 'stats_user_id', None) is not None and self.stats_user_id == user.pk
 
     def get_user_rating(self, user):
         """Get a specific user's rating for this media"""
+        if self._annotated_for(user):
+            return self.user_score
         try:
             return self.user_media.get(user=user).score
         except UserMedia.DoesNotExist:
@@ -59,10 +285,17 @@ class Media(models.Model):
 
     def has_user_rated(self, user):
         """Check if a user has rated this media"""
+        if self._annotated_for(user):
+            return self.user_score is not None
         return self.user_media.filter(user=user, score__isnull=False).exists()
 
     def get_rating_stats(self):
         """Get statistics about ratings"""
+        if hasattr(self, 'rating_count'):
+            return {
+                'average': self.rating_avg or 0,
+                'total': self.rating_count
+            }
         stats = self.user_media.filter(score__isnull=False).aggregate(
             avg_score=Avg('score'),
             total_ratings=Count('score')
@@ -72,28 +305,40 @@ class Media(models.Model):
             'total': stats['total_ratings'] or 0
         }
 
+    # MediaForm(check_catalog=False) clears this so validation runs no queries
+    check_catalog = True
+
     def clean(self):
         """Validate the model data"""
         if self.url and not self.url.startswith(('http://', 'https://')):
             raise ValidationError('URL must start with http:// or https://')
+        Media.validate_title(self.title, self.media_type, self.pk, check_duplicates=self.check_catalog)
+
+    @classmethod
+    def validate_title(cls, title, media_type, exclude_pk=None, check_duplicates=True):
+        """Reject titles that normalize to nothing or are already taken within the media type"""
+        if not normalize_title(title or ''):
+            raise ValidationError({'title': 'Title must contain letters or digits.'})
+        if check_duplicates and media_type and cls.find_duplicate(title, media_type, exclude_pk):
+            raise ValidationError({'title': f'A {media_type} with this exact title already exists.'})
 
     def __str__(self):
         return f"{self.title} ({self.media_type})"
 
-class UserMedia(models.Model):
+class UserMedia(TrackChangesMixin, models.Model):
     class MediaState(models.IntegerChoices):
         CHECK = 0, 'Check'      # Unknown/unrated state
         CHECKED = 1, 'Checked'  # Saved but not started
         VIEWING = 2, 'Viewing'  # Currently consuming
         DONE = 3, 'Done'        # Finished consuming
 
-    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='user_media')
+    # The (user, media) unique index and the collection index both lead with user
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='user_media', db_index=False)
     media = models.ForeignKey(Media, on_delete=models.CASCADE, related_name='user_media')
     added_at = models.DateTimeField(auto_now_add=True)
     state = models.IntegerField(
         choices=MediaState.choices,
-        default=MediaState.CHECK,
-        db_index=True
+        default=MediaState.CHECK
     )
     score = models.FloatField(
         null=True, 
@@ -109,20 +354,94 @@ class UserMedia(models.Model):
         unique_together = ('user', 'media')
         ordering = ['-updated_at']
         indexes = [
-            models.Index(fields=['user', 'media']),
-            models.Index(fields=['score']),
-            models.Index(fields=['state']),
+            # A user's collection filtered by state, newest first
+            models.Index(fields=['user', 'state', '-updated_at'], name='usermedia_user_state_upd_idx'),
+            # Rated rows of a media, covers the score aggregates
+            models.Index(
+                fields=['media', 'score'],
+                condition=Q(score__isnull=False),
+                name='usermedia_rated_by_media_idx'
+            ),
         ]
 
     def save(self, *args, **kwargs):
+        self._check_score(self.score)
+        changed = self.get_changed_fields()
+        if kwargs.get('update_fields') is not None:
+            changed = {name: value for name, value in changed.items() if name in kwargs['update_fields']}
+        creating = self._state.adding
+        # The event's old values: what the row held, also for the field that didn't change
+        loaded = getattr(self, '_loaded_values', None) or {}
+        old_state = changed['state'] if 'state' in changed else loaded.get('state')
+        old_score = changed['score'] if 'score' in changed else loaded.get('score')
+        super().save(*args, **kwargs)
+        # Update the media's average score only if the rating changed
+        if 'score' in changed and (self.score is not None or not creating):
+            from . import stats
+            from .autocomplete import title_index
+            stats.rating_changed(self.media_id, changed['score'], self.score)
+            title_index.rating_changed(self.media_id, changed['score'], self.score)
+            if UserMedia.media.is_cached(self):
+                self.media.calculate_score()
+            else:
+                Media.update_score(self.media_id)
+
+        if 'state' in changed or 'score' in changed:
+            from .events import event_log
+            from . import cursors
+            from .live import publish_user_media
+            event_log.record(self, old_state, old_score)
+            publish_user_media(self)
+            cursors.user_changed(self.user_id)
+
+    @staticmethod
+    def _check_score(score):
         # Only validate score if it's not None
-        if self.score is not None:
-            if self.score < 0 or self.score > 10:
+        if score is not None:
+            if score < 0 or score > 10:
                 raise ValueError("Score must be between 0 and 10")
-        super().save(*args, **kwargs)
-        # Update the media's average score if this is a rating
-        if self.score is not None:
-            self.media.calculate_score()
+
+    @classmethod
+    def upsert(cls, user, media_id, **values):
+        """Set the state and/or score of a user's entry, creating it if needed, in one transaction.
+
+        An existing entry goes through the change-tracking save, which writes
+        only the changed columns and nothing at all when the entry already
+        has these values. A new one is inserted with INSERT ... ON CONFLICT so
+        concurrent requests can't hit the unique constraint. The media score
+        is recomputed in the same transaction when the score changed. Returns
+        the entry.
+        """
+        from . import cursors, stats
+        from .autocomplete import title_index
+        from .events import event_log
+        from .live import publish_user_media
+
+        cls._check_score(values.get('score'))
+        with transaction.atomic():
+            entry = cls.objects.filter(user=user, media_id=media_id).first()
+            if entry is not None:
+                for field, value in values.items():
+                    setattr(entry, field, value)
+                entry.save()
+                return entry
+
+            cls.objects.bulk_create(
+                [cls(user=user, media_id=media_id, **values)],
+                update_conflicts=True,
+                unique_fields=['user', 'media'],
+                update_fields=[*values, 'updated_at'],
+            )
+            entry = cls.objects.get(user=user, media_id=media_id)
+
+            if entry.score is not None:
+                stats.rating_changed(media_id, None, entry.score)
+                title_index.rating_changed(media_id, None, entry.score)
+                Media.update_score(media_id)
+            event_log.record(entry, None, None)
+            publish_user_media(entry)
+            cursors.user_changed(entry.user_id)
+        return entry
 
     def get_rating_status(self):
         """Get the current rating status"""
@@ -144,3 +463,99 @@ class UserMedia(models.Model):
         state_str = f" [{self.get_state_display()}]"
         rating_str = f" rated {self.score}" if self.score is not None else ""
         return f"{self.user.username}'s {self.media.title}{state_str}{rating_str}"
+
+class UserMediaEvent(models.Model):
+    """Append-only log of state and score changes, folded into the daily rollups"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='media_events')
+    media = models.ForeignKey(Media, on_delete=models.CASCADE, related_name='events')
+    old_state = models.IntegerField(choices=UserMedia.MediaState.choices, null=True, blank=True)
+    new_state = models.IntegerField(choices=UserMedia.MediaState.choices)
+    old_score = models.FloatField(null=True, blank=True)
+    new_score = models.FloatField(null=True, blank=True)
+    created_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        ordering = ['created_at']
+
+    def __str__(self):
+        return f"{self.user_id} on {self.media_id}: {self.old_state}->{self.new_state}, {self.old_score}->{self.new_score}"
+
+class MediaDailyStats(models.Model):
+    """Ratings and state transitions of one media on one day"""
+    day = models.DateField()
+    media = models.ForeignKey(Media, on_delete=models.CASCADE, related_name='daily_stats')
+    rating_count = models.IntegerField(default=0)
+    score_sum = models.FloatField(default=0)
+    # {"<old_state>-><new_state>": count}, a created entry counts as "None-><state>"
+    state_transitions = models.JSONField(default=dict, blank=True)
+
+    class Meta:
+        ordering = ['day']
+        unique_together = ('media', 'day')
+
+    def __str__(self):
+        return f"{self.media_id} on {self.day}: {self.rating_count} ratings"
+
+class MediaTypeDailyStats(models.Model):
+    """Ratings and state transitions of one media type on one day"""
+    day = models.DateField()
+    media_type = models.CharField(max_length=50, choices=Media.MediaType.choices)
+    rating_count = models.IntegerField(default=0)
+    score_sum = models.FloatField(default=0)
+    state_transitions = models.JSONField(default=dict, blank=True)
+
+    class Meta:
+        ordering = ['day']
+        unique_together = ('media_type', 'day')
+
+    def __str__(self):
+        return f"{self.media_type} on {self.day}: {self.rating_count} ratings"
+
+class MediaTypeStats(models.Model):
+    """Catalog counters of one media type, kept current by media.stats"""
+    media_type = models.CharField(max_length=50, choices=Media.MediaType.choices, unique=True)
+    media_count = models.IntegerField(default=0)
+    # Media with at least one rating, i.e. a non-null score
+    rated_count = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.media_type}: {self.media_count} media, {self.rated_count} rated"
+
+class ScoreHistogramBucket(models.Model):
+    """Ratings of one media type in one 0.5-point score bucket, kept current by media.stats"""
+    media_type = models.CharField(max_length=50, choices=Media.MediaType.choices)
+    # Score * 2 rounded down: 0 holds [0, 0.5), 20 holds exactly 10
+    bucket = models.SmallIntegerField()
+    rating_count = models.IntegerField(default=0)
+
+    class Meta:
+        ordering = ['media_type', 'bucket']
+        unique_together = ('media_type', 'bucket')
+
+    def __str__(self):
+        return f"{self.media_type} {self.bucket / 2:.1f}: {self.rating_count}"
+
+class MediaNeighbor(models.Model):
+    """A media with similar plot and quotes, written by the build_neighbors command"""
+    # The (media, -score) index serves the lookups, no separate index on media
+    media = models.ForeignKey(Media, on_delete=models.CASCADE, related_name='neighbors', db_index=False)
+    neighbor = models.ForeignKey(Media, on_delete=models.CASCADE, related_name='+')
+    score = models.FloatField()
+
+    class Meta:
+        ordering = ['-score']
+        indexes = [
+            models.Index(fields=['media', '-score'], name='medianeighbor_media_score_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.media_id} ~ {self.neighbor_id}: {self.score:.3f}"
+
+class SyncCursor(models.Model):
+    """Version counter clients compare to know whether to sync, see media.cursors"""
+    # "catalog" or "user:<id>"
+    key = models.CharField(max_length=64, primary_key=True)
+    version = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.key}: {self.version}"
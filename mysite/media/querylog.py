@@ -0,0 +1,127 @@
+import atexit
+import json
+import random
+import re
+import threading
+import time
+import traceback
+from pathlib import Path
+
+from django.conf import settings
+
+# Samples kept per fingerprint between flushes, enough for a stable p95. Windows with
+# more executions keep a uniform reservoir sample of them.
+MAX_SAMPLES = 500
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PLACEHOLDER_LIST = re.compile(r'\((?:\s*(?:\?|%s)\s*,)+\s*(?:\?|%s)\s*\)')
+_WHITESPACE = re.compile(r'\s+')
+
+_APP_DIR = str(Path(__file__).resolve().parent)
+
+
+def fingerprint(sql):
+    """Normalize a statement so queries differing only in literals group together"""
+    sql = _STRING_LITERAL.sub('?', sql)
+    sql = _NUMBER_LITERAL.sub('?', sql)
+    sql = sql.replace('%s', '?')
+    # IN lists of any length are the same query shape
+    sql = _PLACEHOLDER_LIST.sub('(...)', sql)
+    return _WHITESPACE.sub(' ', sql).strip()
+
+
+def caller_location():
+    """First frame inside the media app (views, serializers, template tags...) that ran the query"""
+    for frame in reversed(traceback.extract_stack()[:-3]):
+        if frame.filename.startswith(_APP_DIR) and not frame.filename.endswith(('querylog.py', 'middleware.py')):
+            relative = Path(frame.filename).relative_to(Path(_APP_DIR).parent)
+            return f'{relative}:{frame.lineno} ({frame.name})'
+    return 'unknown'
+
+
+class SlowQueryStats:
+    """In-memory totals per fingerprint, appended to a JSON lines log every few seconds.
+
+    A timer flushes MEDIA_SLOW_QUERY_FLUSH_SECONDS after the first query of a
+    window is recorded, so a worker that goes quiet still writes what it saw.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._timer = None
+
+    def record(self, sql, duration, view_name, location):
+        key = fingerprint(sql)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = {
+                    'fingerprint': key,
+                    'count': 0,
+                    'total': 0.0,
+                    'samples': [],
+                    'views': set(),
+                    'locations': set(),
+                }
+            entry['count'] += 1
+            entry['total'] += duration
+            if len(entry['samples']) < MAX_SAMPLES:
+                entry['samples'].append(round(duration, 6))
+            else:
+                # Reservoir sampling: every execution of the window is equally likely to be kept
+                slot = random.randrange(entry['count'])
+                if slot < MAX_SAMPLES:
+                    entry['samples'][slot] = round(duration, 6)
+            entry['views'].add(view_name)
+            entry['locations'].add(location)
+            if self._timer is None:
+                self._timer = threading.Timer(getattr(settings, 'MEDIA_SLOW_QUERY_FLUSH_SECONDS', 30), self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self):
+        with self._lock:
+            entries = self._entries
+            self._entries = {}
+            timer, self._timer = self._timer, None
+        if timer is not None:
+            timer.cancel()
+        if not entries:
+            return
+
+        path = Path(getattr(settings, 'MEDIA_SLOW_QUERY_LOG', settings.BASE_DIR / 'slow_queries.log'))
+        path.parent.mkdir(parents=True, exist_ok=True)
+        flushed_at = time.time()
+        with path.open('a') as log:
+            for entry in entries.values():
+                log.write(json.dumps({
+                    **entry,
+                    'views': sorted(entry['views']),
+                    'locations': sorted(entry['locations']),
+                    'flushed_at': flushed_at,
+                }) + '\n')
+
+
+slow_query_stats = SlowQueryStats()
+atexit.register(slow_query_stats.flush)
+
+
+class SlowQueryLogger:
+    """Database execute wrapper recording statements slower than MEDIA_SLOW_QUERY_THRESHOLD_MS"""
+
+    def __init__(self, request):
+        self.request = request
+        self.threshold = getattr(settings, 'MEDIA_SLOW_QUERY_THRESHOLD_MS', 50) / 1000
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            if duration >= self.threshold:
+                match = getattr(self.request, 'resolver_match', None)
+                view_name = match.view_name if match else self.request.path
+                slow_query_stats.record(sql, duration, view_name, caller_location())
@@ -1,12 +1,32 @@
+from django.core.exceptions import ValidationError as DjangoValidationError
 from rest_framework import serializers
+from .cache import media_cache
 from .models import Media, UserMedia, User
+from .timing import TimedSerializerMixin
+
+class MediaSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    # Filled from Media.objects.with_rating_stats() annotations, skipped when absent
+    rating_count = serializers.IntegerField(read_only=True)
+    rating_avg = serializers.FloatField(read_only=True)
+    user_state = serializers.IntegerField(read_only=True)
+    user_score = serializers.FloatField(read_only=True)
 
-class MediaSerializer(serializers.ModelSerializer):
     class Meta:
         model = Media
-        fields = ['id', 'title', 'media_type', 'url', 'plot', 'chapters', 'quotes', 'score', 'created_at']
+        fields = ['id', 'title', 'media_type', 'url', 'plot', 'chapters', 'quotes', 'score', 'created_at',
+                  'rating_count', 'rating_avg', 'user_state', 'user_score']
+
+    def validate(self, attrs):
+        # Renames through PUT/PATCH are checked too, not only creation
+        title = attrs.get('title', getattr(self.instance, 'title', ''))
+        media_type = attrs.get('media_type') or getattr(self.instance, 'media_type', Media.MediaType.CINEMA)
+        try:
+            Media.validate_title(title, media_type, getattr(self.instance, 'pk', None))
+        except DjangoValidationError as error:
+            raise serializers.ValidationError(error.message_dict)
+        return attrs
 
-class UserMediaSerializer(serializers.ModelSerializer):
+class UserMediaSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     media = MediaSerializer(read_only=True)
     media_id = serializers.IntegerField(write_only=True, required=True)
     
@@ -15,22 +35,17 @@ class UserMediaSerializer(serializers.ModelSerializer):
         fields = ['id', 'media', 'media_id', 'state', 'score', 'added_at', 'updated_at']
     
     def validate_media_id(self, value):
-        try:
-            Media.objects.get(id=value)
-            return value
-        except Media.DoesNotExist:
+        if media_cache.get(value) is None:
             raise serializers.ValidationError("Media with this ID does not exist")
+        return value
     
     def create(self, validated_data):
         media_id = validated_data.pop('media_id')
-        media = Media.objects.get(id=media_id)
-        return UserMedia.objects.create(
-            user=self.context['request'].user,
-            media=media,
-            **validated_data
-        )
+        user_media = UserMedia.upsert(self.context['request'].user, media_id, **validated_data)
+        user_media.media = media_cache.get(media_id)
+        return user_media
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ['id', 'username', 'email'] 
\ No newline at end of file
@@ -0,0 +1,83 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import cursors, stats
+from .autocomplete import title_index
+from .cache import media_cache
+from .live import CATALOG, broker, publish_user_media
+from .models import Media, UserMedia
+
+
+@receiver(post_save, sender=Media)
+def index_saved_media(sender, instance, **kwargs):
+    title_index.add(instance)
+
+
+@receiver(post_delete, sender=Media)
+def unindex_deleted_media(sender, instance, **kwargs):
+    title_index.remove(instance.pk)
+
+
+@receiver(post_save, sender=Media)
+@receiver(post_delete, sender=Media)
+def invalidate_cached_media(sender, instance, **kwargs):
+    media_id = instance.pk
+    media_cache.invalidate(media_id)
+    # A read that misses before the commit still loads the old row; drop it once the write is visible
+    transaction.on_commit(lambda: media_cache.invalidate(media_id))
+
+
+@receiver(post_save, sender=Media)
+def publish_created_media(sender, instance, created, **kwargs):
+    if created:
+        broker.publish_on_commit(CATALOG, 'media', {
+            'id': instance.pk,
+            'title': instance.title,
+            'media_type': instance.media_type,
+            'score': instance.score,
+        })
+
+
+@receiver(post_delete, sender=Media)
+def publish_deleted_media(sender, instance, **kwargs):
+    broker.publish_on_commit(CATALOG, 'media.deleted', {'id': instance.pk})
+
+
+@receiver(post_delete, sender=UserMedia)
+def publish_deleted_user_media(sender, instance, **kwargs):
+    publish_user_media(instance, deleted=True)
+
+
+@receiver(post_save, sender=Media)
+def count_created_media(sender, instance, created, **kwargs):
+    if created:
+        stats.media_added(instance.media_type)
+
+
+@receiver(post_delete, sender=Media)
+def count_deleted_media(sender, instance, **kwargs):
+    stats.media_removed(instance.media_type, instance.score is not None)
+
+
+@receiver(post_delete, sender=UserMedia)
+def count_deleted_rating(sender, instance, **kwargs):
+    stats.rating_changed(instance.media_id, instance.score, None)
+    title_index.rating_changed(instance.media_id, instance.score, None)
+
+
+@receiver(post_save, sender=Media)
+def bump_catalog_cursor(sender, instance, created, update_fields=None, **kwargs):
+    # Not for score-only saves: the score follows nearly every rating and isn't catalog data
+    if created or update_fields is None or set(update_fields) - {'score'}:
+        cursors.catalog_changed()
+
+
+@receiver(post_delete, sender=Media)
+def bump_catalog_cursor_on_delete(sender, instance, **kwargs):
+    cursors.catalog_changed()
+
+
+@receiver(post_delete, sender=UserMedia)
+def bump_user_cursor(sender, instance, **kwargs):
+    cursors.user_changed(instance.user_id)
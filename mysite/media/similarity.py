@@ -0,0 +1,113 @@
+import heapq
+import math
+import re
+from collections import Counter, defaultdict
+
+try:
+    import numpy as np
+except ImportError:  # Optional: the pure Python path gives the same results, only slower
+    np = None
+
+WORD_RE = re.compile(r'[^\W\d_]{3,}')
+
+
+def media_terms(plot, quotes):
+    """Term counts of a media's plot and quotes"""
+    parts = [plot or '']
+    parts.extend(quote for quote in quotes or [] if isinstance(quote, str))
+    return Counter(WORD_RE.findall(' '.join(parts).lower()))
+
+
+def tfidf(documents, max_features=4096, max_df=0.5):
+    """L2-normalized TF-IDF vectors as {term index: weight}, plus the vocabulary size.
+
+    Only terms found in at least two documents and at most max_df of them are
+    kept, since other terms can't make two documents similar or say little
+    about them. The norm still covers every term of the document.
+    """
+    document_frequency = Counter()
+    for terms in documents:
+        document_frequency.update(terms.keys())
+
+    count = len(documents)
+    candidates = [
+        term for term, frequency in document_frequency.items()
+        if frequency >= 2 and frequency <= max(2, max_df * count)
+    ]
+    candidates.sort(key=lambda term: (-document_frequency[term], term))
+    vocabulary = {term: index for index, term in enumerate(candidates[:max_features])}
+
+    vectors = []
+    for terms in documents:
+        weights = {
+            term: (1 + math.log(occurrences)) * (math.log((1 + count) / (1 + document_frequency[term])) + 1)
+            for term, occurrences in terms.items()
+        }
+        norm = math.sqrt(sum(weight * weight for weight in weights.values())) or 1.0
+        vectors.append({
+            vocabulary[term]: weight / norm for term, weight in weights.items() if term in vocabulary
+        })
+    return vectors, len(vocabulary)
+
+
+def nearest_neighbors(vectors, dimensions, rows, k, floors=None):
+    """Top-k cosine neighbors of the given rows.
+
+    Returns ({row: [(other, score), ...]}, reverse). When floors (one score per
+    row of vectors) is given, reverse lists the (other, row, score) pairs where
+    row would enter other's neighbors because score beats floors[other].
+    """
+    if np is not None and dimensions:
+        return _nearest_numpy(vectors, dimensions, rows, k, floors)
+    return _nearest_python(vectors, rows, k, floors)
+
+
+def _nearest_numpy(vectors, dimensions, rows, k, floors, chunk_size=256):
+    matrix = np.zeros((len(vectors), dimensions), dtype=np.float32)
+    for index, vector in enumerate(vectors):
+        if vector:
+            matrix[index, list(vector.keys())] = list(vector.values())
+    floor_array = None if floors is None else np.asarray(floors, dtype=np.float32)
+
+    neighbors, reverse = {}, []
+    rows = np.asarray(rows, dtype=np.int64)
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start:start + chunk_size]
+        scores = matrix[chunk] @ matrix.T
+        scores[np.arange(len(chunk)), chunk] = 0
+        top = min(k, scores.shape[1] - 1)
+        if top > 0:
+            best = np.argpartition(-scores, top - 1, axis=1)[:, :top]
+            for position, row in enumerate(chunk):
+                picked = best[position]
+                picked = picked[np.argsort(-scores[position, picked], kind='stable')]
+                neighbors[int(row)] = [
+                    (int(other), float(scores[position, other]))
+                    for other in picked if scores[position, other] > 0
+                ]
+        if floor_array is not None:
+            positions, others = np.nonzero(scores > floor_array[None, :])
+            reverse.extend(
+                (int(other), int(chunk[position]), float(scores[position, other]))
+                for position, other in zip(positions, others)
+            )
+    return neighbors, reverse
+
+
+def _nearest_python(vectors, rows, k, floors):
+    postings = defaultdict(list)
+    for index, vector in enumerate(vectors):
+        for term, weight in vector.items():
+            postings[term].append((index, weight))
+
+    neighbors, reverse = {}, []
+    for row in rows:
+        scores = defaultdict(float)
+        for term, weight in vectors[row].items():
+            for other, other_weight in postings[term]:
+                scores[other] += weight * other_weight
+        scores.pop(row, None)
+        neighbors[row] = heapq.nlargest(k, scores.items(), key=lambda item: (item[1], -item[0]))
+        if floors is not None:
+            reverse.extend((other, row, score) for other, score in scores.items() if score > floors[other])
+    return neighbors, reverse
@@ -0,0 +1,177 @@
+from collections import Counter
+
+from django.apps import apps as global_apps
+from django.db import transaction
+from django.db.models import Count, F, Q, Subquery
+
+BUCKETS = 21
+
+
+def score_bucket(score):
+    """0.5-point bucket of a score, None for no score"""
+    if score is None:
+        return None
+    return min(int(score * 2), BUCKETS - 1)
+
+
+def _models():
+    return [global_apps.get_model('media', name) for name in ('Media', 'UserMedia', 'MediaTypeStats', 'ScoreHistogramBucket')]
+
+
+def _bump(model, lookup, deltas, media_id=None):
+    """Add deltas to the counters of one row with a single UPDATE, creating the row if missing.
+
+    With media_id, the row's media_type is looked up from that media inside the UPDATE.
+    """
+    changes = {field: F(field) + delta for field, delta in deltas.items() if delta}
+    if not changes:
+        return
+    if media_id is not None:
+        Media = global_apps.get_model('media', 'Media')
+        media_type = Subquery(Media.objects.filter(pk=media_id).values('media_type')[:1])
+        if model.objects.filter(media_type=media_type, **lookup).update(**changes):
+            return
+        media_type = Media.objects.filter(pk=media_id).values_list('media_type', flat=True).first()
+        if media_type is None:
+            return
+        lookup = {**lookup, 'media_type': media_type}
+    elif model.objects.filter(**lookup).update(**changes):
+        return
+    with transaction.atomic():
+        model.objects.get_or_create(**lookup)
+    model.objects.filter(**lookup).update(**changes)
+
+
+def media_added(media_type, count=1):
+    _, _, MediaTypeStats, _ = _models()
+    _bump(MediaTypeStats, {'media_type': media_type}, {'media_count': count})
+
+
+def media_removed(media_type, rated):
+    _, _, MediaTypeStats, _ = _models()
+    _bump(MediaTypeStats, {'media_type': media_type}, {'media_count': -1, 'rated_count': -1 if rated else 0})
+
+
+def rated_changed(media_id, delta):
+    """A media gained (+1) or lost (-1) its last rating"""
+    _, _, MediaTypeStats, _ = _models()
+    _bump(MediaTypeStats, {}, {'rated_count': delta}, media_id=media_id)
+
+
+def rating_changed(media_id, old_score, new_score):
+    old_bucket, new_bucket = score_bucket(old_score), score_bucket(new_score)
+    if old_bucket == new_bucket:
+        return
+    _, _, _, ScoreHistogramBucket = _models()
+    for bucket, delta in ((old_bucket, -1), (new_bucket, 1)):
+        if bucket is not None:
+            _bump(ScoreHistogramBucket, {'bucket': bucket}, {'rating_count': delta}, media_id=media_id)
+
+
+def bulk_changed(rating_changes=(), score_changes=()):
+    """Apply many rating_changed() and rated_changed() deltas with one UPDATE per counter row touched.
+
+    Both are (media_id, old_score, new_score) triples: rating_changes of
+    ratings, score_changes of media scores.
+    """
+    Media, _, MediaTypeStats, ScoreHistogramBucket = _models()
+    rating_changes, score_changes = list(rating_changes), list(score_changes)
+    media_ids = sorted({change[0] for change in rating_changes} | {change[0] for change in score_changes})
+    media_types = {}
+    # Keep each IN list well below SQLite's bound parameter limit
+    for start in range(0, len(media_ids), 500):
+        media_types.update(
+            Media.objects.filter(pk__in=media_ids[start:start + 500]).values_list('pk', 'media_type')
+        )
+
+    buckets = Counter()
+    for media_id, old_score, new_score in rating_changes:
+        old_bucket, new_bucket = score_bucket(old_score), score_bucket(new_score)
+        if media_id not in media_types or old_bucket == new_bucket:
+            continue
+        if old_bucket is not None:
+            buckets[media_types[media_id], old_bucket] -= 1
+        if new_bucket is not None:
+            buckets[media_types[media_id], new_bucket] += 1
+    rated = Counter()
+    for media_id, old_score, new_score in score_changes:
+        if media_id in media_types and (old_score is None) != (new_score is None):
+            rated[media_types[media_id]] += 1 if old_score is None else -1
+
+    for (media_type, bucket), delta in buckets.items():
+        _bump(ScoreHistogramBucket, {'media_type': media_type, 'bucket': bucket}, {'rating_count': delta})
+    for media_type, delta in rated.items():
+        _bump(MediaTypeStats, {'media_type': media_type}, {'rated_count': delta})
+
+
+def media_type_changed(media, old_type):
+    """Move a media and its ratings from one type's counters to another's"""
+    _, UserMedia, MediaTypeStats, ScoreHistogramBucket = _models()
+    rated = 1 if media.score is not None else 0
+    _bump(MediaTypeStats, {'media_type': old_type}, {'media_count': -1, 'rated_count': -rated})
+    _bump(MediaTypeStats, {'media_type': media.media_type}, {'media_count': 1, 'rated_count': rated})
+    for score in UserMedia.objects.filter(media=media, score__isnull=False).values_list('score', flat=True):
+        bucket = score_bucket(score)
+        _bump(ScoreHistogramBucket, {'media_type': old_type, 'bucket': bucket}, {'rating_count': -1})
+        _bump(ScoreHistogramBucket, {'media_type': media.media_type, 'bucket': bucket}, {'rating_count': 1})
+
+
+def rebuild():
+    """Recompute every counter from the Media and UserMedia tables"""
+    Media, UserMedia, MediaTypeStats, ScoreHistogramBucket = _models()
+    media_types = [value for value, _ in Media._meta.get_field('media_type').choices]
+
+    counts = {
+        row['media_type']: row
+        for row in Media.objects.order_by().values('media_type').annotate(
+            total=Count('pk'), rated=Count('pk', filter=Q(score__isnull=False))
+        )
+    }
+    histogram = {media_type: [0] * BUCKETS for media_type in media_types}
+    ratings = UserMedia.objects.filter(score__isnull=False).order_by().values_list(
+        'media__media_type', 'score'
+    ).annotate(total=Count('pk'))
+    for media_type, score, total in ratings:
+        histogram.setdefault(media_type, [0] * BUCKETS)[score_bucket(score)] += total
+
+    with transaction.atomic():
+        MediaTypeStats.objects.all().delete()
+        ScoreHistogramBucket.objects.all().delete()
+        MediaTypeStats.objects.bulk_create([
+            MediaTypeStats(
+                media_type=media_type,
+                media_count=counts.get(media_type, {}).get('total', 0),
+                rated_count=counts.get(media_type, {}).get('rated', 0),
+            )
+            for media_type in sorted(set(media_types) | counts.keys())
+        ])
+        ScoreHistogramBucket.objects.bulk_create([
+            ScoreHistogramBucket(media_type=media_type, bucket=bucket, rating_count=total)
+            for media_type, totals in histogram.items()
+            for bucket, total in enumerate(totals)
+        ])
+
+
+def snapshot():
+    """Catalog counters and score histograms per media type, read from the two small stats tables"""
+    _, _, MediaTypeStats, ScoreHistogramBucket = _models()
+    types = {}
+    for row in MediaTypeStats.objects.values('media_type', 'media_count', 'rated_count'):
+        types[row['media_type']] = {
+            'media': row['media_count'],
+            'rated': row['rated_count'],
+            'unrated': row['media_count'] - row['rated_count'],
+            'histogram': {f'{bucket / 2:.1f}': 0 for bucket in range(BUCKETS)},
+        }
+    for media_type, bucket, rating_count in ScoreHistogramBucket.objects.values_list(
+        'media_type', 'bucket', 'rating_count'
+    ):
+        if media_type in types:
+            types[media_type]['histogram'][f'{bucket / 2:.1f}'] = rating_count
+    for values in types.values():
+        values['ratings'] = sum(values['histogram'].values())
+
+    total = {
+        key: sum(values[key] for values in types.values()) for key in ('media', 'rated', 'unrated', 'ratings')
+    }
+    return {'types': types, 'total': total}
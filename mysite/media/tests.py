@@ -1,3 +1,1401 @@
-from django.test import TestCase
+import asyncio
+import csv
+import io
+import json
+import os
+import random
+import tempfile
+import time
+import unittest
+from collections import Counter
+from datetime import timedelta
+from difflib import SequenceMatcher
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import AnonymousUser
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.db.models import Avg, Count
+from django.test import AsyncClient, Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.test import APIClient
+
+from .admin import estimated_count
+from .autocomplete import TitleIndex, title_index
+from .cache import MediaCache, media_cache
+from .events import EventLog, event_log
+from .forms import MediaForm, TitleMatcher
+from .live import CATALOG, EventBroker, broker, user_channel
+from .middleware import ProfilingMiddleware
+from .models import (
+    Media, MediaDailyStats, MediaNeighbor, MediaTypeDailyStats, SyncCursor, User, UserMedia, UserMediaEvent, normalize_title
+)
+from . import cursors, similarity, stats
+from .querylog import MAX_SAMPLES, SlowQueryStats, fingerprint
+from .views import UserMediaViewSet
+from .warmup import warm_up
+
+
+class HotQueryPlanTests(TestCase):
+    """Hot queries must be served from an index, never a full table scan"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='planner')
+        cls.media = Media.objects.create(title='Inception', media_type=Media.MediaType.CINEMA)
+        UserMedia.objects.create(user=cls.user, media=cls.media, state=UserMedia.MediaState.DONE, score=9)
+
+    def query_plan(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            return [row[-1] for row in cursor.fetchall()]
+
+    def assertNoFullScan(self, queryset, table=UserMedia._meta.db_table):
+        plan = self.query_plan(queryset)
+        for step in plan:
+            if step.startswith(f'SCAN {table}') and 'INDEX' not in step:
+                self.fail(f'Full scan of {table}: {plan}')
+        return plan
+
+    def test_collection_by_state_uses_collection_index(self):
+        queryset = UserMedia.objects.filter(
+            user=self.user, state=UserMedia.MediaState.DONE
+        ).order_by('-updated_at')
+        plan = self.assertNoFullScan(queryset)
+        self.assertTrue(any('usermedia_user_state_upd_idx' in step for step in plan), plan)
+        # The index order serves ORDER BY updated_at, no sort step needed
+        self.assertFalse(any('TEMP B-TREE' in step for step in plan), plan)
+
+    def test_collection_page_query(self):
+        queryset = UserMedia.objects.filter(
+            user=self.user
+        ).exclude(
+            state=UserMedia.MediaState.CHECK
+        ).select_related('media')
+        self.assertNoFullScan(queryset)
+
+    def test_collection_export_query(self):
+        queryset = UserMedia.objects.filter(
+            user=self.user
+        ).exclude(
+            state=UserMedia.MediaState.CHECK
+        ).order_by('-updated_at').values_list('media__title', 'state', 'score')
+        self.assertNoFullScan(queryset)
+
+    def test_rating_aggregate_uses_partial_index(self):
+        queryset = UserMedia.objects.filter(media=self.media, score__isnull=False)
+        plan = self.assertNoFullScan(queryset.values('media').annotate(avg=Avg('score'), total=Count('score')))
+        self.assertTrue(any('usermedia_rated_by_media_idx' in step for step in plan), plan)
+
+    def test_own_entry_lookup(self):
+        queryset = UserMedia.objects.filter(user=self.user, media=self.media)
+        self.assertNoFullScan(queryset)
+
+    def test_media_list_with_rating_stats(self):
+        queryset = Media.objects.with_rating_stats(self.user)
+        self.assertNoFullScan(queryset)
+
+    def test_duplicate_title_lookup(self):
+        queryset = Media.objects.filter(normalized_title='inception', media_type=Media.MediaType.CINEMA)
+        self.assertNoFullScan(queryset, Media._meta.db_table)
+
+    def test_similar_media_uses_neighbor_index(self):
+        queryset = MediaNeighbor.objects.filter(media=self.media).select_related('neighbor').order_by('-score')[:10]
+        plan = self.assertNoFullScan(queryset, MediaNeighbor._meta.db_table)
+        self.assertTrue(any('medianeighbor_media_score_idx' in step for step in plan), plan)
+        self.assertFalse(any('TEMP B-TREE' in step for step in plan), plan)
+
+
+class RecomputeScoresTests(TestCase):
+    """The set-based recompute must agree with the per-media update_score()"""
+
+    @classmethod
+    def setUpTestData(cls):
+        users = User.objects.bulk_create([User(username=f'rater{i}') for i in range(3)])
+        cls.media = [
+            Media.objects.create(title=f'Film {i}', media_type=Media.MediaType.CINEMA) for i in range(4)
+        ]
+        scores = {0: [8, 6, 7], 1: [None, 5, None], 2: [None, None, None], 3: []}
+        UserMedia.objects.bulk_create([
+            UserMedia(user=users[index], media=cls.media[media_index], state=UserMedia.MediaState.DONE, score=score)
+            for media_index, media_scores in scores.items()
+            for index, score in enumerate(media_scores)
+        ])
+
+    def test_matches_update_score(self):
+        # Stale scores: missing, wrong, and set on media without ratings
+        Media.objects.filter(pk=self.media[0].pk).update(score=None)
+        Media.objects.filter(pk=self.media[1].pk).update(score=9)
+        Media.objects.filter(pk__in=[self.media[2].pk, self.media[3].pk]).update(score=4)
+
+        changed = Media.recompute_scores()
+        recomputed = dict(Media.objects.values_list('pk', 'score'))
+        self.assertEqual(changed, 4)
+        self.assertEqual(Media.recompute_scores(), 0)
+
+        for media in self.media:
+            self.assertEqual(recomputed[media.pk], Media.update_score(media.pk))
+        self.assertEqual(recomputed[self.media[0].pk], 7)
+        self.assertIsNone(recomputed[self.media[3].pk])
+
+    def test_id_range(self):
+        Media.objects.update(score=None)
+        changed = Media.recompute_scores(self.media[1].pk, self.media[1].pk)
+        self.assertEqual(changed, 1)
+        self.assertIsNone(Media.objects.get(pk=self.media[0].pk).score)
+        self.assertEqual(Media.objects.get(pk=self.media[1].pk).score, 5)
+
+    def test_media_ids(self):
+        Media.objects.update(score=1)
+        self.assertEqual(Media.recompute_scores(media_ids=[self.media[0].pk, self.media[3].pk]), 2)
+        self.assertEqual(
+            list(Media.objects.order_by('pk').values_list('score', flat=True)), [7, 1, 1, None]
+        )
+        self.assertEqual(Media.recompute_scores(media_ids=[]), 0)
+
+
+class RatingStatsTests(TestCase):
+    """with_rating_stats() annotations must match the ratings they summarize"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = User.objects.bulk_create([User(username=f'stats{i}') for i in range(3)])
+        cls.rated = Media.objects.create(title='Alien', media_type=Media.MediaType.CINEMA)
+        cls.unrated = Media.objects.create(title='Akira', media_type=Media.MediaType.MANGA)
+        UserMedia.objects.bulk_create([
+            UserMedia(user=cls.users[0], media=cls.rated, state=UserMedia.MediaState.DONE, score=9),
+            UserMedia(user=cls.users[1], media=cls.rated, state=UserMedia.MediaState.DONE, score=6),
+            UserMedia(user=cls.users[2], media=cls.rated, state=UserMedia.MediaState.VIEWING),
+            UserMedia(user=cls.users[0], media=cls.unrated, state=UserMedia.MediaState.CHECKED),
+        ])
+
+    def test_annotations_match_ratings(self):
+        media = {item.pk: item for item in Media.objects.with_rating_stats(self.users[0])}
+        for pk, item in media.items():
+            ratings = list(UserMedia.objects.filter(media_id=pk, score__isnull=False).values_list('score', flat=True))
+            self.assertEqual(item.rating_count, len(ratings))
+            self.assertEqual(item.rating_avg, sum(ratings) / len(ratings) if ratings else None)
+            own = UserMedia.objects.filter(media_id=pk, user=self.users[0]).first()
+            self.assertEqual(item.user_state, own.state if own else None)
+            self.assertEqual(item.user_score, own.score if own else None)
+
+        self.assertEqual(media[self.rated.pk].rating_avg, 7.5)
+        self.assertEqual(media[self.unrated.pk].user_state, UserMedia.MediaState.CHECKED)
+
+    def test_helpers_use_annotations(self):
+        item = Media.objects.with_rating_stats(self.users[1]).get(pk=self.rated.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(item.get_rating_stats(), {'average': 7.5, 'total': 2})
+            self.assertEqual(item.get_user_rating(self.users[1]), 6)
+            self.assertTrue(item.has_user_rated(self.users[1]))
+        # Another user's state is not annotated and falls back to a query
+        with self.assertNumQueries(1):
+            self.assertIsNone(item.get_user_rating(self.users[2]))
+
+    def test_anonymous_has_no_user_fields(self):
+        item = Media.objects.with_rating_stats(AnonymousUser()).get(pk=self.rated.pk)
+        self.assertEqual(item.rating_count, 2)
+        self.assertFalse(hasattr(item, 'user_state'))
+
+
+class CatalogStatsTests(TestCase):
+    """The counters kept up to date by deltas must match a full rebuild after every kind of write"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = User.objects.bulk_create([User(username=f'counted{i}') for i in range(2)])
+        cls.movie = Media.objects.create(title='Heat', media_type=Media.MediaType.CINEMA)
+        cls.show = Media.objects.create(title='The Wire', media_type=Media.MediaType.SERIES)
+        UserMedia.objects.create(user=cls.users[0], media=cls.movie, state=UserMedia.MediaState.DONE, score=8)
+        UserMedia.objects.create(user=cls.users[1], media=cls.movie, state=UserMedia.MediaState.DONE, score=6.5)
+
+    def assertMatchesRebuild(self):
+        kept = stats.snapshot()
+        stats.rebuild()
+        self.assertEqual(kept, stats.snapshot())
+
+    def test_setup_matches_rebuild(self):
+        self.assertEqual(stats.snapshot()['total'], {'media': 2, 'rated': 1, 'unrated': 1, 'ratings': 2})
+        self.assertMatchesRebuild()
+
+    def test_create(self):
+        Media.objects.create(title='Berserk', media_type=Media.MediaType.MANGA)
+        self.assertMatchesRebuild()
+        UserMedia.objects.create(user=self.users[0], media=self.show, state=UserMedia.MediaState.DONE, score=9)
+        self.assertMatchesRebuild()
+        UserMedia.objects.create(user=self.users[1], media=self.show, state=UserMedia.MediaState.VIEWING)
+        self.assertMatchesRebuild()
+
+    def test_rescore(self):
+        entry = UserMedia.objects.get(user=self.users[0], media=self.movie)
+        entry.score = 2
+        entry.save()
+        self.assertMatchesRebuild()
+        entry.score = None
+        entry.save()
+        self.assertMatchesRebuild()
+        UserMedia.objects.filter(media=self.movie, score__isnull=False).get().delete()
+        self.assertMatchesRebuild()
+
+    def test_type_change(self):
+        movie = Media.objects.get(pk=self.movie.pk)
+        movie.media_type = Media.MediaType.SERIES
+        movie.save()
+        self.assertMatchesRebuild()
+        self.assertEqual(stats.snapshot()['types'][Media.MediaType.SERIES]['ratings'], 2)
+
+    def test_delete_cascade(self):
+        Media.objects.get(pk=self.movie.pk).delete()
+        self.assertMatchesRebuild()
+        self.assertEqual(stats.snapshot()['total'], {'media': 1, 'rated': 0, 'unrated': 1, 'ratings': 0})
+        self.users[0].delete()
+        self.assertMatchesRebuild()
+
+
+class FindDuplicatesCommandTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.keep = Media.objects.create(title='The Matrix Reloaded', media_type=Media.MediaType.CINEMA)
+        cls.duplicate = Media.objects.create(title='The Matrix Reloadd', media_type=Media.MediaType.CINEMA)
+        Media.objects.create(title='The Matrix Reloaded', media_type=Media.MediaType.MANGA)
+        Media.objects.create(title='Spirited Away', media_type=Media.MediaType.CINEMA)
+        UserMedia.objects.create(
+            user=User.objects.create(username='dup'), media=cls.duplicate, state=UserMedia.MediaState.DONE, score=8
+        )
+
+    def run_command(self, *args):
+        out = io.StringIO()
+        call_command('find_duplicates', '--workers', '1', *args, stdout=out, stderr=io.StringIO())
+        return out.getvalue()
+
+    def test_json_report(self):
+        pairs = json.loads(self.run_command('--format', 'json'))
+        self.assertEqual(len(pairs), 1)
+        # Only within a media type; the rated entry is the one to keep
+        self.assertEqual(pairs[0]['media_type'], Media.MediaType.CINEMA)
+        self.assertEqual(pairs[0]['keep_id'], self.duplicate.pk)
+        self.assertEqual(pairs[0]['duplicate_id'], self.keep.pk)
+
+    def test_csv_report(self):
+        rows = list(csv.DictReader(io.StringIO(self.run_command())))
+        self.assertEqual([(int(row['keep_id']), int(row['duplicate_id'])) for row in rows],
+                         [(self.duplicate.pk, self.keep.pk)])
+
+    def test_threshold(self):
+        self.assertEqual(json.loads(self.run_command('--format', 'json', '--threshold', '0.99')), [])
+
+    def test_runs_without_the_normalized_title_column(self):
+        # Migration 0008 sends here when it finds duplicates, before the column exists
+        with CaptureQueriesContext(connection) as queries:
+            self.run_command()
+        self.assertFalse(any('normalized_title' in query['sql'] for query in queries.captured_queries))
+
+
+class TitleIndexTests(TestCase):
+    def make_index(self, rows):
+        index = TitleIndex()
+        index.load(rows)
+        return index
+
+    def row(self, media_id, title, media_type=Media.MediaType.CINEMA, rating_count=0):
+        return (media_id, title, media_type, normalize_title(title), rating_count)
+
+    def test_prefix_and_infix_ranked_by_rating_count(self):
+        index = self.make_index([
+            self.row(1, 'Star Wars', rating_count=5),
+            self.row(2, 'Starship Troopers', rating_count=9),
+            self.row(3, 'Lone Star', rating_count=1),
+            self.row(4, 'Star Wars', Media.MediaType.MUSIC, rating_count=50),
+        ])
+        self.assertEqual([item['id'] for item in index.search('star', Media.MediaType.CINEMA)], [2, 1, 3])
+        self.assertEqual([item['id'] for item in index.search('STAR')], [4, 2, 1, 3])
+        self.assertEqual([item['id'] for item in index.search('wars', limit=1)], [4])
+        self.assertEqual(index.search('!!'), [])
+
+    def test_top_n_covers_every_match(self):
+        # The best rated match sorts last alphabetically, far past the first CACHE_THRESHOLD keys
+        rows = [self.row(media_id, f'Aardvark {media_id:05d}') for media_id in range(1, 3001)]
+        rows.append(self.row(5000, 'Azure', rating_count=3))
+        index = self.make_index(rows)
+        self.assertEqual(index.search('a', limit=1)[0]['id'], 5000)
+        self.assertIn((Media.MediaType.CINEMA, 'a'), index._ranked)
+
+    def test_cached_rankings_follow_rating_changes(self):
+        rows = [self.row(media_id, f'Title {media_id:05d}', rating_count=1) for media_id in range(1, 2001)]
+        index = self.make_index(rows)
+        self.assertEqual(index.search('t', limit=1)[0]['id'], 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            index.rating_changed(1500, None, 8)
+        self.assertEqual(index.search('t', limit=2)[0], {
+            'id': 1500, 'title': 'Title 01500', 'media_type': Media.MediaType.CINEMA, 'rating_count': 2
+        })
+
+        with self.captureOnCommitCallbacks(execute=True):
+            index.rating_changed(1500, 8, None)
+            index.rating_changed(1, 5, None)
+        self.assertEqual([item['id'] for item in index.search('t', limit=2)], [2, 3])
+
+    def test_add_and_remove(self):
+        index = self.make_index([self.row(1, 'Dune')])
+        index.add(Media(pk=2, title='Dune Messiah', normalized_title='dune messiah', media_type=Media.MediaType.CINEMA))
+        self.assertEqual([item['id'] for item in index.search('dune')], [1, 2])
+        self.assertEqual([item['id'] for item in index.search('messiah')], [2])
+        index.remove(1)
+        self.assertEqual([item['id'] for item in index.search('dune')], [2])
+
+    def test_ratings_update_the_shared_index_without_counting(self):
+        media = Media.objects.create(title='Heat', media_type=Media.MediaType.CINEMA)
+        user = User.objects.create(username='indexer')
+        title_index.build()
+        self.addCleanup(setattr, title_index, '_built_at', None)
+        # Write the rating's event while the test database still exists
+        self.addCleanup(event_log.flush)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            entry = UserMedia.objects.create(user=user, media=media, state=UserMedia.MediaState.DONE, score=7)
+        self.assertEqual(title_index.search('heat')[0]['rating_count'], 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            entry.delete()
+        self.assertEqual(title_index.search('heat')[0]['rating_count'], 0)
+
+    @unittest.skipUnless(os.environ.get('MEDIA_BENCHMARK_TESTS') == '1', 'Wall-clock benchmark, set MEDIA_BENCHMARK_TESTS=1')
+    def test_p99_latency_on_100k_titles(self):
+        rng = random.Random(0)
+        words = [''.join(rng.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(rng.randint(3, 9))) for _ in range(5000)]
+        media_types = Media.MediaType.values
+        index = self.make_index([
+            self.row(media_id, ' '.join(rng.sample(words, rng.randint(1, 4))), rng.choice(media_types), rng.randint(0, 500))
+            for media_id in range(1, 100001)
+        ])
+        queries = list(dict.fromkeys(word[:length] for word in rng.sample(words, 200) for length in (1, 2, 4)))
+        timings = []
+        # Cold: each query runs once, so only the rankings made while loading are cached
+        for query in queries:
+            started = time.perf_counter()
+            index.search(query, limit=10)
+            timings.append(time.perf_counter() - started)
+        timings.sort()
+        self.assertLess(timings[int(len(timings) * 0.99)], 0.010)
+
+
+class TitleUniquenessTests(TestCase):
+    """Duplicate normalized titles are a 400 or a form error, never an IntegrityError"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser(username='editor', password='secret')
+        cls.existing = Media.objects.create(title='The Godfather', media_type=Media.MediaType.CINEMA)
+        cls.other = Media.objects.create(title='Goodfellas', media_type=Media.MediaType.CINEMA)
+
+    def setUp(self):
+        self.api = APIClient()
+        self.api.force_authenticate(self.user)
+
+    def test_api_rename_to_taken_title(self):
+        response = self.api.patch(f'/api/media/{self.other.pk}/', {'title': 'the godfather!'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('title', response.json())
+        response = self.api.put(f'/api/media/{self.other.pk}/', {
+            'title': 'THE GODFATHER', 'media_type': Media.MediaType.CINEMA, 'quotes': []
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_api_rename_to_own_title_or_other_type(self):
+        response = self.api.patch(f'/api/media/{self.existing.pk}/', {'title': 'The Godfather.'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        response = self.api.patch(f'/api/media/{self.other.pk}/', {
+            'title': 'The Godfather', 'media_type': Media.MediaType.MANGA
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+
+    def test_api_create_duplicate_and_punctuation_only(self):
+        response = self.api.post('/api/media/', {'title': 'The  Godfather', 'media_type': 'cinema'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        for title in ('!!!', '...'):
+            response = self.api.post('/api/media/', {'title': title, 'media_type': 'cinema'}, format='json')
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(Media.objects.count(), 2)
+
+    def test_admin_rename_shows_form_error(self):
+        self.client.force_login(self.user)
+        response = self.client.post(f'/admin/media/media/{self.other.pk}/change/', {
+            'title': 'The Godfather', 'media_type': 'cinema', 'quotes': '[]',
+        }, HTTP_HOST='localhost')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('title', response.context['adminform'].form.errors)
+        self.assertEqual(Media.objects.get(pk=self.other.pk).title, 'Goodfellas')
+
+    def test_model_clean(self):
+        with self.assertRaises(ValidationError):
+            Media(title='?!', media_type=Media.MediaType.MUSIC).full_clean()
+        with self.assertRaises(ValidationError):
+            Media(title='the godfather', media_type=Media.MediaType.CINEMA).full_clean()
+        Media(title='The Godfather', media_type=Media.MediaType.MUSIC).full_clean()
+
+
+class ProfilingMiddlewareTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user(username='profiler', password='secret', is_staff=True)
+        cls.member = User.objects.create_user(username='member', password='secret')
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+        override = override_settings(MEDIA_PROFILING_DIR=self.directory, MEDIA_PROFILING_SAMPLE_RATE=0.0)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def get_health(self, **headers):
+        return Client(HTTP_HOST='localhost').get('/health/', HTTP_X_PROFILE='1', **headers)
+
+    def test_anonymous_and_non_staff_are_not_profiled(self):
+        with mock.patch('media.middleware.cProfile.Profile') as profile:
+            self.assertNotIn('X-Profile-File', self.get_health())
+            token = Token.objects.create(user=self.member)
+            self.assertNotIn('X-Profile-File', self.get_health(HTTP_AUTHORIZATION=f'Token {token.key}'))
+        profile.assert_not_called()
+        self.assertEqual(list(self.directory.iterdir()), [])
+
+    def test_staff_session_and_token(self):
+        client = Client(HTTP_HOST='localhost')
+        client.force_login(self.staff)
+        response = client.get('/health/', HTTP_X_PROFILE='1')
+        self.assertTrue((self.directory / response['X-Profile-File']).exists())
+
+        token = Token.objects.create(user=self.staff)
+        response = self.get_health(HTTP_AUTHORIZATION=f'Token {token.key}')
+        self.assertIn('X-Profile-File', response)
+
+    def test_rotate(self):
+        for name in ('a', 'b', 'c'):
+            (self.directory / f'{name}.pstats').touch()
+        middleware = ProfilingMiddleware(lambda request: None)
+        middleware.max_files = 0
+        middleware.rotate()
+        self.assertEqual(len(list(self.directory.glob('*.pstats'))), 3)
+        middleware.max_files = 2
+        middleware.rotate()
+        self.assertEqual(len(list(self.directory.glob('*.pstats'))), 2)
+
+
+class ServerTimingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user(username='timed', password='secret', is_staff=True)
+        cls.member = User.objects.create_user(username='untimed', password='secret')
+        Media.objects.create(title='Paprika', media_type=Media.MediaType.CINEMA)
+
+    def get(self, path, user=None):
+        client = Client(HTTP_HOST='localhost')
+        if user is not None:
+            client.force_login(user)
+        return client.get(path)
+
+    def test_off_by_default(self):
+        self.assertNotIn('Server-Timing', self.get('/', self.staff))
+
+    @override_settings(MEDIA_SERVER_TIMING=True)
+    def test_only_staff_get_the_header(self):
+        self.assertNotIn('Server-Timing', self.get('/'))
+        self.assertNotIn('Server-Timing', self.get('/', self.member))
+        header = self.get('/', self.staff)['Server-Timing']
+        self.assertTrue(header.startswith('total;dur='))
+        self.assertIn('queries"', header)
+        self.assertIn('tpl;dur=', header)
+
+        token = Token.objects.create(user=self.staff)
+        response = Client(HTTP_HOST='localhost').get('/api/media/', HTTP_AUTHORIZATION=f'Token {token.key}')
+        self.assertIn('ser;dur=', response['Server-Timing'])
+
+    @override_settings(MEDIA_SERVER_TIMING=True, DEBUG=True)
+    def test_everyone_gets_the_header_with_debug(self):
+        self.assertIn('Server-Timing', self.get('/'))
+
+
+class SlowQueryLogTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.log = Path(directory.name) / 'slow.log'
+        override = override_settings(MEDIA_SLOW_QUERY_LOG=self.log, MEDIA_SLOW_QUERY_FLUSH_SECONDS=3600)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def test_fingerprint(self):
+        self.assertEqual(
+            fingerprint("SELECT * FROM t WHERE id IN (%s, %s, %s) AND name = 'x'  AND n = 3"),
+            'SELECT * FROM t WHERE id IN (...) AND name = ? AND n = ?'
+        )
+
+    def test_samples_cover_the_whole_window(self):
+        stats = SlowQueryStats()
+        self.addCleanup(stats.flush)
+        random.seed(7)
+        for duration in range(MAX_SAMPLES * 4):
+            stats.record('SELECT 1', duration, 'view', 'here')
+        entry = stats._entries['SELECT ?']
+        self.assertEqual(entry['count'], MAX_SAMPLES * 4)
+        self.assertEqual(len(entry['samples']), MAX_SAMPLES)
+        # A plain "first N" buffer would only hold durations below MAX_SAMPLES
+        self.assertGreater(sum(sample >= MAX_SAMPLES for sample in entry['samples']), MAX_SAMPLES / 2)
+
+    def test_command_reads_the_persisted_log(self):
+        stats = SlowQueryStats()
+        for _ in range(19):
+            stats.record('SELECT 1 FROM a', 0.01, 'fast', 'a.py:1')
+        stats.record('SELECT 1 FROM a', 1.0, 'slow', 'b.py:2')
+        stats.flush()
+        stats.record('SELECT 1 FROM b', 0.5, 'other', 'c.py:3')
+        stats.flush()
+
+        out = io.StringIO()
+        call_command('slow_queries', '--sort', 'count', stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertIn('count 20', lines[0])
+        self.assertIn('p95 10.0ms', lines[0])
+        self.assertEqual(lines[1].strip(), 'SELECT ? FROM a')
+        self.assertIn('views: fast, slow', lines[2])
+        self.assertIn('count 1', lines[4])
+
+    @override_settings(MEDIA_SLOW_QUERY_FLUSH_SECONDS=0.05)
+    def test_timer_flushes_a_quiet_worker(self):
+        stats = SlowQueryStats()
+        stats.record('SELECT 1 FROM a', 0.2, 'view', 'a.py:1')
+        stats._timer.join(1)
+        self.assertEqual(stats._entries, {})
+        self.assertEqual(json.loads(self.log.read_text())['count'], 1)
+
+    def test_command_without_log(self):
+        out = io.StringIO()
+        call_command('slow_queries', stdout=out)
+        self.assertIn('No slow queries logged yet', out.getvalue())
+
+
+class WarmUpTests(TestCase):
+    def test_warm_up(self):
+        self.assertEqual(set(warm_up()), {'imports', 'url_resolver', 'templates', 'database'})
+
+    def test_unmigrated_database_is_skipped(self):
+        # What a worker sees when it starts before "migrate" has run
+        with mock.patch('media.models.Media.objects.exists', side_effect=OperationalError('no such table')):
+            timings = warm_up()
+        self.assertNotIn('database', timings)
+        self.assertIn('templates', timings)
+
+        out = io.StringIO()
+        with mock.patch('media.models.Media.objects.exists', side_effect=OperationalError('no such table')):
+            call_command('warmup', stdout=out)
+        self.assertIn('database      skipped', out.getvalue())
+
+
+@override_settings(MEDIA_EVENT_BATCH_SIZE=3, MEDIA_EVENT_FLUSH_SECONDS=60)
+class EventLogTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='events')
+        cls.media = Media.objects.create(title='Heat', media_type=Media.MediaType.CINEMA)
+        cls.other = Media.objects.create(title='Ran', media_type=Media.MediaType.CINEMA)
+
+    def setUp(self):
+        self.addCleanup(event_log.flush)
+
+    def rate(self, media, score):
+        with self.captureOnCommitCallbacks(execute=True):
+            entry, _ = UserMedia.objects.get_or_create(
+                user=self.user, media=media, defaults={'state': UserMedia.MediaState.DONE}
+            )
+            entry.score = score
+            entry.save()
+
+    def test_buffered_until_the_batch_is_full(self):
+        self.rate(self.media, 7)
+        self.assertEqual(UserMediaEvent.objects.count(), 0)
+        self.rate(self.media, 8)
+        self.assertEqual(UserMediaEvent.objects.count(), 3)
+        self.assertEqual(
+            list(UserMediaEvent.objects.values_list('old_score', 'new_score')),
+            [(None, None), (None, 7.0), (7.0, 8.0)]
+        )
+
+    def test_nothing_is_buffered_on_rollback(self):
+        # Captured without running them, as if the transaction rolled back
+        with self.captureOnCommitCallbacks():
+            UserMedia.objects.create(user=self.user, media=self.media, state=UserMedia.MediaState.DONE)
+        self.assertEqual(event_log._pending, [])
+        event_log.flush()
+        self.assertEqual(UserMediaEvent.objects.count(), 0)
+
+    def test_events_of_deleted_rows_are_dropped(self):
+        self.rate(self.media, 7)
+        with self.captureOnCommitCallbacks(execute=True):
+            UserMedia.objects.create(user=self.user, media=self.other, state=UserMedia.MediaState.VIEWING)
+        self.media.delete()
+        event_log.flush()
+        self.assertEqual(list(UserMediaEvent.objects.values_list('media_id', flat=True)), [self.other.pk])
+
+    def test_timer_flushes_a_lone_event(self):
+        log = EventLog()
+        with override_settings(MEDIA_EVENT_FLUSH_SECONDS=0.01), mock.patch.object(log, 'flush') as flush:
+            log._append(UserMediaEvent(user=self.user, media=self.media, new_state=UserMedia.MediaState.DONE))
+            timer = log._timer
+            timer.join(1)
+        flush.assert_called_once()
+
+    def test_flush_cancels_the_timer(self):
+        log = EventLog()
+        log._append(UserMediaEvent(
+            user=self.user, media=self.media, new_state=UserMedia.MediaState.DONE, created_at=timezone.now()
+        ))
+        timer = log._timer
+        log.flush()
+        self.assertIsNone(log._timer)
+        self.assertTrue(timer.finished.is_set())
+        self.assertEqual(UserMediaEvent.objects.count(), 1)
+
+    def test_rollup(self):
+        now = timezone.now()
+        done, viewing = UserMedia.MediaState.DONE, UserMedia.MediaState.VIEWING
+        UserMediaEvent.objects.bulk_create([
+            UserMediaEvent(user=self.user, media=self.media, old_state=None, new_state=viewing, created_at=now),
+            UserMediaEvent(user=self.user, media=self.media, old_state=viewing, new_state=done,
+                           new_score=8, created_at=now),
+            UserMediaEvent(user=self.user, media=self.other, old_state=None, new_state=done,
+                           new_score=6, created_at=now - timedelta(days=1)),
+            # Outside the default two-day window
+            UserMediaEvent(user=self.user, media=self.other, old_state=done, new_state=done,
+                           old_score=6, new_score=4, created_at=now - timedelta(days=5)),
+        ])
+        call_command('rollup_ratings', stdout=io.StringIO())
+
+        today = timezone.localdate(now)
+        stats = MediaDailyStats.objects.get(media=self.media, day=today)
+        self.assertEqual((stats.rating_count, stats.score_sum), (1, 8))
+        self.assertEqual(stats.state_transitions, {f'None->{viewing}': 1, f'{viewing}->{done}': 1})
+        self.assertEqual(MediaDailyStats.objects.get(media=self.other).day, timezone.localdate(now - timedelta(days=1)))
+        self.assertEqual(MediaTypeDailyStats.objects.get(media_type=Media.MediaType.CINEMA, day=today).rating_count, 1)
+
+        call_command('rollup_ratings', '--all', stdout=io.StringIO())
+        self.assertEqual(MediaDailyStats.objects.filter(media=self.other).count(), 2)
+
+    def test_rollup_of_saved_and_upserted_changes(self):
+        done, viewing = UserMedia.MediaState.DONE, UserMedia.MediaState.VIEWING
+        with self.captureOnCommitCallbacks(execute=True):
+            entry = UserMedia.upsert(self.user, self.media.pk, state=viewing, score=8)
+        with self.captureOnCommitCallbacks(execute=True):
+            entry.state = done
+            entry.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            UserMedia.upsert(self.user, self.media.pk, score=9)
+        event_log.flush()
+        self.assertEqual(
+            list(UserMediaEvent.objects.order_by('pk').values_list('old_state', 'new_state', 'old_score', 'new_score')),
+            [(None, viewing, None, 8.0), (viewing, done, 8.0, 8.0), (done, done, 8.0, 9.0)]
+        )
+
+        call_command('rollup_ratings', stdout=io.StringIO())
+        stats = MediaDailyStats.objects.get(media=self.media)
+        self.assertEqual((stats.rating_count, stats.score_sum), (2, 17))
+        self.assertEqual(stats.state_transitions, {f'None->{viewing}': 1, f'{viewing}->{done}': 1})
+
+    def test_rollup_window_uses_the_created_at_index(self):
+        plan = UserMediaEvent.objects.filter(created_at__gte=timezone.now()).explain()
+        self.assertIn('USING INDEX media_usermediaevent_created_at', plan)
+
+
+class ExportCollectionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='exporter', password='secret')
+        other = User.objects.create_user(username='someone')
+        alien = Media.objects.create(title='Alien', media_type=Media.MediaType.CINEMA)
+        akira = Media.objects.create(title='Akira, the manga', media_type=Media.MediaType.MANGA)
+        dune = Media.objects.create(title='Dune', media_type=Media.MediaType.MUSIC)
+        UserMedia.objects.bulk_create([
+            UserMedia(user=cls.user, media=alien, state=UserMedia.MediaState.DONE, score=9),
+            UserMedia(user=cls.user, media=akira, state=UserMedia.MediaState.VIEWING),
+            UserMedia(user=cls.user, media=dune, state=UserMedia.MediaState.CHECK),
+            UserMedia(user=other, media=dune, state=UserMedia.MediaState.DONE, score=3),
+        ])
+
+    def setUp(self):
+        self.client = Client(HTTP_HOST='localhost')
+        self.client.force_login(self.user)
+
+    def export(self, export_format):
+        response = self.client.get('/my-collection/export/', {'format': export_format})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(f'collection.{export_format}', response['Content-Disposition'])
+        return b''.join(response.streaming_content).decode()
+
+    def test_csv(self):
+        rows = list(csv.reader(io.StringIO(self.export('csv'))))
+        self.assertEqual(rows[0], ['title', 'media_type', 'state', 'score', 'added_at', 'updated_at'])
+        self.assertEqual(
+            sorted(row[:4] for row in rows[1:]),
+            [['Akira, the manga', Media.MediaType.MANGA, 'Viewing', ''], ['Alien', Media.MediaType.CINEMA, 'Done', '9.0']]
+        )
+
+    def test_ndjson(self):
+        records = [json.loads(line) for line in self.export('ndjson').splitlines()]
+        self.assertEqual({record['title']: record['score'] for record in records}, {'Alien': 9.0, 'Akira, the manga': None})
+        self.assertEqual([record['state'] for record in records if record['title'] == 'Alien'], ['Done'])
+
+    def test_bad_format_and_anonymous(self):
+        self.assertEqual(self.client.get('/my-collection/export/', {'format': 'xml'}).status_code, 400)
+        response = Client(HTTP_HOST='localhost').get('/my-collection/export/')
+        self.assertEqual(response.status_code, 302)
+
+
+class CompactDbCommandTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='compact')
+        cls.media = [
+            Media.objects.create(title=f'Compact {index}', media_type=Media.MediaType.CINEMA) for index in range(5)
+        ]
+        UserMedia.objects.bulk_create([
+            UserMedia(user=cls.user, media=cls.media[0], state=UserMedia.MediaState.CHECK),
+            UserMedia(user=cls.user, media=cls.media[1], state=UserMedia.MediaState.CHECK),
+            UserMedia(user=cls.user, media=cls.media[2], state=UserMedia.MediaState.CHECK, score=4),
+            UserMedia(user=cls.user, media=cls.media[3], state=UserMedia.MediaState.DONE),
+            UserMedia(user=cls.user, media=cls.media[4], state=UserMedia.MediaState.CHECK),
+        ])
+
+    def test_dry_run(self):
+        out = io.StringIO()
+        call_command('compact_db', '--dry-run', stdout=out)
+        self.assertIn('3 Check entries without a score would be deleted', out.getvalue())
+        self.assertEqual(UserMedia.objects.count(), 5)
+
+    def test_deletes_dead_rows_and_notifies_streams(self):
+        out = io.StringIO()
+        before = broker._cursor(None)
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('compact_db', '--batch-size', '2', '--pause', '0', stdout=out)
+        self.assertIn('Deleted 3 Check entries without a score.', out.getvalue())
+        self.assertEqual(
+            sorted(UserMedia.objects.values_list('media_id', flat=True)), [self.media[2].pk, self.media[3].pk]
+        )
+
+        pending, _ = broker._since(before, {user_channel(self.user.pk)})
+        deleted = [json.loads(text.rsplit('data: ', 1)[1])['media_id'] for text in pending if 'collection.deleted' in text]
+        self.assertEqual(sorted(deleted), [self.media[0].pk, self.media[1].pk, self.media[4].pk])
+
+
+class SyncCursorTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='cursor')
+        cls.media = Media.objects.create(title='Ran', media_type=Media.MediaType.CINEMA)
+
+    def test_rating_bumps_only_the_user_cursor(self):
+        before = cursors.read(self.user.pk)
+        UserMedia.upsert(self.user, self.media.pk, state=UserMedia.MediaState.DONE, score=7)
+        UserMedia.upsert(self.user, self.media.pk, score=9)
+        Media.recompute_scores()
+        after = cursors.read(self.user.pk)
+        self.assertEqual(after['catalog'], before['catalog'])
+        self.assertEqual(after['user'], before['user'] + 2)
+
+    def test_catalog_edits_bump_the_catalog_cursor(self):
+        before = cursors.read()['catalog']
+        media = Media.objects.get(pk=self.media.pk)
+        media.score = 3
+        media.save()
+        self.assertEqual(cursors.read()['catalog'], before)
+        media.plot = 'Lear in feudal Japan.'
+        media.save()
+        created = Media.objects.create(title='Ikiru', media_type=Media.MediaType.CINEMA)
+        created.delete()
+        self.assertEqual(cursors.read()['catalog'], before + 3)
+
+    def test_health_reports_the_cursors(self):
+        token = Token.objects.create(user=self.user)
+        UserMedia.upsert(self.user, self.media.pk, state=UserMedia.MediaState.CHECK)
+        response = Client(HTTP_HOST='localhost').head('/health/', HTTP_AUTHORIZATION=f'Token {token.key}')
+        sync = cursors.read(self.user.pk)
+        self.assertEqual(response['X-Catalog-Cursor'], str(sync['catalog']))
+        self.assertEqual(response['X-User-Cursor'], str(sync['user']))
+
+    def test_erase_data_drops_user_cursors(self):
+        UserMedia.upsert(self.user, self.media.pk, state=UserMedia.MediaState.CHECK)
+        before = cursors.read()['catalog']
+        for fast in ([], ['--fast']):
+            with self.subTest(fast=fast):
+                call_command('erase_data', '--action', 'erase', *fast, stdout=io.StringIO())
+                self.assertEqual(list(SyncCursor.objects.values_list('key', flat=True)), [cursors.CATALOG])
+                self.assertGreater(cursors.read()['catalog'], before)
+                before = cursors.read()['catalog']
+
+
+class MediaBatchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='batcher')
+        cls.media = [
+            Media.objects.create(title=f'Batch {index}', media_type=Media.MediaType.MUSIC) for index in range(3)
+        ]
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_get_and_post(self):
+        ids = [self.media[2].pk, self.media[0].pk, 999999, self.media[2].pk]
+        for response in (
+            self.client.get('/api/media/batch/', {'ids': ','.join(map(str, ids))}),
+            self.client.post('/api/media/batch/', {'ids': ids}, format='json'),
+        ):
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            self.assertEqual(data['fields'][:2], ['id', 'title'])
+            self.assertEqual([row[0] for row in data['rows']], [self.media[2].pk, self.media[0].pk])
+            self.assertEqual(data['rows'][1][1], 'Batch 0')
+            self.assertEqual(data['missing'], [999999])
+
+    def test_empty(self):
+        data = self.client.get('/api/media/batch/').json()
+        self.assertEqual((data['rows'], data['missing']), ([], []))
+
+    @override_settings(MEDIA_BATCH_MAX_IDS=2)
+    def test_id_cap(self):
+        ids = [media.pk for media in self.media]
+        response = self.client.post('/api/media/batch/', {'ids': ids}, format='json')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post('/api/media/batch/', {'ids': ids[:2]}, format='json')
+        self.assertEqual(len(response.json()['rows']), 2)
+
+    def test_invalid_ids(self):
+        for body in ({'ids': ['x']}, {'ids': [1.5]}, {'ids': [True]}, {'ids': 5}, {'ids': [None]}, [1, 2]):
+            with self.subTest(body=body):
+                response = self.client.post('/api/media/batch/', body, format='json')
+                self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get('/api/media/batch/', {'ids': '1,two'}).status_code, 400)
+
+    def test_requires_authentication(self):
+        self.assertEqual(APIClient().get('/api/media/batch/', {'ids': '1'}).status_code, 401)
+
+
+class TitleSimilarityTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.matrix = Media.objects.create(title='The Matrix', media_type=Media.MediaType.CINEMA)
+
+    def test_matcher_matches_a_full_scan(self):
+        rng = random.Random(3)
+        titles = [''.join(rng.choice('abcde ') for _ in range(rng.randint(2, 30))) for _ in range(300)]
+        matcher = TitleMatcher((title, title) for title in titles)
+        for title in titles[:50]:
+            expected = sorted(
+                other for other in titles
+                if SequenceMatcher(None, other, title).ratio() > 0.85
+            )
+            self.assertEqual(sorted(other for other, _ in matcher.similar(title, limit=None)), expected)
+
+    def test_form_rejects_similar_titles_of_the_same_type(self):
+        form = MediaForm({'title': 'The Matrixx', 'media_type': Media.MediaType.CINEMA, 'quotes': '[]'})
+        self.assertFalse(form.is_valid())
+        self.assertIn("'The Matrix' (95% similar)", form.errors['title'][0])
+
+        form = MediaForm({'title': 'The Matrixx', 'media_type': Media.MediaType.MANGA, 'quotes': '[]'})
+        self.assertTrue(form.is_valid(), form.errors)
+
+    def test_form_exact_duplicate_has_one_error(self):
+        form = MediaForm({'title': 'the matrix!', 'media_type': Media.MediaType.CINEMA, 'quotes': '[]'})
+        self.assertFalse(form.is_valid())
+        self.assertEqual(len(form.errors['title']), 1)
+
+
+class ImportCatalogCommandTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Media.objects.create(title='The Matrix', media_type=Media.MediaType.CINEMA)
+
+    def test_import(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / 'catalog.csv'
+            with path.open('w', newline='') as source:
+                writer = csv.writer(source)
+                writer.writerow(['title', 'media_type', 'quotes'])
+                writer.writerows([
+                    ['The Matrix', Media.MediaType.CINEMA, ''],
+                    ['The Matrixx', Media.MediaType.CINEMA, ''],
+                    ['The Matrixx', Media.MediaType.MANGA, ''],
+                    ['Heat', Media.MediaType.CINEMA, ''],
+                    ['Heat!', Media.MediaType.CINEMA, ''],
+                    ['Heats', Media.MediaType.CINEMA, ''],
+                    ['A', Media.MediaType.CINEMA, ''],
+                ])
+            out = io.StringIO()
+            call_command('import_catalog', str(path), '--workers', '1', stdout=out)
+            with path.with_name('catalog.csv.rejects.csv').open() as rejects:
+                reasons = {int(row['row']): row['reason'] for row in csv.DictReader(rejects)}
+
+        self.assertIn('Imported 2 of 7 rows', out.getvalue())
+        self.assertEqual(set(reasons), {1, 2, 5, 6, 7})
+        self.assertTrue(reasons[1].startswith('duplicate of an existing'))
+        self.assertIn("too similar to an existing cinema: 'The Matrix'", reasons[2])
+        self.assertIn("'Heat'", reasons[6])
+        self.assertTrue(reasons[7].startswith('title:'))
+        self.assertEqual(
+            sorted(Media.objects.values_list('title', 'media_type')),
+            [('Heat', Media.MediaType.CINEMA), ('The Matrix', Media.MediaType.CINEMA), ('The Matrixx', Media.MediaType.MANGA)]
+        )
+
+
+class TrackChangesTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='tracker')
+        cls.media = Media.objects.create(title='Heat', media_type=Media.MediaType.CINEMA, quotes=['A quote long enough'])
+        cls.entry = UserMedia.objects.create(user=cls.user, media=cls.media, state=UserMedia.MediaState.VIEWING, score=6)
+
+    def test_no_op_saves_issue_no_queries(self):
+        entry = UserMedia.objects.get(pk=self.entry.pk)
+        media = Media.objects.get(pk=self.media.pk)
+        with self.assertNumQueries(0):
+            entry.save()
+            entry.state = UserMedia.MediaState.VIEWING
+            entry.save()
+            media.save()
+
+    def test_only_changed_fields_are_written(self):
+        media = Media.objects.get(pk=self.media.pk)
+        media.quotes.append('Another quote, edited in place')
+        with CaptureQueriesContext(connection) as queries:
+            media.save()
+        update = [query['sql'] for query in queries if query['sql'].startswith('UPDATE')]
+        self.assertEqual(len(update), 1)
+        self.assertIn('"quotes"', update[0])
+        self.assertNotIn('"plot"', update[0])
+        with self.assertNumQueries(0):
+            media.save()
+
+    def test_refresh_from_db_resets_the_snapshot(self):
+        entry = UserMedia.objects.get(pk=self.entry.pk)
+        UserMedia.objects.filter(pk=entry.pk).update(state=UserMedia.MediaState.DONE)
+        entry.refresh_from_db()
+        self.assertEqual(entry.get_changed_fields(), {})
+        with self.assertNumQueries(0):
+            entry.save()
+
+        # Going back to the value of the stale snapshot is a change again
+        entry.state = UserMedia.MediaState.VIEWING
+        self.assertEqual(entry.get_changed_fields(), {'state': UserMedia.MediaState.DONE})
+
+    def test_deferred_fields_loaded_later_are_not_changes(self):
+        media = Media.objects.only('title').get(pk=self.media.pk)
+        self.assertIsNone(media.plot)
+        self.assertEqual(media.get_changed_fields(), {})
+        with self.assertNumQueries(0):
+            media.save()
+
+    def test_update_fields_only_persist_the_written_fields(self):
+        entry = UserMedia.objects.get(pk=self.entry.pk)
+        entry.score = 8
+        entry.state = UserMedia.MediaState.DONE
+        with self.captureOnCommitCallbacks(execute=True):
+            entry.save(update_fields=['score'])
+        self.addCleanup(event_log.flush)
+        self.assertEqual(entry.get_changed_fields(), {'state': UserMedia.MediaState.VIEWING})
+        self.assertEqual(UserMedia.objects.get(pk=entry.pk).state, UserMedia.MediaState.VIEWING)
+
+        entry.save()
+        self.assertEqual(UserMedia.objects.get(pk=entry.pk).state, UserMedia.MediaState.DONE)
+
+
+class MediaCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.media = [
+            Media.objects.create(title=f'Cached {index}', media_type=Media.MediaType.CINEMA, quotes=['A quote long enough'])
+            for index in range(3)
+        ]
+        cls.user = User.objects.create(username='cached', is_staff=True)
+
+    def setUp(self):
+        media_cache.clear()
+        self.addCleanup(media_cache.clear)
+
+    def test_hits_and_copies(self):
+        cache = MediaCache()
+        ids = [media.pk for media in self.media]
+        with self.assertNumQueries(1):
+            first = cache.get_many(ids)
+        with self.assertNumQueries(0):
+            second = cache.get_many(ids)
+        self.assertEqual(cache.stats()['hits'], 3)
+        self.assertEqual(cache.stats()['misses'], 3)
+
+        first[ids[0]].quotes.append('Changed by the caller only')
+        first[ids[0]].title = 'Changed'
+        self.assertEqual(second[ids[0]].quotes, ['A quote long enough'])
+        self.assertEqual(cache.get(ids[0]).title, 'Cached 0')
+        self.assertIs(cache.get(ids[0], readonly=True), cache.get(ids[0], readonly=True))
+        self.assertIsNone(cache.get(0))
+
+    def test_saves_invalidate(self):
+        media = media_cache.get(self.media[0].pk)
+        media.title = 'Renamed'
+        media.save()
+        with self.assertNumQueries(1):
+            self.assertEqual(media_cache.get(media.pk).title, 'Renamed')
+        media_id = media.pk
+        media.delete()
+        self.assertIsNone(media_cache.get(media_id))
+
+    def test_read_before_the_commit_is_dropped_at_commit(self):
+        media = Media.objects.get(pk=self.media[0].pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            media.title = 'Renamed'
+            media.save()
+            # Stands in for another thread reading the old committed row before the commit
+            media_cache.get(media.pk)
+            self.assertEqual(media_cache.stats()['size'], 1)
+        self.assertEqual(media_cache.stats()['size'], 0)
+
+    def test_read_racing_a_write_is_not_stored(self):
+        cache = MediaCache()
+        in_bulk = Media.objects.in_bulk
+        media_id = self.media[1].pk
+
+        def racing_in_bulk(ids):
+            loaded = in_bulk(ids)
+            cache.invalidate(media_id)
+            return loaded
+
+        with mock.patch.object(Media.objects, 'in_bulk', side_effect=racing_in_bulk):
+            self.assertEqual(cache.get(media_id).title, 'Cached 1')
+        self.assertEqual(cache.stats()['size'], 0)
+        # Nothing is reading any more, so the invalidation is forgotten
+        self.assertEqual(cache._invalidated, {})
+        cache.get(media_id)
+        self.assertEqual(cache.stats()['size'], 1)
+
+    def test_bounded(self):
+        cache = MediaCache()
+        for media_id in range(10000):
+            cache.invalidate(media_id)
+        self.assertEqual(len(cache._invalidated), 0)
+        with override_settings(MEDIA_CACHE_SIZE=2):
+            cache.get_many(media.pk for media in self.media)
+            self.assertEqual(cache.stats()['size'], 2)
+
+    def test_metrics(self):
+        media_cache.get(self.media[0].pk)
+        media_cache.get(self.media[0].pk)
+        client = APIClient()
+        client.force_authenticate(self.user)
+        self.assertEqual(client.get('/metrics/').json()['media_cache'], {
+            'size': 1, 'max_size': 5000, 'hits': 1, 'misses': 1, 'hit_rate': 0.5,
+        })
+        client.force_authenticate(User.objects.create(username='not_staff'))
+        self.assertEqual(client.get('/metrics/').status_code, 403)
+
+    def test_user_media_list(self):
+        for media in self.media:
+            UserMedia.objects.create(user=self.user, media=media, state=UserMedia.MediaState.VIEWING)
+        client = APIClient()
+        client.force_authenticate(self.user)
+        self.assertEqual(len(client.get('/api/user-media/').json()), 3)
+
+        class Pagination(PageNumberPagination):
+            page_size = 2
+
+        with mock.patch.object(UserMediaViewSet, 'pagination_class', Pagination):
+            page = client.get('/api/user-media/').json()
+        self.assertEqual(page['count'], 3)
+        self.assertEqual(len(page['results']), 2)
+
+        # The media of one entry is deleted between the two queries
+        get_many = media_cache.get_many
+        gone = self.media[2].pk
+        with mock.patch.object(media_cache, 'get_many', side_effect=lambda ids, readonly: {
+            media_id: media for media_id, media in get_many(ids, readonly=readonly).items() if media_id != gone
+        }):
+            response = client.get('/api/user-media/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(entry['media']['id'] for entry in response.json()), [self.media[0].pk, self.media[1].pk])
+
+
+class UpsertTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = User.objects.bulk_create([User(username=f'upsert{index}') for index in range(2)])
+        cls.media = Media.objects.create(title='Heat', media_type=Media.MediaType.CINEMA)
+
+    def setUp(self):
+        self.addCleanup(event_log.flush)
+
+    def upsert(self, user, **values):
+        with self.captureOnCommitCallbacks(execute=True):
+            return UserMedia.upsert(user, self.media.pk, **values)
+
+    def test_insert_update_and_no_op(self):
+        entry = self.upsert(self.users[0], state=UserMedia.MediaState.DONE, score=8)
+        self.assertEqual((entry.state, entry.score), (UserMedia.MediaState.DONE, 8))
+        self.assertEqual(Media.objects.get(pk=self.media.pk).score, 8)
+
+        entry = self.upsert(self.users[0], score=6)
+        self.assertEqual(UserMedia.objects.filter(user=self.users[0]).count(), 1)
+        self.assertEqual((entry.state, entry.score), (UserMedia.MediaState.DONE, 6))
+        self.assertEqual(Media.objects.get(pk=self.media.pk).score, 6)
+
+        updated_at = entry.updated_at
+        # Selecting the stored values again only reads the entry
+        with CaptureQueriesContext(connection) as queries:
+            entry = UserMedia.upsert(self.users[0], self.media.pk, state=UserMedia.MediaState.DONE, score=6)
+        statements = [query['sql'] for query in queries if 'SAVEPOINT' not in query['sql']]
+        self.assertEqual(len(statements), 1)
+        self.assertTrue(statements[0].startswith('SELECT'))
+        self.assertEqual(UserMedia.objects.get(pk=entry.pk).updated_at, updated_at)
+
+        event_log.flush()
+        self.assertEqual(
+            list(UserMediaEvent.objects.values_list('old_score', 'new_score')), [(None, 8.0), (8.0, 6.0)]
+        )
+
+    def test_update_score(self):
+        self.assertIsNone(Media.update_score(self.media.pk))
+        UserMedia.objects.bulk_create([
+            UserMedia(user=self.users[0], media=self.media, state=UserMedia.MediaState.DONE, score=9),
+            UserMedia(user=self.users[1], media=self.media, state=UserMedia.MediaState.DONE, score=4),
+        ])
+        self.assertEqual(Media.update_score(self.media.pk), 6.5)
+        self.assertEqual(Media.objects.get(pk=self.media.pk).score, 6.5)
+        UserMedia.objects.filter(user=self.users[0]).update(score=None)
+        self.assertEqual(Media.update_score(self.media.pk), 4)
+
+
+class LiveEventsTests(TestCase):
+    def test_poll(self):
+        events = EventBroker()
+        first = events.poll({CATALOG})
+        self.assertEqual(len(first), 1)
+        self.assertIn('retry: 10000', first[0])
+        last_id = first[0].split('\n')[0][4:]
+
+        events.publish(CATALOG, 'score', {'media_id': 1, 'score': 7.5})
+        events.publish(user_channel(2), 'collection', {'media_id': 1})
+        events.publish(user_channel(3), 'collection', {'media_id': 1})
+        frames = events.poll({CATALOG, user_channel(2)}, last_id, retry=5)
+        self.assertEqual(len(frames), 3)
+        self.assertIn('event: score\ndata: {"media_id":1,"score":7.5}', frames[0])
+        self.assertIn('event: collection', frames[1])
+        self.assertTrue(frames[2].endswith('retry: 5000\n\n'))
+
+        # Caught up: only the id frame
+        self.assertEqual(len(events.poll({CATALOG}, frames[2].split('\n')[0][4:])), 1)
+        # Another process's ids can't be resumed
+        self.assertIn('event: reset', events.poll({CATALOG}, 'other-1')[0])
+
+    @override_settings(MEDIA_LIVE_KEEPALIVE_SECONDS=0.05)
+    def test_stream(self):
+        events = EventBroker()
+
+        async def read():
+            stream = events.stream({CATALOG})
+            frames = [await anext(stream)]
+            events.publish(user_channel(1), 'collection', {'media_id': 1})
+            events.publish(CATALOG, 'score', {'media_id': 2, 'score': None})
+            frames.append(await anext(stream))
+            frames.append(await anext(stream))
+            await stream.aclose()
+            return frames
+
+        retry, score, keepalive = asyncio.run(read())
+        self.assertEqual(retry, 'retry: 3000\n\n')
+        self.assertIn('event: score\ndata: {"media_id":2,"score":null}', score)
+        self.assertEqual(keepalive, ': keepalive\n\n')
+
+    def test_wsgi_view_ends_the_response(self):
+        client = Client(HTTP_HOST='localhost')
+        response = client.get('/events/')
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertFalse(response.streaming)
+        self.assertIn('retry: 10000', response.content.decode())
+        self.assertIn('EventSource', client.get('/').content.decode())
+
+    def test_asgi_view_streams(self):
+        async def read():
+            response = await AsyncClient(HTTP_HOST='localhost').get('/events/')
+            self.assertTrue(response.streaming)
+            content = aiter(response.streaming_content)
+            first = await anext(content)
+            await content.aclose()
+            return first
+
+        self.assertEqual(asyncio.run(read()), b'retry: 3000\n\n')
+
+    def test_home_has_live_badges_for_logged_in_users(self):
+        user = User.objects.create_user(username='live', password='secret')
+        rated = Media.objects.create(title='Zero', media_type=Media.MediaType.CINEMA, score=0.0)
+        UserMedia.objects.create(user=user, media=rated, state=UserMedia.MediaState.DONE, score=0)
+        client = Client(HTTP_HOST='localhost')
+        client.force_login(user)
+        content = client.get('/').content.decode()
+        self.assertIn(f'data-score-for="{rated.pk}">Global Rating: 0.0/10', content)
+        self.assertIn(f'data-rating-for="{rated.pk}">Rated: 0.0/10', content)
+        self.assertIn("addEventListener('collection'", content)
+
+    @override_settings(MEDIA_LIVE_UPDATES=False)
+    def test_disabled(self):
+        client = Client(HTTP_HOST='localhost')
+        self.assertEqual(client.get('/events/').status_code, 404)
+        self.assertNotIn('EventSource', client.get('/').content.decode())
+
+
+class AdminTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser(username='admin', password='secret')
+        cls.media = [Media.objects.create(title=f'Admin {index}', media_type=Media.MediaType.CINEMA) for index in range(5)]
+
+    def setUp(self):
+        self.client = Client(HTTP_HOST='localhost')
+        self.client.force_login(self.admin)
+        self.addCleanup(event_log.flush)
+
+    def test_estimated_count_reads_index_statistics(self):
+        Media.objects.filter(pk__in=[self.media[0].pk, self.media[1].pk]).delete()
+        # Without statistics it falls back to the highest id
+        self.assertEqual(estimated_count(Media), self.media[4].pk)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        self.assertEqual(estimated_count(Media), 3)
+
+    def test_estimated_count_ignores_partial_indexes(self):
+        users = User.objects.bulk_create([User(username=f'counted{index}') for index in range(4)])
+        UserMedia.objects.bulk_create([
+            UserMedia(user=user, media=media, state=UserMedia.MediaState.DONE, score=5 if media == self.media[0] else None)
+            for user in users for media in self.media
+        ])
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        # usermedia_rated_by_media_idx only holds the 4 rated rows
+        self.assertEqual(estimated_count(UserMedia), 20)
+
+    def test_actions_keep_the_stats_without_a_rebuild(self):
+        users = User.objects.bulk_create([User(username=f'admin_rater{index}') for index in range(3)])
+        entries = [
+            UserMedia.objects.create(user=user, media=self.media[index], state=UserMedia.MediaState.DONE, score=score)
+            for index, (user, score) in enumerate(zip(users, [8, 3.5, 10]))
+        ]
+        with mock.patch.object(stats, 'rebuild') as rebuild:
+            self.client.post('/admin/media/usermedia/', {
+                'action': 'mark_check', '_selected_action': [entries[0].pk, entries[1].pk],
+            })
+            Media.objects.filter(pk=self.media[2].pk).update(score=2)
+            self.client.post('/admin/media/media/', {
+                'action': 'recompute_selected_scores', '_selected_action': [self.media[2].pk],
+            })
+        rebuild.assert_not_called()
+        kept = stats.snapshot()
+        stats.rebuild()
+        self.assertEqual(kept, stats.snapshot())
+        self.assertEqual(kept['total']['ratings'], 1)
+
+    def test_recompute_only_the_selected_media(self):
+        Media.objects.update(score=3)
+        before = broker._cursor(None)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/admin/media/media/', {
+                'action': 'recompute_selected_scores', '_selected_action': [self.media[0].pk],
+            })
+        self.assertEqual(list(Media.objects.order_by('pk').values_list('score', flat=True)), [None, 3, 3, 3, 3])
+        pending, _ = broker._since(before, {CATALOG})
+        self.assertEqual(len(pending), 1)
+        self.assertIn(f'"media_id":{self.media[0].pk},"score":null', pending[0])
+
+    def test_set_state_updates_the_index_and_live_streams(self):
+        user = User.objects.create(username='rated')
+        entry = UserMedia.objects.create(user=user, media=self.media[1], state=UserMedia.MediaState.DONE, score=6)
+        Media.update_score(self.media[1].pk)
+        before = broker._cursor(None)
+        with self.captureOnCommitCallbacks(execute=True), \
+                mock.patch.object(title_index, 'rating_changed') as rating_changed:
+            self.client.post('/admin/media/usermedia/', {'action': 'mark_check', '_selected_action': [entry.pk]})
+
+        rating_changed.assert_called_once_with(self.media[1].pk, 6, None)
+        self.assertIsNone(Media.objects.get(pk=self.media[1].pk).score)
+        pending, _ = broker._since(before, {CATALOG, user_channel(user.pk)})
+        self.assertEqual(sorted(text.split('\n')[1] for text in pending), ['event: collection', 'event: score'])
+
+
+class SimilarityTests(TestCase):
+    DOCUMENTS = [
+        'pirates sail the ocean looking for treasure',
+        'pirates hunt treasure across the ocean islands',
+        'a detective hunts a killer in the city',
+        'the detective and the killer meet in the city at night',
+        'pirates meet a detective',
+        'unique words nowhere else',
+    ]
+
+    def vectors(self):
+        return similarity.tfidf([similarity.media_terms(plot, []) for plot in self.DOCUMENTS])
+
+    def test_tfidf(self):
+        vectors, dimensions = self.vectors()
+        # Terms of a single document ("hunt"), or of more than half of them ("the"), are left out
+        self.assertEqual(dimensions, 7)
+        self.assertEqual(vectors[5], {})
+        for vector in vectors[:5]:
+            self.assertLessEqual(sum(weight * weight for weight in vector.values()), 1 + 1e-9)
+        self.assertEqual(similarity.media_terms('The THE, an ox!', ['quoted the']), Counter({'the': 3, 'quoted': 1}))
+
+    def test_neighbor_ordering(self):
+        vectors, dimensions = self.vectors()
+        with mock.patch.object(similarity, 'np', None):
+            neighbors, reverse = similarity.nearest_neighbors(vectors, dimensions, [0, 4, 5], 2, floors=[0.3] * 6)
+        self.assertEqual([other for other, _ in neighbors[0]], [1, 4])
+        self.assertGreater(neighbors[0][0][1], neighbors[0][1][1])
+        self.assertEqual([other for other, _ in neighbors[4]], [3, 2])
+        self.assertEqual(neighbors[5], [])
+        # Only pairs that beat the other media's current weakest neighbor come back
+        self.assertEqual(sorted((other, row) for other, row, _ in reverse), [(1, 0), (3, 4)])
+
+    @unittest.skipIf(similarity.np is None, 'NumPy is not installed')
+    def test_numpy_matches_python(self):
+        vectors, dimensions = self.vectors()
+        rows = list(range(len(vectors)))
+        fast, fast_reverse = similarity.nearest_neighbors(vectors, dimensions, rows, 3, floors=[0.1] * 6)
+        with mock.patch.object(similarity, 'np', None):
+            slow, slow_reverse = similarity.nearest_neighbors(vectors, dimensions, rows, 3, floors=[0.1] * 6)
+        for row in rows:
+            self.assertEqual([other for other, _ in fast[row]], [other for other, _ in slow[row]])
+        self.assertEqual(sorted(pair[:2] for pair in fast_reverse), sorted(pair[:2] for pair in slow_reverse))
+
+    def test_build_neighbors_and_view(self):
+        media = [
+            Media.objects.create(title=f'Plot {index}', media_type=Media.MediaType.CINEMA, plot=plot)
+            for index, plot in enumerate(self.DOCUMENTS)
+        ]
+        out = io.StringIO()
+        call_command('build_neighbors', '--k', '2', '--media-type', Media.MediaType.CINEMA, stdout=out)
+        self.assertIn('cinema: 5 media scored', out.getvalue())
+        # Nothing new, and the media without vocabulary terms is not scored again
+        out = io.StringIO()
+        call_command('build_neighbors', '--k', '2', '--media-type', Media.MediaType.CINEMA, stdout=out)
+        self.assertIn('Built neighbors of 0 media', out.getvalue())
+
+        client = APIClient()
+        client.force_authenticate(User.objects.create(username='similar'))
+        url = f'/api/media/{media[0].pk}/similar/'
+        response = client.get(url)
+        self.assertEqual([item['id'] for item in response.json()], [media[1].pk, media[4].pk])
+        self.assertGreater(response.json()[0]['similarity'], response.json()[1]['similarity'])
+        self.assertEqual(len(client.get(url, {'limit': -5}).json()), 1)
+        self.assertEqual(client.get(url, {'limit': 'all'}).status_code, 400)
+        self.assertEqual(client.get('/api/media/999999/similar/').status_code, 404)
+        self.assertEqual(client.get('/api/media/abc/similar/').status_code, 404)
+        self.assertEqual(client.get(f'/api/media/{media[5].pk}/similar/').json(), [])
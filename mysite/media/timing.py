@@ -0,0 +1,96 @@
+from collections import defaultdict
+from contextvars import ContextVar
+from time import perf_counter
+
+from django.template import TemplateDoesNotExist
+from django.template.backends.django import DjangoTemplates, Template, reraise
+from rest_framework.renderers import JSONRenderer
+
+# Timings of the request being handled, None outside ServerTimingMiddleware
+_current = ContextVar('media_server_timing', default=None)
+
+# (metric, description) in header order
+METRICS = [
+    ('db', 'Database'),
+    ('tpl', 'Templates'),
+    ('ser', 'Serialization'),
+    ('render', 'Rendering'),
+]
+
+
+class Timings:
+    """Durations of one request, per metric. Also the database execute wrapper that feeds "db"."""
+
+    def __init__(self):
+        self.durations = defaultdict(float)
+        self.queries = 0
+        self.active = set()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.durations['db'] += perf_counter() - started
+            self.queries += 1
+
+    def header(self, total):
+        entries = [f'total;dur={total * 1000:.2f}']
+        for name, description in METRICS:
+            if name == 'db':
+                entries.append(f'db;dur={self.durations[name] * 1000:.2f};desc="{self.queries} queries"')
+            elif name in self.durations:
+                entries.append(f'{name};dur={self.durations[name] * 1000:.2f};desc="{description}"')
+        return ', '.join(entries)
+
+
+def activate(timings):
+    return _current.set(timings)
+
+
+def deactivate(token):
+    _current.reset(token)
+
+
+def timed(name, func, *args, **kwargs):
+    """Call func, adding its duration to the current request's metric; nested calls count once"""
+    timings = _current.get()
+    if timings is None or name in timings.active:
+        return func(*args, **kwargs)
+    timings.active.add(name)
+    started = perf_counter()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        timings.durations[name] += perf_counter() - started
+        timings.active.discard(name)
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        return timed('tpl', super().render, context, request)
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """The Django template backend, timing every render for the Server-Timing header"""
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return TimedTemplate(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            reraise(exc, self)
+
+
+class TimedJSONRenderer(JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return timed('render', super().render, data, accepted_media_type, renderer_context)
+
+
+class TimedSerializerMixin:
+    """Time to_representation of DRF serializers; nested and listed serializers add up once"""
+
+    def to_representation(self, instance):
+        return timed('ser', super().to_representation, instance)
@@ -1,5 +1,4 @@
 from django.urls import path, include
-from django.http import JsonResponse
 from django.contrib.auth import views as auth_views
 from rest_framework.routers import DefaultRouter
 from . import views
@@ -12,14 +11,12 @@ router.register(r'media', views.MediaViewSet, basename='media')
 router.register(r'user-media', views.UserMediaViewSet, basename='user-media')
 
 
-def health_check(request):
-    return JsonResponse({'status': 'ok'})
-
 urlpatterns = [
     # Main pages
     path('', views.home, name='home'),
     path('create/', views.create_media, name='create_media'),
     path('my-collection/', views.user_collection, name='user_collection'),
+    path('my-collection/export/', views.export_collection, name='export_collection'),
     
     # Authentication
     path('login/', auth_views.LoginView.as_view(
@@ -37,7 +34,9 @@ urlpatterns = [
     path('api/', include(router.urls)),
     path('api-token-auth/', views.obtain_auth_token, name='api_token_auth'),
 
-    path('health/', health_check),
+    path('health/', views.health_check, name='health'),
+    path('metrics/', views.metrics, name='metrics'),
+    path('events/', views.event_stream, name='event_stream'),
     path('user-exists/<str:username>/', views.UserExistsView.as_view(), name='user_exists'),
     path('register-App/', views.RegisterView.as_view(), name='register_api'),
 ] 
\ No newline at end of file
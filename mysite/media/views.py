@@ -1,20 +1,37 @@
-from django.shortcuts import render, redirect, get_object_or_404
-from django.db.models import Avg
+from django.conf import settings
+from django.shortcuts import render, redirect
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Exists, OuterRef
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from datetime import timedelta
+import csv
+import itertools
+import json
 from django.contrib.auth import login, authenticate
-from .models import Media, UserMedia, User
+from .models import Media, UserMedia, User, MediaDailyStats, MediaTypeDailyStats, MediaNeighbor
 from django.contrib.auth.decorators import login_required
-from django.http import JsonResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.contrib import messages
 from .forms import MediaForm
+from .autocomplete import title_index
+from . import cursors, stats
+from .cache import media_cache
+from .live import CATALOG, broker, user_channel
 from rest_framework import viewsets, permissions, status
 from .serializers import MediaSerializer, UserMediaSerializer
 from rest_framework.decorators import action, api_view, permission_classes
+from rest_framework.generics import get_object_or_404
 from rest_framework.response import Response
 from rest_framework.authtoken.models import Token
 from rest_framework import serializers
 from rest_framework.permissions import AllowAny
 from rest_framework.views import APIView
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_http_methods
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed
 from django.utils.decorators import method_decorator
 
 @api_view(['POST'])
@@ -36,15 +53,12 @@ def obtain_auth_token(request):
     token, created = Token.objects.get_or_create(user=user)
     return Response({'token': token.key})
 
-from django.db.models import Avg, Q, Prefetch
-from .models import Media, UserMedia
-
 def home(request):
     query = request.GET.get('q', '')
     selected_state = request.GET.get('state')
 
-    # Start base queryset
-    media_qs = Media.objects.all()
+    # Start base queryset, annotated with rating stats and the user's own state
+    media_qs = Media.objects.with_rating_stats(request.user)
 
     # Apply search filter if query is present
     if query:
@@ -52,31 +66,13 @@ def home(request):
 
     # Apply state filter only if user is authenticated and valid state
     if request.user.is_authenticated and selected_state in ['1', '2', '3']:
-        media_qs = media_qs.prefetch_related(
-            Prefetch(
-                'user_media',
-                queryset=UserMedia.objects.filter(user=request.user),
-                to_attr='filtered_user_media'
-            )
-        )
-        media_items = []
-        for media in media_qs:
-            # Use prefetched data to check if media is in desired state
-            if hasattr(media, 'filtered_user_media') and media.filtered_user_media:
-                user_media = media.filtered_user_media[0]
-                if user_media.state == int(selected_state):
-                    media_items.append(media)
-    else:
-        media_items = list(media_qs)
-
-    # Annotate with avg score and sort
-    media_items = sorted(
-        media_items,
-        key=lambda m: (
-            -(m.user_media.aggregate(avg_score=Avg('score'))['avg_score'] or 0),
-            -m.created_at.timestamp()
-        )
-    )
+        media_qs = media_qs.filter(user_state=int(selected_state))
+
+    # Sort by average score, unrated media last, newest first on ties
+    media_items = list(media_qs.order_by(
+        Coalesce('rating_avg', 0.0).desc(),
+        '-created_at'
+    ))
 
     # User rating dict
     user_ratings = {}
@@ -94,6 +90,8 @@ def home(request):
         'user_media_states': UserMedia.MediaState.choices,
         'selected_state': selected_state,
         'query': query,
+        'catalog_stats': stats.snapshot(),
+        'live_updates': getattr(settings, 'MEDIA_LIVE_UPDATES', True),
     }
     return render(request, 'media/home.html', context)
 
@@ -134,9 +132,123 @@ def user_collection(request):
     }
     return render(request, 'media/user_collection.html', context)
 
+class Echo:
+    """File-like object that hands back what csv.writer writes, for streaming"""
+    def write(self, value):
+        return value
+
+@login_required
+def export_collection(request):
+    export_format = request.GET.get('format', 'csv')
+    if export_format not in ('csv', 'ndjson'):
+        return JsonResponse({'error': 'format must be csv or ndjson'}, status=400)
+
+    # Same rows as user_collection, projected to plain tuples and read in chunks
+    rows = UserMedia.objects.filter(
+        user=request.user
+    ).exclude(
+        state=UserMedia.MediaState.CHECK
+    ).order_by('-updated_at').values_list(
+        'media__title', 'media__media_type', 'state', 'score', 'added_at', 'updated_at'
+    ).iterator(chunk_size=2000)
+
+    columns = ['title', 'media_type', 'state', 'score', 'added_at', 'updated_at']
+    state_labels = dict(UserMedia.MediaState.choices)
+
+    def records():
+        for title, media_type, state, score, added_at, updated_at in rows:
+            yield [title, media_type, state_labels.get(state, state), score,
+                   added_at.isoformat(), updated_at.isoformat()]
+
+    if export_format == 'csv':
+        writer = csv.writer(Echo())
+        lines = itertools.chain([writer.writerow(columns)], (writer.writerow(record) for record in records()))
+        content_type = 'text/csv'
+    else:
+        lines = (json.dumps(dict(zip(columns, record))) + '\n' for record in records())
+        content_type = 'application/x-ndjson'
+
+    response = StreamingHttpResponse(lines, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="collection.{export_format}"'
+    return response
+
+@require_http_methods(['GET', 'HEAD'])
+def health_check(request):
+    """Liveness plus the sync cursors, so one call tells a client whether it has anything to sync.
+
+    The catalog cursor grows when a media is added, edited or removed (not when
+    its score moves), the user cursor when the caller's collection changes.
+    They are sent as headers too, so a HEAD request is enough.
+    """
+    user = request.user
+    if not user.is_authenticated and request.headers.get('Authorization'):
+        try:
+            authenticated = TokenAuthentication().authenticate(request)
+        except AuthenticationFailed:
+            authenticated = None
+        if authenticated is not None:
+            user = authenticated[0]
+
+    sync = cursors.read(user.pk if user.is_authenticated else None)
+    response = JsonResponse({'status': 'ok', 'build': cursors.build_id(), **sync})
+    response['X-Build-Id'] = cursors.build_id()
+    response['X-Catalog-Cursor'] = sync['catalog']
+    if 'user' in sync:
+        response['X-User-Cursor'] = sync['user']
+    response['Cache-Control'] = 'no-store'
+    if request.method == 'HEAD':
+        response.content = b''
+    return response
+
+async def event_stream(request):
+    """Server-sent events: catalog score changes, plus the user's own collection changes when logged in.
+
+    Under ASGI the stream stays open without holding a thread. A WSGI worker
+    would be held for as long as the client stays connected, so there each
+    response carries only the pending events and EventSource reconnects every
+    MEDIA_LIVE_POLL_SECONDS. Resumes from the Last-Event-ID header, or
+    ?last_event_id= for clients that can't set headers.
+    """
+    if not getattr(settings, 'MEDIA_LIVE_UPDATES', True):
+        raise Http404('Live updates are disabled.')
+
+    user = await request.auser()
+    auth = request.headers.get('Authorization', '')
+    if not user.is_authenticated and auth.startswith('Token '):
+        token = await Token.objects.select_related('user').filter(key=auth[6:].strip()).afirst()
+        if token is not None and token.user.is_active:
+            user = token.user
+
+    channels = {CATALOG}
+    if user.is_authenticated:
+        channels.add(user_channel(user.pk))
+    last_event_id = request.headers.get('Last-Event-ID') or request.GET.get('last_event_id')
+
+    if isinstance(request, ASGIRequest):
+        response = StreamingHttpResponse(broker.stream(channels, last_event_id), content_type='text/event-stream')
+    else:
+        frames = broker.poll(channels, last_event_id, getattr(settings, 'MEDIA_LIVE_POLL_SECONDS', 10))
+        response = HttpResponse(''.join(frames), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAdminUser])
+def metrics(request):
+    return Response({
+        'media_cache': media_cache.stats(),
+    })
+
+def get_cached_media_or_404(media_id):
+    media = media_cache.get(media_id)
+    if media is None:
+        raise Http404('No Media matches the given query.')
+    return media
+
 @login_required
 def rate_media(request, media_id):
-    media = get_object_or_404(Media, id=media_id)
+    media = get_cached_media_or_404(media_id)
     
     if request.method == 'POST':
         score = request.POST.get('score')
@@ -151,16 +263,8 @@ def rate_media(request, media_id):
         else:
             score = None
         
-        # Get or create UserMedia entry
-        user_media, created = UserMedia.objects.get_or_create(
-            user=request.user,
-            media=media,
-            defaults={'score': score}
-        )
-        
-        if not created:
-            user_media.score = score
-            user_media.save()
+        # Creates or updates the entry and the media's average score atomically
+        UserMedia.upsert(request.user, media.id, score=score)
         
         # Redirect back to the previous page
         next_url = request.POST.get('next')
@@ -187,26 +291,15 @@ def rate_media(request, media_id):
 @login_required
 def update_media_state(request, media_id):
     if request.method == 'POST':
-        media = get_object_or_404(Media, id=media_id)
+        media = get_cached_media_or_404(media_id)
         new_state = int(request.POST.get('state', 0))
         
-        # Get or create UserMedia entry
-        user_media, created = UserMedia.objects.get_or_create(
-            user=request.user,
-            media=media,
-            defaults={'state': new_state}
-        )
-        
-        if not created:
-            user_media.state = new_state
-            # If state is changed to CHECK, clear the rating
-            if new_state == UserMedia.MediaState.CHECK:
-                user_media.score = None
-            user_media.save()
-            
-            # If rating was cleared, recalculate media's average score
-            if new_state == UserMedia.MediaState.CHECK:
-                media.calculate_score()
+        values = {'state': new_state}
+        # If state is changed to CHECK, clear the rating
+        if new_state == UserMedia.MediaState.CHECK:
+            values['score'] = None
+        # Creates or updates the entry and the media's average score atomically
+        user_media = UserMedia.upsert(request.user, media.id, **values)
         
         # If this is an AJAX request, return JSON response
         if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
@@ -267,7 +360,7 @@ def create_media(request):
             title = form.cleaned_data['title']
             media_type = form.cleaned_data['media_type']
             
-            if Media.objects.filter(title__iexact=title, media_type=media_type).exists():
+            if Media.find_duplicate(title, media_type):
                 messages.error(request, 'A media with this title and type already exists.')
                 return render(request, 'media/create_media.html', {'form': form})
             
@@ -297,25 +390,139 @@ class MediaViewSet(viewsets.ModelViewSet):
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
+        # Rating stats and the caller's own state/score come from the same query
+        queryset = Media.objects.with_rating_stats(self.request.user)
+
         # Filter media based on user's collection if requested
         user_collection = self.request.query_params.get('user_collection', None)
         if user_collection and self.request.user.is_authenticated:
-            return Media.objects.filter(user_media__user=self.request.user)
-        return Media.objects.all()
+            # Exists() keeps the rating aggregates from joining on the filter
+            return queryset.filter(
+                Exists(UserMedia.objects.filter(user=self.request.user, media=OuterRef('pk')))
+            )
+        return queryset
 
     def perform_create(self, serializer):
-        # Get the title and media_type from the request data
-        title = serializer.validated_data.get('title', '').strip()
-        media_type = serializer.validated_data.get('media_type')
-        
-        # Check for existing media with the same title and type
-        if Media.objects.filter(title__iexact=title, media_type=media_type).exists():
-            raise serializers.ValidationError({
-                'title': f'A {media_type} with this exact title already exists. Please check if it\'s the same media.'
-            })
-        
-        # If no duplicate found, save the media
-        serializer.save()
+        # Duplicate titles are rejected by MediaSerializer.validate
+        self._save_unique(serializer)
+
+    def perform_update(self, serializer):
+        self._save_unique(serializer)
+
+    def _save_unique(self, serializer):
+        """Save, turning a lost race on the normalized title constraint into a 400"""
+        try:
+            with transaction.atomic():
+                serializer.save()
+        except IntegrityError:
+            raise serializers.ValidationError({'title': 'A media of this type with this exact title already exists.'})
+
+    @action(detail=True, methods=['get'])
+    def trend(self, request, pk=None):
+        """Daily ratings and state transitions of one media, read from the rollups only"""
+        rows = MediaDailyStats.objects.filter(media_id=pk, day__gte=self._trend_start(request))
+        return Response(self._trend_rows(rows))
+
+    @action(detail=False, methods=['get'], url_path='trend')
+    def type_trend(self, request):
+        """Daily ratings and state transitions per media type, read from the rollups only"""
+        rows = MediaTypeDailyStats.objects.filter(day__gte=self._trend_start(request))
+        media_type = request.query_params.get('media_type')
+        if media_type:
+            rows = rows.filter(media_type=media_type)
+        return Response(self._trend_rows(rows, 'media_type'))
+
+    def _trend_start(self, request):
+        try:
+            days = min(max(int(request.query_params.get('days', 30)), 1), 366)
+        except ValueError:
+            days = 30
+        return timezone.localdate() - timedelta(days=days - 1)
+
+    def _trend_rows(self, rows, *extra_fields):
+        return [
+            {
+                **row,
+                'average': row['score_sum'] / row['rating_count'] if row['rating_count'] else None,
+            }
+            for row in rows.values('day', *extra_fields, 'rating_count', 'score_sum', 'state_transitions')
+        ]
+
+    @action(detail=False, methods=['get'], url_path='stats')
+    def catalog_stats(self, request):
+        """Counts per media type, rated vs unrated titles and score histograms, from the stats tables"""
+        return Response(stats.snapshot())
+
+    @action(detail=True, methods=['get'])
+    def similar(self, request, pk=None):
+        """Media with similar plot and quotes, precomputed by the build_neighbors command"""
+        try:
+            limit = int(request.query_params.get('limit', 10))
+        except ValueError:
+            return Response({'error': 'limit must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        limit = max(1, min(limit, 50))
+        get_object_or_404(Media.objects.only('pk'), pk=pk)
+        neighbors = MediaNeighbor.objects.filter(media_id=pk).select_related('neighbor').order_by('-score')[:limit]
+        return Response([
+            {**MediaSerializer(neighbor.neighbor).data, 'similarity': round(neighbor.score, 4)}
+            for neighbor in neighbors
+        ])
+
+    BATCH_FIELDS = ['id', 'title', 'media_type', 'url', 'plot', 'chapters', 'quotes', 'score', 'created_at']
+
+    @action(detail=False, methods=['get', 'post'])
+    def batch(self, request):
+        """Media by id, from ?ids=1,2,3 or a POST body {"ids": [...]}, for clients filling gaps in their copy.
+
+        Rows come back in request order as lists of BATCH_FIELDS, without the
+        rating stats; ids that don't exist are listed under "missing".
+        """
+        invalid = Response({'error': 'ids must be a list of integers'}, status=status.HTTP_400_BAD_REQUEST)
+        if request.method == 'POST':
+            if not isinstance(request.data, dict):
+                return invalid
+            raw = request.data.get('ids')
+        else:
+            raw = request.query_params.get('ids')
+        if isinstance(raw, str):
+            raw = [part for part in raw.split(',') if part.strip()]
+        if raw is not None and not isinstance(raw, list):
+            return invalid
+        # int() would turn true into 1 and cut 1.5 down to 1
+        if any(isinstance(value, (bool, float)) for value in raw or []):
+            return invalid
+        try:
+            ids = list(dict.fromkeys(int(value) for value in raw or []))
+        except (TypeError, ValueError):
+            return invalid
+        max_ids = getattr(settings, 'MEDIA_BATCH_MAX_IDS', 5000)
+        if len(ids) > max_ids:
+            return Response({'error': f'At most {max_ids} ids per request'}, status=status.HTTP_400_BAD_REQUEST)
+
+        # One id__in query per chunk, to stay under SQLite's bound parameter limit
+        chunk_size = connection.features.max_query_params or len(ids) or 1
+        rows = {}
+        for start in range(0, len(ids), chunk_size):
+            for row in Media.objects.filter(pk__in=ids[start:start + chunk_size]).values_list(*self.BATCH_FIELDS):
+                rows[row[0]] = row
+        return Response({
+            'fields': self.BATCH_FIELDS,
+            'rows': [rows[media_id] for media_id in ids if media_id in rows],
+            'missing': [media_id for media_id in ids if media_id not in rows],
+        })
+
+    @action(detail=False, methods=['get'])
+    def autocomplete(self, request):
+        """Typeahead over normalized titles, served from the in-memory title index"""
+        media_type = request.query_params.get('media_type') or None
+        if media_type and media_type not in Media.MediaType.values:
+            return Response({'error': 'Unknown media type'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            limit = min(int(request.query_params.get('limit', 10)), 50)
+        except ValueError:
+            limit = 10
+        results = title_index.search(request.query_params.get('q', ''), media_type, limit)
+        return Response(results)
 
 class UserMediaViewSet(viewsets.ModelViewSet):
     serializer_class = UserMediaSerializer
@@ -323,6 +530,22 @@ class UserMediaViewSet(viewsets.ModelViewSet):
     
     def get_queryset(self):
         return UserMedia.objects.filter(user=self.request.user)
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        user_media = list(queryset) if page is None else page
+        # One query for the media the cache doesn't hold instead of one per entry;
+        # serialization only reads them, so the cached objects are shared
+        media = media_cache.get_many((entry.media_id for entry in user_media), readonly=True)
+        # An entry whose media was deleted since the first query went with it
+        user_media = [entry for entry in user_media if entry.media_id in media]
+        for entry in user_media:
+            entry.media = media[entry.media_id]
+        serializer = self.get_serializer(user_media, many=True)
+        if page is not None:
+            return self.get_paginated_response(serializer.data)
+        return Response(serializer.data)
     
     def perform_create(self, serializer):
         serializer.save()
@@ -0,0 +1,72 @@
+import time
+from pathlib import Path
+
+from django.apps import apps
+from django.db import DatabaseError, OperationalError, ProgrammingError, connection
+from django.template.loader import get_template
+from django.urls import resolve, reverse
+
+
+def _import_api_classes():
+    """DRF imports its renderers, parsers and auth classes lazily on the first API request"""
+    from rest_framework.settings import api_settings
+    import corsheaders.middleware  # noqa: F401
+    import rest_framework.authtoken.models  # noqa: F401
+
+    for setting in ('DEFAULT_RENDERER_CLASSES', 'DEFAULT_PARSER_CLASSES',
+                    'DEFAULT_AUTHENTICATION_CLASSES', 'DEFAULT_PERMISSION_CLASSES',
+                    'DEFAULT_CONTENT_NEGOTIATION_CLASS', 'DEFAULT_METADATA_CLASS'):
+        getattr(api_settings, setting)
+
+
+def _build_url_resolver():
+    """Import the URLconfs (including the DefaultRouter routes) and fill the reverse cache"""
+    resolve('/')
+    resolve(reverse('media:media-list'))
+    reverse('media:home')
+
+
+def _compile_templates():
+    """Load every template of the app once so the cached loader keeps the compiled version"""
+    template_dir = Path(apps.get_app_config('media').path) / 'templates'
+    for path in template_dir.rglob('*.html'):
+        get_template(path.relative_to(template_dir).as_posix())
+
+
+def _open_database():
+    """Load the database driver and the schema pages, then close so forked workers start clean.
+
+    Returns False when the database is unreachable or not migrated yet: the worker still
+    starts, and the request that needs the database reports the error instead.
+    """
+    from .models import Media
+
+    try:
+        Media.objects.exists()
+    except (OperationalError, ProgrammingError):
+        return False
+    finally:
+        try:
+            connection.close()
+        except DatabaseError:
+            pass
+    return True
+
+
+def warm_up():
+    """Pay a worker's cold-start costs before its first request, returns seconds spent per step.
+
+    Steps that had to be skipped (see _open_database) are left out of the result.
+    """
+    timings = {}
+    for name, step in (
+        ('imports', _import_api_classes),
+        ('url_resolver', _build_url_resolver),
+        ('templates', _compile_templates),
+        ('database', _open_database),
+    ):
+        started = time.perf_counter()
+        if step() is False:
+            continue
+        timings[name] = time.perf_counter() - started
+    return timings
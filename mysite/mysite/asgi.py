@@ -9,8 +9,14 @@ https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
 
 import os
 
+from django.conf import settings
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mysite.settings')
 
 application = get_asgi_application()
+
+# Pay the cold-start costs (imports, URL resolver, templates, database) before the first request
+if settings.MEDIA_WARMUP:
+    from media.warmup import warm_up
+    warm_up()
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -44,12 +45,15 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'media.middleware.ServerTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'media.middleware.SlowQueryLogMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'media.middleware.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -58,7 +62,7 @@ ROOT_URLCONF = 'mysite.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'media.timing.TimedDjangoTemplates',  # DjangoTemplates, timed for Server-Timing
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -82,6 +86,12 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # Take the write lock when a transaction starts so read-then-write
+            # transactions wait for each other instead of failing with "database is locked"
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
     }
 }
 
@@ -139,6 +149,10 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.AllowAny',  # Allow unauthenticated access to login/register
     ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'media.timing.TimedJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
 }
 
 # CORS settings
@@ -163,3 +177,38 @@ CORS_ALLOW_HEADERS = [
     'x-csrftoken',
     'x-requested-with',
 ]
+
+# Per-request profiling (see media.middleware.ProfilingMiddleware)
+MEDIA_PROFILING_DIR = BASE_DIR / 'profiles'
+MEDIA_PROFILING_SAMPLE_RATE = 0.0  # Share of all requests to profile, e.g. 0.01
+MEDIA_PROFILING_MAX_FILES = 200  # 0 keeps every profile
+
+# Slow-query log (see media.querylog)
+MEDIA_SLOW_QUERY_THRESHOLD_MS = 50
+MEDIA_SLOW_QUERY_FLUSH_SECONDS = 30
+MEDIA_SLOW_QUERY_LOG = BASE_DIR / 'slow_queries.log'
+
+# Warm up new workers in wsgi.py/asgi.py (see media.warmup)
+MEDIA_WARMUP = os.environ.get('MEDIA_WARMUP', '1') == '1'
+
+# UserMedia event log batching (see media.events): written every BATCH_SIZE events, or
+# FLUSH_SECONDS after the first buffered one
+MEDIA_EVENT_BATCH_SIZE = 100
+MEDIA_EVENT_FLUSH_SECONDS = 5
+
+# Per-process Media object cache (see media.cache)
+MEDIA_CACHE_SIZE = 5000
+MEDIA_CACHE_TTL = 30  # Seconds; bounds staleness from writes in other processes
+
+# Server-sent events (see media.live). Streamed under ASGI; under WSGI each /events/
+# response carries the pending events and the browser reconnects every POLL_SECONDS
+MEDIA_LIVE_UPDATES = True
+MEDIA_LIVE_POLL_SECONDS = 10
+MEDIA_LIVE_BACKLOG = 1000  # Events kept for clients resuming with Last-Event-ID
+MEDIA_LIVE_KEEPALIVE_SECONDS = 15
+
+# Server-Timing response header for staff users, or everyone with DEBUG (see media.middleware.ServerTimingMiddleware)
+MEDIA_SERVER_TIMING = os.environ.get('MEDIA_SERVER_TIMING', '0') == '1'
+
+# Batch media fetch, /api/media/batch/
+MEDIA_BATCH_MAX_IDS = 5000